@@ -0,0 +1,196 @@
+"""
+Write-behind ingestion for /api/activity/ping.
+
+Pings are appended to an in-process ring buffer and answered immediately;
+a background flusher writes them out in batches:
+
+- every `flush_ms` milliseconds, or as soon as `flush_rows` pings are
+  waiting, whichever comes first;
+- all buffered pings go into `user_activity` as one multi-row INSERT
+  (executemany, chunks of 1000 rows);
+- `User.lat/lng` updates are coalesced to the latest position per user and
+  applied as one bulk UPDATE by primary key, in the same transaction.
+
+The buffer is bounded (`capacity`); when the database falls behind, the
+oldest pings are dropped and counted instead of growing memory without
+limit. `stats()` reports queue depth and flush latency.
+
+scripts/load_test_activity_ping.py compares sustained pings/sec against
+the old one-commit-per-ping path.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+FLUSH_MS = int(os.getenv("ACTIVITY_FLUSH_MS", "500"))
+FLUSH_ROWS = int(os.getenv("ACTIVITY_FLUSH_ROWS", "500"))
+BUFFER_CAPACITY = int(os.getenv("ACTIVITY_BUFFER_CAPACITY", "50000"))
+INSERT_CHUNK = 1000
+
+
+class ActivityIngestor:
+    def __init__(self, db, activity_model, user_model, context_factory=None,
+                 flush_ms: int = FLUSH_MS, flush_rows: int = FLUSH_ROWS, capacity: int = BUFFER_CAPACITY,
+                 after_flush: Optional[Callable[[Dict[int, Tuple[float, float]]], None]] = None):
+        self.db = db
+        self.activity_model = activity_model
+        self.user_model = user_model
+        self.context_factory = context_factory
+        self.flush_ms = flush_ms
+        self.flush_rows = flush_rows
+        # Called with {user_id: (lat, lng)} after each successful flush, since
+        # the bulk UPDATE bypasses mapper events.
+        self.after_flush = after_flush
+
+        self._buffer: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        self._metrics: Dict[str, float] = {
+            "submitted": 0, "flushed_rows": 0, "flushes": 0, "dropped": 0, "failed_flushes": 0,
+            "max_depth": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+            "last_batch_rows": 0, "user_updates": 0,
+        }
+
+    # ---------- producer side ----------
+
+    def submit(self, user_id: int, lat: Optional[float], lng: Optional[float], activity_type: str = "ping",
+               device_motion: Optional[float] = None, created_at: Optional[datetime] = None) -> datetime:
+        """Buffer one ping; returns its timestamp."""
+        created_at = created_at or datetime.utcnow()
+        row = {
+            "user_id": user_id,
+            "lat": lat,
+            "lng": lng,
+            "activity_type": activity_type,
+            "device_motion": device_motion,
+            "created_at": created_at,
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._metrics["dropped"] += 1
+            self._buffer.append(row)
+            self._metrics["submitted"] += 1
+            depth = len(self._buffer)
+            if depth > self._metrics["max_depth"]:
+                self._metrics["max_depth"] = depth
+        return created_at
+
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    # ---------- flushing ----------
+
+    def due(self) -> bool:
+        depth = len(self._buffer)
+        if depth >= self.flush_rows:
+            return True
+        return depth > 0 and (time.monotonic() - self._last_flush) * 1000.0 >= self.flush_ms
+
+    def flush(self) -> int:
+        """Write every buffered ping now; returns how many rows were written."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._buffer)
+                self._buffer.clear()
+            self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+
+            # Latest position per user wins.
+            latest: Dict[int, Tuple[float, float]] = {}
+            for row in rows:
+                if row["lat"] is not None and row["lng"] is not None:
+                    latest[row["user_id"]] = (row["lat"], row["lng"])
+
+            started = time.perf_counter()
+            try:
+                if self.context_factory is not None:
+                    with self.context_factory():
+                        self._write(rows, latest)
+                else:
+                    self._write(rows, latest)
+            except Exception as e:
+                self._requeue(rows)
+                with self._lock:
+                    self._metrics["failed_flushes"] += 1
+                print(f"[ACTIVITY] Flush of {len(rows)} pings failed, requeued: {e}")
+                return 0
+            duration_ms = (time.perf_counter() - started) * 1000.0
+
+            with self._lock:
+                m = self._metrics
+                m["flushes"] += 1
+                m["flushed_rows"] += len(rows)
+                m["user_updates"] += len(latest)
+                m["last_batch_rows"] = len(rows)
+                m["last_flush_ms"] = duration_ms
+                m["total_flush_ms"] += duration_ms
+                m["max_flush_ms"] = max(m["max_flush_ms"], duration_ms)
+
+            if self.after_flush is not None and latest:
+                try:
+                    self.after_flush(latest)
+                except Exception as e:
+                    print(f"[ACTIVITY] after_flush hook failed: {e}")
+            return len(rows)
+
+    def _write(self, rows: List[dict], latest: Dict[int, Tuple[float, float]]) -> None:
+        from sqlalchemy import insert, update
+
+        session = self.db.session
+        try:
+            for i in range(0, len(rows), INSERT_CHUNK):
+                session.execute(insert(self.activity_model), rows[i:i + INSERT_CHUNK])
+            if latest:
+                session.execute(
+                    update(self.user_model),
+                    [{"id": uid, "lat": lat, "lng": lng} for uid, (lat, lng) in latest.items()],
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            if self.context_factory is not None:
+                self.db.session.remove()
+
+    def _requeue(self, rows: List[dict]) -> None:
+        """Put a failed batch back in front of newer pings (oldest dropped if full)."""
+        with self._lock:
+            room = self._buffer.maxlen - len(self._buffer)
+            keep = rows[-room:] if room > 0 else []
+            self._metrics["dropped"] += len(rows) - len(keep)
+            self._buffer.extendleft(reversed(keep))
+
+    def run_forever(self, sleep: Callable[[float], None] = time.sleep, stop: Optional[threading.Event] = None) -> None:
+        """Flusher loop. `sleep` lets it yield cooperatively (socketio.sleep)."""
+        tick = min(self.flush_ms, 50) / 1000.0
+        print(f"[ACTIVITY] Flusher started (every {self.flush_ms}ms or {self.flush_rows} pings)")
+        while stop is None or not stop.is_set():
+            try:
+                if self.due():
+                    self.flush()
+            except Exception as e:
+                print(f"[ACTIVITY] Flusher loop error: {e}")
+            sleep(tick)
+        self.flush()
+
+    # ---------- metrics ----------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            m = dict(self._metrics)
+            m["queue_depth"] = len(self._buffer)
+            m["capacity"] = self._buffer.maxlen
+        m["avg_flush_ms"] = round(m["total_flush_ms"] / m["flushes"], 2) if m["flushes"] else 0.0
+        m["flush_ms_setting"] = self.flush_ms
+        m["flush_rows_setting"] = self.flush_rows
+        for key in ("last_flush_ms", "max_flush_ms", "total_flush_ms"):
+            m[key] = round(m[key], 2)
+        return m
@@ -0,0 +1,248 @@
+"""
+Retention for the user_activity (radar ping) table.
+
+The radar never looks back more than RADAR_MAX_WINDOW_MIN (3 hours), but
+raw pings used to be kept forever. `run()`:
+
+1. Rolls every complete hour older than the retention window up into
+   user_activity_hourly: per user and hour, the ping count, coordinate and
+   motion sums (so means can be derived) and first/last ping time. An hour
+   is rolled up once; re-runs skip hours that already have summaries.
+2. On Postgres, if user_activity is partitioned by day
+   (user_activity_pYYYYMMDD), drops whole partitions that are past the
+   window and creates the next few days' partitions ahead of time.
+3. Deletes the remaining rolled-up raw rows in batches of `batch_size` ids,
+   one short transaction per batch.
+
+With dry_run=True nothing is written; the result reports what would be
+rolled up, purged and dropped. Results (and running totals) are kept in
+`last_run` / `totals` for the admin stats endpoint.
+
+Scheduled as the recurring "activity_retention" job; run by hand with
+scripts/activity_retention.py.
+"""
+
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+RETENTION_HOURS = int(os.getenv("ACTIVITY_RETENTION_HOURS", "24"))
+# Never purge pings the radar can still ask for (3 hour window).
+MIN_RETENTION_HOURS = 3
+PURGE_BATCH_SIZE = int(os.getenv("ACTIVITY_PURGE_BATCH_SIZE", "5000"))
+# Bound a single run; the next scheduled run picks up where this one stopped.
+MAX_HOURS_PER_RUN = 48
+PARTITION_DAYS_AHEAD = 3
+
+PARTITION_PREFIX = "user_activity_p"
+_PARTITION_RE = re.compile(r"^user_activity_p(\d{8})$")
+
+last_run: Dict[str, Any] = {}
+totals: Dict[str, int] = {"runs": 0, "rolled_up": 0, "purged": 0, "partitions_dropped": 0}
+
+
+def _hour_floor(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def run(db, activity_model, rollup_model, retention_hours: int = RETENTION_HOURS,
+        batch_size: int = PURGE_BATCH_SIZE, dry_run: bool = False, now: Optional[datetime] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    retention_hours = max(MIN_RETENTION_HOURS, int(retention_hours))
+    cutoff = _hour_floor(now - timedelta(hours=retention_hours))
+
+    result: Dict[str, Any] = {
+        "dry_run": dry_run,
+        "cutoff": cutoff.isoformat(),
+        "retention_hours": retention_hours,
+        "hours": 0,
+        "rolled_up": 0,
+        "purged": 0,
+        "batches": 0,
+        "partitions_dropped": [],
+        "partitions_created": [],
+    }
+
+    partitioned = _is_partitioned(db)
+    if partitioned and not dry_run:
+        result["partitions_created"] = _create_partitions(db, now)
+
+    # 1) hourly rollup, oldest first
+    purge_before = _rollup(db, activity_model, rollup_model, cutoff, dry_run, result)
+
+    if purge_before is not None:
+        # 2) whole partitions past the window
+        if partitioned:
+            result["partitions_dropped"] = _drop_partitions(db, purge_before, dry_run)
+        # 3) batched delete of what is left
+        _purge(db, activity_model, purge_before, batch_size, dry_run, result)
+
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    result["finished_at"] = datetime.utcnow().isoformat()
+
+    last_run.clear()
+    last_run.update(result)
+    if not dry_run:
+        totals["runs"] += 1
+        totals["rolled_up"] += result["rolled_up"]
+        totals["purged"] += result["purged"]
+        totals["partitions_dropped"] += len(result["partitions_dropped"])
+
+    verb = "would purge" if dry_run else "purged"
+    print(
+        f"[RETENTION] user_activity before {cutoff:%Y-%m-%d %H:00}: {result['hours']} hours, "
+        f"{result['rolled_up']} hourly rows, {verb} {result['purged']} raw rows in {result['batches']} batches, "
+        f"partitions dropped {result['partitions_dropped']} ({result['elapsed_ms']:.0f}ms)"
+    )
+    return result
+
+
+def _rollup(db, A, R, cutoff, dry_run, result) -> Optional[datetime]:
+    """Roll up complete hours before `cutoff`; returns the end of the last hour handled."""
+    session = db.session
+    hour_end = None
+    cursor = None
+    for _ in range(MAX_HOURS_PER_RUN):
+        q = session.query(func.min(A.created_at)).filter(A.created_at < cutoff)
+        if cursor is not None:
+            q = q.filter(A.created_at >= cursor)
+        oldest = q.scalar()
+        if oldest is None:
+            break
+        hour = _hour_floor(oldest)
+        hour_end = hour + timedelta(hours=1)
+        cursor = hour_end
+        result["hours"] += 1
+
+        if session.query(R.id).filter(R.hour == hour).first() is not None:
+            continue  # rolled up by an earlier run that stopped before purging
+
+        rows = (
+            session.query(
+                A.user_id,
+                func.count(A.id),
+                func.count(A.lat),
+                func.sum(A.lat),
+                func.sum(A.lng),
+                func.count(A.device_motion),
+                func.sum(A.device_motion),
+                func.min(A.created_at),
+                func.max(A.created_at),
+            )
+            .filter(A.created_at >= hour, A.created_at < hour_end)
+            .group_by(A.user_id)
+            .all()
+        )
+        result["rolled_up"] += len(rows)
+        if dry_run:
+            continue
+        session.bulk_insert_mappings(R, [
+            {
+                "user_id": user_id,
+                "hour": hour,
+                "ping_count": pings,
+                "located_count": located,
+                "lat_sum": lat_sum or 0.0,
+                "lng_sum": lng_sum or 0.0,
+                "motion_count": motions,
+                "motion_sum": motion_sum or 0.0,
+                "first_at": first_at,
+                "last_at": last_at,
+            }
+            for user_id, pings, located, lat_sum, lng_sum, motions, motion_sum, first_at, last_at in rows
+        ])
+        session.commit()
+    return hour_end
+
+
+def _purge(db, A, before, batch_size, dry_run, result) -> None:
+    session = db.session
+    if dry_run:
+        result["purged"] += session.query(func.count(A.id)).filter(A.created_at < before).scalar() or 0
+        return
+    while True:
+        ids = [
+            row[0]
+            for row in session.query(A.id).filter(A.created_at < before).order_by(A.created_at).limit(batch_size).all()
+        ]
+        if not ids:
+            break
+        n = session.query(A).filter(A.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+        result["purged"] += n
+        result["batches"] += 1
+
+
+# ---------- Postgres daily partitions ----------
+
+def _is_partitioned(db) -> bool:
+    if db.engine.dialect.name != "postgresql":
+        return False
+    try:
+        return db.session.execute(db.text(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = 'user_activity'"
+        )).first() is not None
+    except Exception as e:
+        db.session.rollback()
+        print(f"[RETENTION] Could not inspect partitions: {e}")
+        return False
+
+
+def _partitions(db) -> List[str]:
+    rows = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'user_activity'"
+    )).all()
+    return [r[0] for r in rows]
+
+
+def partition_ddl(day: datetime) -> str:
+    start = day.strftime("%Y-%m-%d")
+    end = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+    return (
+        f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{day:%Y%m%d} PARTITION OF user_activity "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def _create_partitions(db, now: datetime) -> List[str]:
+    existing = set(_partitions(db))
+    created = []
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(PARTITION_DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        name = f"{PARTITION_PREFIX}{day:%Y%m%d}"
+        if name in existing:
+            continue
+        try:
+            db.session.execute(db.text(partition_ddl(day)))
+            db.session.commit()
+            created.append(name)
+        except Exception as e:
+            # e.g. the default partition already holds rows for that day
+            db.session.rollback()
+            print(f"[RETENTION] Could not create partition {name}: {e}")
+    return created
+
+
+def _drop_partitions(db, before: datetime, dry_run: bool) -> List[str]:
+    dropped = []
+    for name in sorted(_partitions(db)):
+        m = _PARTITION_RE.match(name)
+        if not m:
+            continue
+        day_end = datetime.strptime(m.group(1), "%Y%m%d") + timedelta(days=1)
+        if day_end > before:
+            continue
+        if not dry_run:
+            db.session.execute(db.text(f"DROP TABLE IF EXISTS {name}"))
+            db.session.commit()
+        dropped.append(name)
+    return dropped
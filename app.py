@@ -9,29 +9,48 @@ except Exception:
     pass
 
 from datetime import datetime, timedelta
+import atexit
 import base64
 import json
 import os
-import math
 import time
 import random
 import string
-import requests
 
 from reputation_service import analyze_review_quality, calculate_reputation_points
 from smart_suggestion_service import (
-    SmartSuggestionService, WeatherService, LocationMatcher, DemandAnalyzer
+    SmartSuggestionService, WeatherService, LocationMatcher, DemandAnalyzer, SUGGESTION_RADIUS_KM
 )
-from sqlalchemy import func
+from sqlalchemy import func, event, or_, and_, insert
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from collections import namedtuple
 from flask_cors import CORS
 
+import geo
+import geo_index
+import distance_provider
+import job_queue
+from activity_ingest import ActivityIngestor
+import activity_retention
+import radar_service
+import request_feed
+import event_bus
+import backplane
+import presence
+import cluster
+import attachments
+from fcm_dispatcher import FCMDispatcher
+
 from flask import (
     Flask, render_template, request,
-    redirect, url_for, session, flash, jsonify
+    redirect, url_for, session, flash, jsonify, g, has_request_context,
+    abort, send_file,
 )
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename 
+from werkzeug.local import LocalProxy
 from flask_migrate import Migrate
 
 from flask_mail import Mail, Message
@@ -176,14 +195,42 @@ db = SQLAlchemy(app)
 jwt = JWTManager(app)
 migrate = Migrate(app, db)
 
-# Socket.IO for real-time chat (eventlet will be auto-detected)
+# Socket.IO for real-time chat (eventlet will be auto-detected).
+# SOCKETIO_MESSAGE_QUEUE (redis://, amqp://, local://host:port, see
+# backplane.py) shares rooms and presence between several web workers.
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "").strip() or None
+# Set by worker.py: that process only emits, through the queue.
+SOCKETIO_WRITE_ONLY = os.getenv("SOCKETIO_WRITE_ONLY", "0").strip() == "1"
+SOCKETIO_TRANSPORTS = [
+    t.strip() for t in os.getenv("SOCKETIO_TRANSPORTS", "websocket,polling").split(",") if t.strip()
+]
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
     ping_timeout=60,
     ping_interval=25,
-    max_http_buffer_size=100000000  # 100MB for file uploads
+    # Attachments are uploaded over HTTP (attachments.py); socket events stay small.
+    max_http_buffer_size=int(os.getenv("SOCKETIO_MAX_BUFFER_BYTES", str(1024 * 1024))),
+    **backplane.socketio_options(
+        SOCKETIO_MESSAGE_QUEUE,
+        channel=os.getenv("SOCKETIO_CHANNEL", backplane.DEFAULT_CHANNEL),
+        write_only=SOCKETIO_WRITE_ONLY,
+    ),
+)
+SHARED_STORE_URL = os.getenv("PRESENCE_URL", "").strip() or SOCKETIO_MESSAGE_QUEUE
+online_presence = presence.presence_for_url(SHARED_STORE_URL)
+# Caches and snapshots kept in step between workers through the same store
+# (cluster.py); the handlers are registered further down.
+peers = cluster.cluster_for_url(
+    SHARED_STORE_URL,
+    channel=os.getenv("SOCKETIO_CHANNEL", backplane.DEFAULT_CHANNEL) + "-cluster",
+    context_factory=app.app_context,
 )
+if int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1 and not peers.shared:
+    raise RuntimeError(
+        "WEB_CONCURRENCY > 1 needs SOCKETIO_MESSAGE_QUEUE (or PRESENCE_URL) set to a redis:// or "
+        "local:// URL: the live feed, geo index, radar and user caches are per worker otherwise"
+    )
 
 # --- Email / OTP mail config ---
 app.config["MAIL_SERVER"] = "smtp.gmail.com"
@@ -318,6 +365,8 @@ class Request(db.Model):
     # location / meta
     lat = db.Column(db.Float, nullable=True)
     lng = db.Column(db.Float, nullable=True)
+    # geohash of (lat, lng); kept in sync by the before_insert/update hooks below
+    geohash = db.Column(db.String(12), nullable=True, index=True)
     area = db.Column(db.String(150), nullable=True)         # e.g. Mohammadpur, Iqbal Road
     landmark = db.Column(db.String(150), nullable=True)     # nearest mosque / school
 
@@ -343,6 +392,26 @@ class Request(db.Model):
 
     status = db.Column(db.String(20), default="open")  # open / claimed / closed
 
+    # Shaped after the hot feeds/counters (need_help, can_help, list_requests,
+    # dashboard, api_home_summary); test_query_plans.py checks they are used.
+    __table_args__ = (
+        db.Index("ix_requests_status_offer_created", "status", "is_offer", "created_at"),
+        db.Index("ix_requests_status_expires", "status", "expires_at"),
+        db.Index("ix_requests_offer_expires", "is_offer", "expires_at"),
+        db.Index("ix_requests_expires_category", "expires_at", "category"),
+        db.Index("ix_requests_user_created", "user_id", "created_at"),
+        db.Index("ix_requests_helper_status", "helper_id", "status"),
+        # Postgres only: small partial indexes over just the open requests.
+        db.Index(
+            "ix_requests_open_offer_created", "is_offer", db.text("created_at DESC"),
+            postgresql_where=db.text("status = 'open'"),
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "ix_requests_open_expires", "expires_at",
+            postgresql_where=db.text("status = 'open'"),
+        ).ddl_if(dialect="postgresql"),
+    )
+
     user = db.relationship("User",backref="requests",foreign_keys=[user_id])   # tell SQLAlchemy exactly which FK is for "user"
     helper = db.relationship("User",foreign_keys=[helper_id],backref="helped_requests")
 
@@ -387,6 +456,253 @@ class Request(db.Model):
         return d
 
 
+@event.listens_for(Request, "before_insert")
+@event.listens_for(Request, "before_update")
+def _sync_request_geohash(mapper, connection, target):
+    """Keep Request.geohash in sync with lat/lng on every write."""
+    if target.lat is None or target.lng is None:
+        target.geohash = None
+        return
+    try:
+        target.geohash = geo.encode_geohash(target.lat, target.lng)
+    except (TypeError, ValueError):
+        target.geohash = None
+
+
+def filter_requests_near(q, center_lat, center_lng, radius_km, include_unlocated=False):
+    """
+    Narrow a Request query to rows that can be within `radius_km`.
+
+    Prefers the in-memory geo_index (which only holds open, unexpired
+    requests, so this is meant for "open" queries). Falls back to the indexed
+    geohash column (3x3 covering cells) plus a lat/lng bounding box. Callers
+    still run the exact haversine check on the result.
+    """
+    ids = geo_index.candidate_ids(center_lat, center_lng, radius_km, kind="request")
+    if ids is not None:
+        if include_unlocated:
+            return q.filter(or_(Request.lat.is_(None), Request.lng.is_(None), Request.id.in_(ids)))
+        return q.filter(Request.id.in_(ids))
+
+    min_lat, max_lat, min_lng, max_lng = geo.bounding_box(center_lat, center_lng, radius_km)
+    conds = [Request.lat.isnot(None), Request.lng.isnot(None), Request.lat.between(min_lat, max_lat)]
+    if min_lng is not None:
+        conds.append(Request.lng.between(min_lng, max_lng))
+
+    cells = geo.covering_cells(center_lat, center_lng, radius_km)
+    if cells:
+        conds.append(or_(*[Request.geohash.between(*geo.geohash_range(c)) for c in cells]))
+
+    spatial = and_(*conds)
+    if include_unlocated:
+        return q.filter(or_(Request.lat.is_(None), Request.lng.is_(None), spatial))
+    return q.filter(spatial)
+
+
+# ------------------ HOT REQUEST QUERIES ------------------
+# The statements behind need_help, can_help, list_requests, the nearby APIs,
+# dashboard and api_home_summary. Views execute these as they are, and
+# test_query_plans.py checks the same statements against the indexes.
+
+def live_requests_select(now):
+    """Open, unexpired requests (unordered)."""
+    return db.select(Request).where(Request.expires_at > now, Request.status == "open")
+
+
+def open_posts_select(now, is_offer=None):
+    """Open, unexpired posts newest first; is_offer=None means both kinds."""
+    stmt = live_requests_select(now)
+    if is_offer is not None:
+        stmt = stmt.where(Request.is_offer == bool(is_offer))
+    return stmt.order_by(Request.created_at.desc())
+
+
+def posts_count_select(now, is_offer):
+    """Unexpired posts of one kind, any status (the need/offer totals)."""
+    return db.select(func.count(Request.id)).where(Request.is_offer == bool(is_offer), Request.expires_at > now)
+
+
+def category_counts_select(now):
+    return (
+        db.select(Request.category, func.count(Request.id))
+        .where(Request.expires_at > now)
+        .group_by(Request.category)
+    )
+
+
+def requests_nearby_select(now, lat, lng, radius_km, created_after):
+    """Live requests posted since `created_after` that can be within the radius."""
+    stmt = live_requests_select(now).where(Request.created_at >= created_after)
+    return filter_requests_near(stmt, lat, lng, radius_km)
+
+
+def requests_search_select(now, lat=None, lng=None, radius_km=5.0, category=None, include_offers=True):
+    """Live requests for the list API; with a location, nearby or unlocated ones."""
+    stmt = live_requests_select(now)
+    if category:
+        stmt = stmt.where(func.lower(Request.category) == category.lower())
+    if not include_offers:
+        stmt = stmt.where(Request.is_offer == False)  # noqa: E712
+    if lat is not None and lng is not None:
+        stmt = filter_requests_near(stmt, lat, lng, radius_km, include_unlocated=True)
+    return stmt
+
+
+def user_active_posts_select(user_id):
+    return (
+        db.select(Request)
+        .where(Request.user_id == user_id, Request.status.in_(["open", "in_progress", "claimed"]))
+        .order_by(Request.created_at.desc())
+    )
+
+
+def user_expired_unanswered_candidates_select(user_id, now, limit=200):
+    """The user's expired posts nobody was assigned to (responses checked by the caller)."""
+    return (
+        db.select(Request)
+        .where(Request.user_id == user_id, Request.expires_at <= now, Request.helper_id == None)  # noqa: E711
+        .order_by(Request.created_at.desc())
+        .limit(limit)
+    )
+
+
+def helper_engagements_select(user_id):
+    return (
+        db.select(Request)
+        .where(Request.helper_id == user_id, Request.status.in_(["in_progress", "claimed"]))
+        .order_by(Request.created_at.desc())
+    )
+
+
+def open_requests_count_select(now):
+    return db.select(func.count(Request.id)).where(Request.status == "open", Request.expires_at > now)
+
+
+def matched_requests_count_select():
+    return db.select(func.count(Request.id)).where(Request.status.in_(["claimed", "closed"]))
+
+
+def _index_request(mapper, connection, target):
+    live = (
+        target.status == "open"
+        and target.completed_at is None
+        and target.expires_at is not None
+        and target.expires_at > datetime.utcnow()
+    )
+    if live:
+        geo_index.upsert("request", target.id, target.lat, target.lng, expires_at=target.expires_at)
+    else:
+        geo_index.remove("request", target.id)
+
+
+def _unindex_request(mapper, connection, target):
+    geo_index.remove("request", target.id)
+
+
+event.listen(Request, "after_insert", _index_request)
+event.listen(Request, "after_update", _index_request)
+event.listen(Request, "after_delete", _unindex_request)
+
+
+def _load_request_points():
+    now = datetime.utcnow()
+    return (
+        db.session.query(Request.id, Request.lat, Request.lng, Request.expires_at)
+        .filter(
+            Request.status == "open",
+            Request.expires_at > now,
+            Request.completed_at.is_(None),
+            Request.lat.isnot(None),
+            Request.lng.isnot(None),
+        )
+        .all()
+    )
+
+
+geo_index.register_loader("request", _load_request_points)
+
+
+# Live-requests feed (request_feed.py): stage each written request on the
+# session and hand the batch to the feed only once the transaction commits.
+def _stage_feed_request(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is None:
+        return
+    row = None
+    if request_feed.is_live(target):
+        name = request_feed.feed.user_name(target.user_id)
+        if name is None and target.user_id is not None:
+            name = connection.execute(
+                db.select(User.name).where(User.id == target.user_id)
+            ).scalar()
+        row = request_feed.compact_row(target, name)
+    session.info.setdefault("feed_changes", {})[target.id] = row
+
+
+def _stage_feed_request_delete(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        session.info.setdefault("feed_changes", {})[target.id] = None
+
+
+event.listen(Request, "after_insert", _stage_feed_request)
+event.listen(Request, "after_update", _stage_feed_request)
+event.listen(Request, "after_delete", _stage_feed_request_delete)
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_feed_changes(session):
+    changes = session.info.pop("feed_changes", None)
+    if changes:
+        request_feed.feed.apply(changes)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_feed_changes(session):
+    session.info.pop("feed_changes", None)
+
+
+def _load_feed_requests():
+    now = datetime.utcnow()
+    return (
+        db.session.query(Request, User.name)
+        .outerjoin(User, User.id == Request.user_id)
+        .filter(
+            Request.status == "open",
+            Request.expires_at > now,
+            Request.completed_at.is_(None),
+            Request.lat.isnot(None),
+            Request.lng.isnot(None),
+        )
+        .all()
+    )
+
+
+request_feed.feed.register_loader(_load_feed_requests)
+
+
+def backfill_request_geohashes(batch_size=500):
+    """Fill Request.geohash for rows written before the column existed."""
+    updated = 0
+    while True:
+        rows = (
+            Request.query.filter(
+                Request.geohash.is_(None),
+                Request.lat.isnot(None),
+                Request.lng.isnot(None),
+            )
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for r in rows:
+            r.geohash = geo.encode_geohash(r.lat, r.lng)
+        db.session.commit()
+        updated += len(rows)
+    return updated
+
+
 
 # ------------------ MODEL: Impact Story ------------------
 class ImpactStory(db.Model):
@@ -446,6 +762,79 @@ class UserActivity(db.Model):
         }
 
 
+# Hourly per-user summary of user_activity rows past the retention window
+# (see activity_retention.py). Sums rather than means so rows can be merged.
+class UserActivityHourly(db.Model):
+    __tablename__ = "user_activity_hourly"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    hour = db.Column(db.DateTime, nullable=False, index=True)   # start of the hour (UTC)
+    ping_count = db.Column(db.Integer, nullable=False, default=0)
+    located_count = db.Column(db.Integer, nullable=False, default=0)
+    lat_sum = db.Column(db.Float, nullable=False, default=0.0)
+    lng_sum = db.Column(db.Float, nullable=False, default=0.0)
+    motion_count = db.Column(db.Integer, nullable=False, default=0)
+    motion_sum = db.Column(db.Float, nullable=False, default=0.0)
+    first_at = db.Column(db.DateTime, nullable=True)
+    last_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "hour", name="uq_user_activity_hourly_user_hour"),
+    )
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "hour": self.hour.isoformat() if self.hour else None,
+            "ping_count": self.ping_count,
+            "avg_lat": (self.lat_sum / self.located_count) if self.located_count else None,
+            "avg_lng": (self.lng_sum / self.located_count) if self.located_count else None,
+            "avg_motion": (self.motion_sum / self.motion_count) if self.motion_count else None,
+        }
+
+
+def _load_radar_pings():
+    cutoff = datetime.utcnow() - timedelta(minutes=radar_service.RADAR_MAX_WINDOW_MIN)
+    return (
+        db.session.query(
+            UserActivity.user_id, User.name, User.is_trusted_helper,
+            UserActivity.lat, UserActivity.lng, UserActivity.device_motion, UserActivity.created_at,
+        )
+        .join(User, User.id == UserActivity.user_id)
+        .filter(UserActivity.created_at >= cutoff)
+        .order_by(UserActivity.created_at)
+        .all()
+    )
+
+
+radar_service.radar.register_loader(_load_radar_pings)
+
+
+def _index_user(mapper, connection, target):
+    geo_index.upsert("user", target.id, target.lat, target.lng)
+    radar_service.radar.update_user(target.id, name=target.name, is_helper=target.is_trusted_helper)
+    request_feed.feed.rename_user(target.id, target.name)
+
+
+def _unindex_user(mapper, connection, target):
+    geo_index.remove("user", target.id)
+
+
+event.listen(User, "after_insert", _index_user)
+event.listen(User, "after_update", _index_user)
+event.listen(User, "after_delete", _unindex_user)
+
+
+def _load_user_points():
+    return (
+        db.session.query(User.id, User.lat, User.lng)
+        .filter(User.lat.isnot(None), User.lng.isnot(None))
+        .all()
+    )
+
+
+geo_index.register_loader("user", _load_user_points)
 
 
 def get_trusted_helpers_for_ping(sender_id):
@@ -492,64 +881,27 @@ def send_fcm_to_user(target_user, title, body, data=None):
     Accepts:
       - target_user as a User object OR an int user_id
     """
-    if not firebase_admin._apps:
-        print("[FCM] Firebase not initialized, cannot send notification.")
-        return False
-
     # Allow caller to pass user_id (int) or User object
     try:
-        if isinstance(target_user, int):
-            target_user = User.query.get(target_user)
-        elif isinstance(target_user, str) and target_user.isdigit():
-            target_user = User.query.get(int(target_user))
+        if isinstance(target_user, str) and target_user.isdigit():
+            target_user = int(target_user)
+        user_id = _user_id_of(target_user) if target_user is not None else None
     except Exception as e:
         print("[FCM] Invalid target_user provided:", e)
         return False
 
-    if not target_user:
+    if user_id is None:
         print("[FCM] Target user not found.")
         return False
 
-    tokens = [t.token for t in target_user.fcm_tokens.all()]
-    if not tokens:
-        print(f"[FCM] User {target_user.id} has no FCM tokens registered.")
-        return False
-
-    # Ensure data is string:string
-    data_payload = {k: str(v) for k, v in (data or {}).items()}
-
-    message = messaging.MulticastMessage(
-        notification=messaging.Notification(title=title, body=body),
-        data=data_payload,
-        tokens=tokens,
-        android=messaging.AndroidConfig(priority="high"),
-        apns=messaging.APNSConfig(headers={"apns-priority": "10"}),
-    )
-
     try:
-        response = messaging.send_multicast(message)
-
-        # Cleanup invalid tokens
-        if response.failure_count > 0:
-            bad_tokens = []
-            for idx, resp in enumerate(response.responses):
-                if not resp.success:
-                    # resp.exception can be None; guard it
-                    code = getattr(getattr(resp, "exception", None), "code", None)
-                    if code in ("INVALID_ARGUMENT", "UNREGISTERED"):
-                        bad_tokens.append(tokens[idx])
-
-            if bad_tokens:
-                FCMToken.query.filter(FCMToken.token.in_(bad_tokens)).delete(synchronize_session=False)
-                db.session.commit()
-                print(f"[FCM] Cleaned up {len(bad_tokens)} expired tokens for user {target_user.id}.")
-
-        print(f"[FCM] Multicast sent: Success={response.success_count}, Failures={response.failure_count}")
-        return response.success_count > 0
-
+        result = fcm_dispatcher.send([user_id], title=title, body=body, data=data)
     except Exception as e:
         print(f"[FCM] Error sending multicast: {e}")
         return False
+    if result.tokens == 0:
+        print(f"[FCM] User {user_id} has no FCM tokens registered.")
+    return result.success > 0
 
 
 def send_fcm_to_trusted_helpers(title, body, data=None, exclude_user_id=None):
@@ -559,16 +911,9 @@ def send_fcm_to_trusted_helpers(title, body, data=None, exclude_user_id=None):
         if exclude_user_id is not None:
             q = q.filter(User.id != exclude_user_id)
 
-        sent = 0
-        for helper in q.all():
-            try:
-                if helper.fcm_tokens.count() > 0:
-                    if send_fcm_to_user(helper, title=title, body=body, data=data):
-                        sent += 1
-            except Exception:
-                continue
-
-        return sent
+        helper_ids = [uid for (uid,) in q.with_entities(User.id).all()]
+        result = fcm_dispatcher.send(helper_ids, title=title, body=body, data=data)
+        return len(result.delivered_user_ids)
     except Exception as e:
         print("[FCM] Error in send_fcm_to_trusted_helpers:", e)
         return 0
@@ -599,51 +944,86 @@ def send_fcm_for_emotional_chat(listener, from_user):
         print(f"[FCM] Error in send_fcm_for_emotional_chat: {e}")
 
 
-def send_fcm_for_need_request(req_obj):
+# Recipients per bell / push job of a need-request fan-out: a failed job is
+# retried on its own, so at most one chunk can be alerted twice.
+NEED_FANOUT_CHUNK = int(os.getenv("NEED_FANOUT_CHUNK", "500"))
+
+
+def _users_near_need_request(req_obj, radius_km=5.0):
+    """[(user_id, distance_km), ...] for users with a location inside the radius."""
+    if req_obj.lat is None or req_obj.lng is None:
+        return []
+
+    q = User.query.filter(User.id != req_obj.user_id)
+    candidates = geo_index.filter_query(q, User, "user", req_obj.lat, req_obj.lng, radius_km).all()
+
+    dists = geo.distances_km(
+        req_obj.lat, req_obj.lng, [u.lat for u in candidates], [u.lng for u in candidates]
+    )
+    return [(_user_id_of(u), float(dist)) for u, dist in zip(candidates, dists) if dist <= radius_km]
+
+
+def fan_out_need_request(req_obj):
     """
-    Notify users nearby AND save to database for the bell icon stack.
+    Plan all notifications for a new need-help post: nearby users (bell +
+    push) first, then a push to every trusted helper not already alerted.
+    The sending is queued as per-chunk jobs in one transaction, so a retry
+    (of this job or of a chunk) never alerts a whole audience again. Runs
+    from the job queue, not the request.
     """
-    try:
-        # FIX: Get ALL users with location (removed fcm_token filter)
-        candidates = User.query.filter(
-            User.lat.isnot(None),
-            User.lng.isnot(None),
-            User.id != req_obj.user_id 
-        ).all()
+    print(f"[FCM] Trigger nearby helpers for req {req_obj.id}")
+    nearby = _users_near_need_request(req_obj)
+    notified = {uid for uid, _ in nearby}
+
+    q = User.query.filter(User.is_trusted_helper == True, User.id != req_obj.user_id)  # noqa: E712
+    helper_ids = [uid for (uid,) in q.with_entities(User.id).order_by(User.id) if uid not in notified]
+
+    jobs = 0
+    for i in range(0, len(nearby), NEED_FANOUT_CHUNK):
+        chunk = nearby[i:i + NEED_FANOUT_CHUNK]
+        job_queue.enqueue("need_request_bells", {"request_id": req_obj.id, "user_ids": [uid for uid, _ in chunk]},
+                          commit=False)
+        job_queue.enqueue("need_request_push", {"request_id": req_obj.id, "nearby": chunk}, commit=False)
+        jobs += 2
+    for i in range(0, len(helper_ids), NEED_FANOUT_CHUNK):
+        job_queue.enqueue("need_request_push", {"request_id": req_obj.id, "helpers": helper_ids[i:i + NEED_FANOUT_CHUNK]},
+                          commit=False)
+        jobs += 1
+    db.session.commit()
+    print(f"[FCM] Queued {jobs} alert jobs for {len(notified)} nearby users and {len(helper_ids)} helpers.")
 
-        count = 0
-        radius_km = 5.0 
-
-        for u in candidates:
-            dist = haversine_distance_km(req_obj.lat, req_obj.lng, u.lat, u.lng)
-            
-            if dist <= radius_km:
-                title = f"Help needed nearby ({round(dist, 1)}km)"
-                body = f"{req_obj.user.name} needs help with {req_obj.category}: {req_obj.title}"
-                
-                # 1. SAVE TO DB (Always do this for the Bell Icon)
-                push_notification(
-                    user_id=u.id,
-                    type="nearby",
-                    message=body,
-                    link=url_for('list_requests') 
-                )
 
-                # 2. Send Mobile Push (Only if they have a token)
-                if u.fcm_tokens.count() > 0:
-                    send_fcm_to_user(
-                        u, 
-                        title=title, 
-                        body=body,
-                        data={"type": "NEARBY_REQUEST", "request_id": str(req_obj.id)}
-                    )
-                
-                count += 1
-        
-        print(f"[FCM] Saved nearby alerts for {count} users.")
+def send_need_request_bells(req_obj, user_ids):
+    """Bell notifications for one chunk of nearby users. Raises if nothing was written, so the job retries."""
+    body = f"{req_obj.user.name} needs help with {req_obj.category}: {req_obj.title}"
+    if user_ids and not push_notifications_bulk(user_ids, type="nearby", message=body, link=url_for('list_requests')):
+        raise RuntimeError(f"bell notifications for request {req_obj.id} were not saved")
+    print(f"[FCM] Saved nearby alerts for {len(user_ids)} users.")
 
-    except Exception as e:
-        print(f"[FCM] Error in send_fcm_for_need_request: {e}")
+
+def send_need_request_push(req_obj, nearby=(), helper_ids=()):
+    """
+    Mobile pushes for one chunk: nearby users get the distance, other trusted
+    helpers the general broadcast. Errors propagate so the job retries.
+    """
+    if nearby:
+        body = f"{req_obj.user.name} needs help with {req_obj.category}: {req_obj.title}"
+        data = {"type": "NEARBY_REQUEST", "request_id": str(req_obj.id)}
+        fcm_dispatcher.send_many(
+            ([int(uid)], f"Help needed nearby ({round(float(dist), 1)}km)", body, data)
+            for uid, dist in nearby
+        )
+    if helper_ids:
+        fcm_dispatcher.send(
+            helper_ids,
+            title="Someone nearby needs help",
+            body=f"{req_obj.user.name} posted: “{req_obj.title}” (category: {req_obj.category})",
+            data={
+                "type": "NEED_HELP",
+                "request_id": req_obj.id,
+                "category": req_obj.category,
+            },
+        )
 
 
 def send_fcm_for_sos(from_user):
@@ -653,21 +1033,19 @@ def send_fcm_for_sos(from_user):
             User.id != from_user.id
         ).all()
 
-        for h in helpers:
-            push_notification(
-                user_id=h.id,
-                type="sos",
-                message=f"🚨 SOS: {from_user.name} needs immediate help!",
-                link=url_for("chat_with_user", other_user_id=from_user.id)
-            )
+        push_notifications_bulk(
+            helpers,
+            type="sos",
+            message=f"🚨 SOS: {from_user.name} needs immediate help!",
+            link=url_for("chat_with_user", other_user_id=from_user.id)
+        )
 
-            if h.fcm_tokens.count() > 0:
-                send_fcm_to_user(
-                    h,
-                    title="🚨 SOS ALERT!",
-                    body=f"EMERGENCY: {from_user.name} needs help!",
-                    data={"type": "SOS_ALERT", "from_user_id": str(from_user.id)}
-                )
+        fcm_dispatcher.send(
+            [_user_id_of(h) for h in helpers],
+            title="🚨 SOS ALERT!",
+            body=f"EMERGENCY: {from_user.name} needs help!",
+            data={"type": "SOS_ALERT", "from_user_id": str(from_user.id)}
+        )
 
         return True
     except Exception as e:
@@ -675,24 +1053,139 @@ def send_fcm_for_sos(from_user):
         return False
 
 
-def get_trusted_helpers_within_radius_km(center_lat, center_lng, radius_km, exclude_user_id=None):
+def _trusted_helpers_with_distance(center_lat, center_lng, radius_km, exclude_user_id=None):
+    """[(helper, distance_km), ...] within radius_km, nearest first."""
     q = User.query.filter(User.is_trusted_helper == True)  # noqa: E712
     if exclude_user_id is not None:
         q = q.filter(User.id != exclude_user_id)
 
-    q = q.filter(User.lat.isnot(None), User.lng.isnot(None))
+    q = geo_index.filter_query(q, User, "user", center_lat, center_lng, radius_km)
 
-    results = []
-    for h in q.all():
-        try:
-            dist = haversine_distance_km(center_lat, center_lng, h.lat, h.lng)
-        except Exception:
-            continue
-        if dist <= radius_km:
-            results.append((h, dist))
+    helpers = q.all()
+    dists = geo.distances_km(center_lat, center_lng, [h.lat for h in helpers], [h.lng for h in helpers])
+    results = [(h, float(dist)) for h, dist in zip(helpers, dists) if dist <= radius_km]
 
     results.sort(key=lambda t: t[1])
-    return [h for h, _ in results]
+    return results
+
+
+def get_trusted_helpers_within_radius_km(center_lat, center_lng, radius_km, exclude_user_id=None):
+    return [h for h, _ in _trusted_helpers_with_distance(center_lat, center_lng, radius_km, exclude_user_id)]
+
+
+# SOS goes to the nearest helpers first and widens only if nobody responds.
+# None = every remaining trusted helper (including those without a location).
+SOS_RINGS_KM = [1.0, 3.0, 10.0, None]
+SOS_RING_ESCALATE_SECONDS = int(os.getenv("SOS_RING_ESCALATE_SECONDS", "60"))
+
+
+def _sos_still_unanswered(sos_req):
+    if sos_req is None or sos_req.status != "open":
+        return False
+    if sos_req.expires_at is not None and sos_req.expires_at <= datetime.utcnow():
+        return False
+    return SOSResponse.query.filter_by(request_id=sos_req.id).first() is None
+
+
+def dispatch_sos_ring(sos_req, ring):
+    """
+    Notify the helpers in ring `ring` of SOS_RINGS_KM (those farther than the
+    previous ring's radius), record it, and schedule the next ring. Empty
+    rings escalate immediately.
+    """
+    while ring < len(SOS_RINGS_KM):
+        started = time.perf_counter()
+        radius_km = SOS_RINGS_KM[ring]
+        inner_km = SOS_RINGS_KM[ring - 1] if ring > 0 else None
+        owner = db.session.get(User, sos_req.user_id)
+        owner_name = owner.name if owner else "Someone"
+
+        if radius_km is not None:
+            pairs = _trusted_helpers_with_distance(sos_req.lat, sos_req.lng, radius_km, exclude_user_id=sos_req.user_id)
+            helper_ids = [_user_id_of(h) for h, dist in pairs if inner_km is None or dist > inner_km]
+        else:
+            # Everyone not already covered by the last bounded ring.
+            covered = set()
+            if inner_km is not None:
+                covered = {
+                    _user_id_of(h)
+                    for h, _ in _trusted_helpers_with_distance(sos_req.lat, sos_req.lng, inner_km, exclude_user_id=sos_req.user_id)
+                }
+            q = db.session.query(User.id).filter(User.is_trusted_helper == True, User.id != sos_req.user_id)  # noqa: E712
+            helper_ids = [uid for (uid,) in q.all() if uid not in covered]
+
+        request_id = sos_req.id
+        errors = []
+        if helper_ids:
+            # A failed channel is logged and recorded on the ring, and the
+            # session rolled back so the ring and the escalation still go in.
+            try:
+                if not push_notifications_bulk(
+                    helper_ids,
+                    type="sos",
+                    message=f"🚨 SOS: {owner_name} needs immediate help nearby!",
+                    link=url_for("map_page", focus_request_id=request_id),
+                ):
+                    errors.append("bell notifications were not saved")
+            except Exception as e:
+                db.session.rollback()
+                errors.append(f"bell notifications: {e}")
+            try:
+                fcm_dispatcher.send(
+                    helper_ids,
+                    title="🚨 SOS ALERT!",
+                    body=f"EMERGENCY: {owner_name} needs help nearby!",
+                    data={"type": "SOS_ALERT", "request_id": str(request_id)},
+                )
+            except Exception as e:
+                db.session.rollback()
+                errors.append(f"push: {e}")
+
+        label = f"{radius_km:g} km" if radius_km is not None else "all"
+        for error in errors:
+            print(f"[SOS] Request {request_id} ring {ring} ({label}) delivery failed: {error}")
+        db.session.add(SOSDispatchRing(
+            request_id=request_id,
+            ring=ring,
+            radius_km=radius_km,
+            helpers_notified=len(helper_ids),
+            dispatch_ms=(time.perf_counter() - started) * 1000.0,
+            error="; ".join(errors)[:2000] or None,
+        ))
+        db.session.commit()
+        print(f"[SOS] Request {request_id} ring {ring} ({label}): notified {len(helper_ids)} helpers")
+
+        ring += 1
+        if ring >= len(SOS_RINGS_KM):
+            return
+        if helper_ids:
+            job_queue.enqueue(
+                "sos_escalate",
+                {"request_id": request_id, "ring": ring},
+                delay_seconds=SOS_RING_ESCALATE_SECONDS,
+            )
+            return
+        # Nobody in this ring: widen right away.
+
+
+@job_queue.handler("sos_escalate")
+def _job_sos_escalate(payload):
+    sos_req = db.session.get(Request, int(payload["request_id"]))
+    if not _sos_still_unanswered(sos_req):
+        return
+    dispatch_sos_ring(sos_req, int(payload["ring"]))
+
+
+def record_sos_response_latency(request_id):
+    """Stamp the first response on the most recent ring dispatched for this SOS."""
+    ring = (
+        SOSDispatchRing.query.filter_by(request_id=request_id)
+        .order_by(SOSDispatchRing.ring.desc())
+        .first()
+    )
+    if ring and ring.first_response_at is None:
+        ring.first_response_at = datetime.utcnow()
+        db.session.commit()
 
 
 def build_flagged_map_for_requests(requests_list):
@@ -797,8 +1290,12 @@ class FCMToken(db.Model):
     # The token string itself, must be unique across all tokens
     token = db.Column(db.String(255), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    
+
+
+# Multi-user FCM sends: one token query, 500-token multicast chunks, thread pool.
+fcm_dispatcher = FCMDispatcher(db, FCMToken)
+
+
 class Offer(db.Model):
     __tablename__ = "offers"
 
@@ -839,13 +1336,32 @@ class SOSResponse(db.Model):
         "Request", backref=db.backref("sos_responses", cascade="all, delete-orphan")
     )
     helper = db.relationship("User", backref="sos_responses")
+
+
+# One row per ring an SOS was dispatched to (see dispatch_sos_ring)
+class SOSDispatchRing(db.Model):
+    __tablename__ = "sos_dispatch_rings"
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey("requests.id"), nullable=False, index=True)
+    ring = db.Column(db.Integer, nullable=False)              # 0-based index into SOS_RINGS_KM
+    radius_km = db.Column(db.Float, nullable=True)            # None = every remaining helper
+    helpers_notified = db.Column(db.Integer, nullable=False, default=0)
+    dispatch_ms = db.Column(db.Float, nullable=True)          # time to select + notify
+    dispatched_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    first_response_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)                 # why bells/pushes failed, if they did
+
+    def response_latency_seconds(self):
+        if not self.first_response_at or not self.dispatched_at:
+            return None
+        return (self.first_response_at - self.dispatched_at).total_seconds()
 # In app.py
 class Review(db.Model):
     __tablename__ = "reviews"
     id = db.Column(db.Integer, primary_key=True)
     request_id = db.Column(db.Integer, db.ForeignKey("requests.id"), nullable=False)
     reviewer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    helper_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    helper_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text, nullable=True)
@@ -870,9 +1386,13 @@ class Conversation(db.Model):
     __tablename__ = "conversations"
     id = db.Column(db.Integer, primary_key=True)
     # participant user ids (two users, one-on-one)
-    user_a = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    user_b = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_a = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    user_b = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # newest message, kept up to date by ChatMessage insert/delete events so
+    # the inbox (conversation_inbox) needs no per-conversation lookup
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
 
     def participants(self):
         return {self.user_a, self.user_b}
@@ -888,8 +1408,31 @@ class ChatMessage(db.Model):
     delivered = db.Column(db.Boolean, default=False)
     read = db.Column(db.Boolean, default=False)
     language = db.Column(db.String(10), nullable=True)  # original language code if known
+    attachment_id = db.Column(db.Integer, db.ForeignKey("chat_attachments.id"), nullable=True)
 
     conversation = db.relationship("Conversation", backref="messages")
+    attachment = db.relationship("ChatAttachment")
+
+    __table_args__ = (
+        db.Index("ix_chat_messages_conv_read_sender", "conversation_id", "read", "sender_id"),
+        # keyset pagination of a conversation's history (chat_history_page)
+        db.Index("ix_chat_messages_conv_id", "conversation_id", "id"),
+    )
+
+
+class ChatAttachment(db.Model):
+    """A file sent in a chat; the bytes live in the attachment store under sha256."""
+    __tablename__ = "chat_attachments"
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey("conversations.id"), nullable=False, index=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    file_name = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True, index=True)  # set once the upload is complete
+    status = db.Column(db.String(20), nullable=False, default="uploading")  # uploading / ready
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
 
 
 # ------------------ MODELS: Resources ------------------
@@ -963,25 +1506,17 @@ class ResourceWantedItem(db.Model):
 
 # ------------------ IMPACT ANALYTICS ------------------
 def calculate_impact(user_id):
-    completed = Request.query.filter_by(
-        helper_id=user_id,
-        status="completed"
-    ).all()
-
-    # Prefer verified review duration hours if present.
-    hours = (
-        db.session.query(func.coalesce(func.sum(Review.duration_hours), 0.0))
-        .filter(Review.helper_id == user_id)
-        .scalar()
-    ) or 0.0
+    # helped / hours come from the user_stats ledger (verified reviews).
+    stats = get_user_stat(user_id)
+    hours = stats["review_hours"]
 
     items = Resource.query.filter_by(user_id=user_id).count()
 
-    rides = [r for r in completed if r.category == "ride"]
-    carbon = len(rides) * 2.5
+    rides = Request.query.filter_by(helper_id=user_id, status="completed", category="ride").count()
+    carbon = rides * 2.5
 
     return {
-        "helped": len(completed),
+        "helped": stats["helped_count"],
         "hours": round(hours, 1),
         "items": items,
         "carbon": round(carbon, 1)
@@ -1007,6 +1542,21 @@ class Event(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
 
+# Cached route distances between rounded coordinates (see distance_provider.py)
+class DistanceCache(db.Model):
+    __tablename__ = "distance_cache"
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(30), nullable=False)
+    origin_key = db.Column(db.String(40), nullable=False)
+    dest_key = db.Column(db.String(40), nullable=False)
+    meters = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_distance_cache_pair", "provider", "dest_key", "origin_key"),
+    )
+
+
 class EventInterest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
@@ -1032,23 +1582,330 @@ class ImpactLog(db.Model):
     helper = db.relationship("User", backref="impact_logs")
 
 
-# ------------------ NOTIFICATION MODEL ------------------
-class Notification(db.Model):
-    __tablename__ = "notifications"
+# ------------------ USER STATS LEDGER ------------------
+# Per-helper running totals over reviews and impact_log, updated in the same
+# transaction as every Review / ImpactLog write so summaries read one row
+# instead of re-aggregating a helper's whole history.
+class UserStats(db.Model):
+    __tablename__ = "user_stats"
 
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    type = db.Column(db.String(50), nullable=False)  # sos, emotional_ping, chat, system, etc.
-    message = db.Column(db.Text, nullable=False)
-    link = db.Column(db.String(255), nullable=True)  # URL to redirect when clicked
-    is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    helped_count = db.Column(db.Integer, nullable=False, default=0)     # distinct requests reviewed as helper
+    people_helped = db.Column(db.Integer, nullable=False, default=0)    # distinct reviewers (recipients)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    review_hours = db.Column(db.Float, nullable=False, default=0.0)
+    event_hours = db.Column(db.Float, nullable=False, default=0.0)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    carbon = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    user = db.relationship("User", backref="notifications")
 
-    def to_dict(self):
-        created_at = self.created_at
-        try:
+USER_STATS_FIELDS = (
+    "helped_count", "people_helped", "review_count", "review_hours", "event_hours", "items", "carbon",
+)
+
+
+def _empty_stats():
+    return {
+        "helped_count": 0, "people_helped": 0, "review_count": 0,
+        "review_hours": 0.0, "event_hours": 0.0, "items": 0, "carbon": 0.0,
+    }
+
+
+def _stats_from_source(conn, user_ids):
+    """{user_id: stats} aggregated from reviews and impact_log (two grouped queries)."""
+    user_ids = list(user_ids)
+    stats = {int(uid): _empty_stats() for uid in user_ids}
+    if not stats:
+        return stats
+    reviews = conn.execute(
+        db.select(
+            Review.helper_id,
+            func.count(func.distinct(Review.request_id)),
+            func.count(func.distinct(Review.reviewer_id)),
+            func.count(Review.id),
+            func.coalesce(func.sum(Review.duration_hours), 0.0),
+        )
+        .where(Review.helper_id.in_(user_ids))
+        .group_by(Review.helper_id)
+    )
+    for uid, helped, people, n, hours in reviews:
+        stats[int(uid)].update(
+            helped_count=int(helped or 0), people_helped=int(people or 0),
+            review_count=int(n or 0), review_hours=float(hours or 0.0),
+        )
+    impacts = conn.execute(
+        db.select(
+            ImpactLog.helper_id,
+            func.coalesce(func.sum(ImpactLog.hours), 0.0),
+            func.coalesce(func.sum(ImpactLog.items), 0),
+            func.coalesce(func.sum(ImpactLog.carbon), 0.0),
+        )
+        .where(ImpactLog.helper_id.in_(user_ids))
+        .group_by(ImpactLog.helper_id)
+    )
+    for uid, hours, items, carbon in impacts:
+        stats[int(uid)].update(event_hours=float(hours or 0.0), items=int(items or 0), carbon=float(carbon or 0.0))
+    return stats
+
+
+def _create_ledger_rows(conn, table, changes, source, on_conflict):
+    """
+    Give the users in `changes` ({user_id: {column: delta}}) that have no
+    row in `table` (user_counters, user_stats) one, inside the writer's
+    transaction: counted by `source(user_ids)` from the source tables, which
+    already include the write. A reader may insert the row meanwhile from an
+    older snapshot that lacks the write; the insert then adds the deltas to
+    it instead (ON CONFLICT, `on_conflict(column, delta)`). Returns the user
+    ids handled here; the caller applies the deltas to the others.
+    """
+    ids = list(changes)
+    existing = {
+        uid for (uid,) in conn.execute(db.select(table.c.user_id).where(table.c.user_id.in_(ids)))
+    }
+    missing = [uid for uid in ids if uid not in existing]
+    if not missing:
+        return set()
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    now = datetime.utcnow()
+    for uid, values in source(missing).items():
+        stmt = upsert(table).values(user_id=uid, updated_at=now, **values)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={
+                **{column: on_conflict(table.c[column], d) for column, d in changes[uid].items()},
+                "updated_at": now,
+            },
+        ))
+    return set(missing)
+
+
+def _bump_user_stats(conn, user_id, **deltas):
+    """
+    Add `deltas` to one user_stats row on `conn` (a Session or Connection),
+    after the Review / ImpactLog write has been executed. A user without a
+    row gets one counted from the source tables (see _create_ledger_rows).
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if user_id is None or not deltas:
+        return
+    table = UserStats.__table__
+    user_id = int(user_id)
+    if _create_ledger_rows(
+        conn, table, {user_id: deltas},
+        source=lambda ids: _stats_from_source(conn, ids),
+        on_conflict=lambda col, d: col + d,
+    ):
+        return
+    values = {k: table.c[k] + v for k, v in deltas.items()}
+    values["updated_at"] = datetime.utcnow()
+    conn.execute(table.update().where(table.c.user_id == user_id).values(values))
+
+
+def _recount_user_stats(conn, user_ids):
+    """Overwrite existing rows for these users from the source tables."""
+    user_ids = {int(uid) for uid in user_ids if uid is not None}
+    if not user_ids:
+        return
+    table = UserStats.__table__
+    values = {f: db.bindparam(f"v_{f}") for f in USER_STATS_FIELDS}
+    values["updated_at"] = datetime.utcnow()
+    stmt = table.update().where(table.c.user_id == db.bindparam("uid")).values(values)
+    conn.execute(stmt, [
+        {"uid": uid, **{f"v_{f}": v for f, v in stats.items()}}
+        for uid, stats in _stats_from_source(conn, user_ids).items()
+    ])
+
+
+def _is_only_review(conn, review, column, value):
+    """True if `review` is the helper's only review with this request/reviewer."""
+    return conn.execute(
+        db.select(Review.id)
+        .where(Review.helper_id == review.helper_id, column == value, Review.id != review.id)
+        .limit(1)
+    ).first() is None
+
+
+def _review_ledger(sign):
+    def handler(mapper, connection, target):
+        _bump_user_stats(
+            connection, target.helper_id,
+            review_count=sign,
+            review_hours=sign * float(target.duration_hours or 0.0),
+            helped_count=sign if _is_only_review(connection, target, Review.request_id, target.request_id) else 0,
+            people_helped=sign if _is_only_review(connection, target, Review.reviewer_id, target.reviewer_id) else 0,
+        )
+        _refresh_user_scores(connection, [target.helper_id])
+    return handler
+
+
+def _review_ledger_update(mapper, connection, target):
+    # Rare (reviews are written once); recount the helpers involved.
+    helper_ids = {target.helper_id}
+    helper_ids.update(sa_inspect(target).attrs.helper_id.history.deleted or ())
+    _recount_user_stats(connection, helper_ids)
+    _refresh_user_scores(connection, helper_ids)
+
+
+def _impact_ledger(sign):
+    def handler(mapper, connection, target):
+        _bump_user_stats(
+            connection, target.helper_id,
+            event_hours=sign * float(target.hours or 0.0),
+            items=sign * int(target.items or 0),
+            carbon=sign * float(target.carbon or 0.0),
+        )
+    return handler
+
+
+def _impact_ledger_update(mapper, connection, target):
+    helper_ids = {target.helper_id}
+    helper_ids.update(sa_inspect(target).attrs.helper_id.history.deleted or ())
+    _recount_user_stats(connection, helper_ids)
+
+
+event.listen(Review, "after_insert", _review_ledger(1))
+event.listen(Review, "after_delete", _review_ledger(-1))
+event.listen(Review, "after_update", _review_ledger_update)
+event.listen(ImpactLog, "after_insert", _impact_ledger(1))
+event.listen(ImpactLog, "after_delete", _impact_ledger(-1))
+event.listen(ImpactLog, "after_update", _impact_ledger_update)
+
+
+def get_user_stats(user_ids):
+    """
+    {user_id: stats dict} from user_stats: one primary-key lookup per batch.
+    Users without a row yet (nothing written for them since) are aggregated
+    from the source tables once and their row is stored; a write that
+    commits meanwhile adds itself to that row (see _create_ledger_rows).
+    """
+    user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+    if not user_ids:
+        return {}
+    stats = {}
+    columns = [UserStats.user_id] + [getattr(UserStats, f) for f in USER_STATS_FIELDS]
+    for i in range(0, len(user_ids), 1000):
+        for row in db.session.query(*columns).filter(UserStats.user_id.in_(user_ids[i:i + 1000])):
+            stats[row[0]] = dict(zip(USER_STATS_FIELDS, row[1:]))
+
+    missing = [uid for uid in user_ids if uid not in stats]
+    if missing:
+        fresh = _stats_from_source(db.session, missing)
+        stats.update(fresh)
+        try:
+            db.session.execute(insert(UserStats), [
+                {"user_id": uid, "updated_at": datetime.utcnow(), **row} for uid, row in fresh.items()
+            ])
+            db.session.commit()
+        except Exception:
+            # e.g. a concurrent request created the row first; it will be read next time.
+            db.session.rollback()
+    return stats
+
+
+def get_user_stat(user_id):
+    return get_user_stats([user_id]).get(int(user_id)) or _empty_stats()
+
+
+def rebuild_user_stats(batch_size=1000):
+    """
+    Rebuild user_stats from scratch: impact_log is summed per helper, then
+    reviews are streamed once ordered by helper (yield_per), each helper's
+    row is finished as soon as the next helper starts, and rows are written
+    in batches. Replaces the table in one transaction.
+    """
+    started = time.perf_counter()
+    impacts = {
+        int(uid): (float(h or 0.0), int(i or 0), float(c or 0.0))
+        for uid, h, i, c in db.session.execute(
+            db.select(
+                ImpactLog.helper_id,
+                func.coalesce(func.sum(ImpactLog.hours), 0.0),
+                func.coalesce(func.sum(ImpactLog.items), 0),
+                func.coalesce(func.sum(ImpactLog.carbon), 0.0),
+            ).group_by(ImpactLog.helper_id)
+        )
+    }
+
+    written = 0
+    batch = []
+    now = datetime.utcnow()
+
+    def finish(uid, stats):
+        nonlocal written
+        hours, items, carbon = impacts.pop(uid, (0.0, 0, 0.0))
+        stats.update(event_hours=hours, items=items, carbon=carbon)
+        batch.append({"user_id": uid, "updated_at": now, **stats})
+        if len(batch) >= batch_size:
+            db.session.execute(insert(UserStats), batch)
+            written += len(batch)
+            batch.clear()
+
+    db.session.query(UserStats).delete(synchronize_session=False)
+
+    reviews = db.session.execute(
+        db.select(Review.helper_id, Review.request_id, Review.reviewer_id, Review.duration_hours)
+        .order_by(Review.helper_id)
+        .execution_options(yield_per=batch_size)
+    )
+    current = None
+    stats = requests_seen = reviewers_seen = None
+    for helper_id, request_id, reviewer_id, hours in reviews:
+        if helper_id != current:
+            if current is not None:
+                finish(current, stats)
+            current = helper_id
+            stats = _empty_stats()
+            requests_seen, reviewers_seen = set(), set()
+        stats["review_count"] += 1
+        stats["review_hours"] += float(hours or 0.0)
+        if request_id not in requests_seen:
+            requests_seen.add(request_id)
+            stats["helped_count"] += 1
+        if reviewer_id not in reviewers_seen:
+            reviewers_seen.add(reviewer_id)
+            stats["people_helped"] += 1
+    if current is not None:
+        finish(current, stats)
+
+    # helpers with impact logs but no reviews
+    for uid in list(impacts):
+        finish(uid, _empty_stats())
+    if batch:
+        db.session.execute(insert(UserStats), batch)
+        written += len(batch)
+    db.session.commit()
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000.0, 1)
+    print(f"[STATS] Rebuilt user_stats: {written} rows in {elapsed_ms:.0f}ms")
+    return {"rows": written, "elapsed_ms": elapsed_ms}
+
+
+# ------------------ NOTIFICATION MODEL ------------------
+class Notification(db.Model):
+    __tablename__ = "notifications"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    type = db.Column(db.String(50), nullable=False)  # sos, emotional_ping, chat, system, etc.
+    message = db.Column(db.Text, nullable=False)
+    link = db.Column(db.String(255), nullable=True)  # URL to redirect when clicked
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship("User", backref="notifications")
+
+    __table_args__ = (
+        # unread lookups and the bell list (newest first)
+        db.Index("ix_notifications_user_read_created", "user_id", "is_read", "created_at"),
+    )
+
+    def to_dict(self):
+        created_at = self.created_at
+        try:
             created_at_str = created_at.strftime("%Y-%m-%d %H:%M") if created_at else ""
         except Exception:
             created_at_str = str(created_at) if created_at else ""
@@ -1063,6 +1920,461 @@ class Notification(db.Model):
         }
 
 
+# Per-user unread badge counters, kept in step with notifications and
+# chat_messages inside the same transaction (see _bump_unread_counters).
+# A missing row means "not counted yet"; it is built on the first write or
+# read that needs it.
+class UserCounter(db.Model):
+    __tablename__ = "user_counters"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0)
+    unread_chat = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def _bump_unread_counters(conn, notifications=None, chat=None):
+    """
+    Apply {user_id: delta} changes to user_counters on `conn` (a Session or
+    Connection, so the change commits or rolls back with the caller's
+    transaction). Call it after the write itself has been executed: users
+    without a counter row get one counted from the source tables, which
+    then already include it (see _create_ledger_rows).
+    """
+    table = UserCounter.__table__
+    now = datetime.utcnow()
+    changes = {}
+    for column, deltas in (("unread_notifications", notifications), ("unread_chat", chat)):
+        for uid, d in (deltas or {}).items():
+            if d:
+                changes.setdefault(int(uid), {})[column] = int(d)
+    if not changes:
+        return
+    missing = _create_ledger_rows(
+        conn, table, changes,
+        source=lambda ids: {
+            uid: {"unread_notifications": n, "unread_chat": c}
+            for uid, (n, c) in _count_unread_from_source(ids, conn).items()
+        },
+        on_conflict=lambda col, d: db.case((col + d < 0, 0), else_=col + d),
+    )
+    for column in ("unread_notifications", "unread_chat"):
+        params = [
+            {"uid": uid, "delta": deltas[column]}
+            for uid, deltas in changes.items() if column in deltas and uid not in missing
+        ]
+        if not params:
+            continue
+        col = table.c[column]
+        delta = db.bindparam("delta")
+        stmt = (
+            table.update()
+            .where(table.c.user_id == db.bindparam("uid"))
+            .values({column: db.case((col + delta < 0, 0), else_=col + delta), "updated_at": now})
+        )
+        # one executemany per column, however many users
+        conn.execute(stmt, params)
+
+
+def _chat_recipient(conn, conversation_id, sender_id):
+    row = conn.execute(
+        db.select(Conversation.user_a, Conversation.user_b).where(Conversation.id == conversation_id)
+    ).first()
+    if row is None:
+        return None
+    return row[1] if row[0] == sender_id else row[0]
+
+
+def _count_notification_insert(mapper, connection, target):
+    if not target.is_read:
+        _bump_unread_counters(connection, notifications={target.user_id: 1})
+
+
+def _count_notification_update(mapper, connection, target):
+    hist = sa_inspect(target).attrs.is_read.history
+    if hist.has_changes():
+        was_read = bool(hist.deleted[0]) if hist.deleted else False
+        if was_read != bool(target.is_read):
+            _bump_unread_counters(connection, notifications={target.user_id: -1 if target.is_read else 1})
+
+
+def _count_notification_delete(mapper, connection, target):
+    if not target.is_read:
+        _bump_unread_counters(connection, notifications={target.user_id: -1})
+
+
+def _count_chat_insert(mapper, connection, target):
+    if target.read:
+        return
+    recipient = _chat_recipient(connection, target.conversation_id, target.sender_id)
+    if recipient is not None:
+        _bump_unread_counters(connection, chat={recipient: 1})
+
+
+def _count_chat_update(mapper, connection, target):
+    hist = sa_inspect(target).attrs.read.history
+    if not hist.has_changes():
+        return
+    was_read = bool(hist.deleted[0]) if hist.deleted else False
+    if was_read == bool(target.read):
+        return
+    recipient = _chat_recipient(connection, target.conversation_id, target.sender_id)
+    if recipient is not None:
+        _bump_unread_counters(connection, chat={recipient: -1 if target.read else 1})
+
+
+def _count_chat_delete(mapper, connection, target):
+    if target.read:
+        return
+    recipient = _chat_recipient(connection, target.conversation_id, target.sender_id)
+    if recipient is not None:
+        _bump_unread_counters(connection, chat={recipient: -1})
+
+
+event.listen(Notification, "after_insert", _count_notification_insert)
+event.listen(Notification, "after_update", _count_notification_update)
+event.listen(Notification, "after_delete", _count_notification_delete)
+event.listen(ChatMessage, "after_insert", _count_chat_insert)
+event.listen(ChatMessage, "after_update", _count_chat_update)
+event.listen(ChatMessage, "after_delete", _count_chat_delete)
+
+
+# ------------------ CONVERSATION LAST MESSAGE (denormalized) ------------------
+# conversations.last_message_id / last_message_at follow the newest message so
+# the inbox sorts and joins on them directly. Written on the flush connection,
+# in the same transaction as the message.
+
+def _latest_message_values():
+    """UPDATE values recomputing last_message_* from chat_messages (correlated)."""
+    conv = Conversation.__table__
+    msgs = ChatMessage.__table__
+    newest = msgs.alias("newest")
+
+    def newest_id():
+        return (
+            db.select(func.max(msgs.c.id)).where(msgs.c.conversation_id == conv.c.id)
+            .correlate(conv).scalar_subquery()
+        )
+
+    newest_at = (
+        db.select(newest.c.created_at).where(newest.c.id == newest_id())
+        .correlate(conv).scalar_subquery()
+    )
+    return {"last_message_id": newest_id(), "last_message_at": newest_at}
+
+
+def _track_last_message_insert(mapper, connection, target):
+    conv = Conversation.__table__
+    connection.execute(
+        conv.update()
+        .where(
+            conv.c.id == target.conversation_id,
+            or_(conv.c.last_message_id.is_(None), conv.c.last_message_id < target.id),
+        )
+        .values(last_message_id=target.id, last_message_at=target.created_at)
+    )
+
+
+def _track_last_message_delete(mapper, connection, target):
+    conv = Conversation.__table__
+    connection.execute(
+        conv.update()
+        .where(conv.c.id == target.conversation_id, conv.c.last_message_id == target.id)
+        .values(_latest_message_values())
+    )
+
+
+event.listen(ChatMessage, "after_insert", _track_last_message_insert)
+event.listen(ChatMessage, "after_delete", _track_last_message_delete)
+
+
+def backfill_conversation_last_messages():
+    """Fill last_message_* for conversations that predate the columns; returns rows updated."""
+    conv = Conversation.__table__
+    stmt = (
+        conv.update()
+        .where(
+            conv.c.last_message_id.is_(None),
+            db.select(ChatMessage.id).where(ChatMessage.conversation_id == conv.c.id).exists(),
+        )
+        .values(_latest_message_values())
+    )
+    with db.engine.begin() as conn:
+        return conn.execute(stmt).rowcount or 0
+
+
+# ------------------ EVENT BUS (socket push) ------------------
+# Domain events go out over Socket.IO (event_bus.py) so pages can subscribe
+# instead of polling. Anything raised inside a transaction is staged on the
+# session and published after commit.
+bus = event_bus.EventBus(socketio)
+
+
+def _publish_feed_to_bus(changes, version):
+    # Live-request feed changes -> the cell room of each request (or the
+    # "requests" topic for wide subscriptions), then one summary nudge.
+    for rid, old, new in changes:
+        row = new or old
+        cell = event_bus.cell_for(row["lat"], row["lng"]) if row is not None else None
+        bus.publish(
+            "request.changed" if new is not None else "request.removed",
+            {"id": rid, "version": version},
+            topics=["requests"], cells=[cell],
+        )
+    bus.publish("summary.changed", {"version": version}, topics=["summary"])
+
+
+request_feed.feed.add_listener(_publish_feed_to_bus)
+
+
+def _bus_request_written(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        bus.stage(
+            session, "request.updated", {"id": target.id, "status": target.status},
+            users=[target.user_id, target.helper_id],
+        )
+
+
+def _bus_offer_updated(mapper, connection, target):
+    status = sa_inspect(target).attrs.status.history
+    if target.status != "accepted" or not status.has_changes():
+        return
+    session = sa_inspect(target).session
+    if session is not None:
+        owner_id = connection.execute(
+            db.select(Request.user_id).where(Request.id == target.request_id)
+        ).scalar()
+        bus.stage(
+            session, "offer.accepted", {"offer_id": target.id, "request_id": target.request_id},
+            users=[target.helper_id, owner_id], topics=["summary"],
+        )
+
+
+def _bus_notification_created(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        bus.stage(session, "notification.created", {"type": target.type}, users=[target.user_id])
+
+
+def _bus_impact_changed(mapper, connection, target):
+    # ImpactLog and Review both credit a helper (their dashboard changes too).
+    session = sa_inspect(target).session
+    if session is not None:
+        bus.stage(session, "impact.changed", topics=["impact"], users=[target.helper_id])
+
+
+event.listen(Request, "after_insert", _bus_request_written)
+event.listen(Request, "after_update", _bus_request_written)
+event.listen(Offer, "after_update", _bus_offer_updated)
+event.listen(Notification, "after_insert", _bus_notification_created)
+event.listen(ImpactLog, "after_insert", _bus_impact_changed)
+event.listen(Review, "after_insert", _bus_impact_changed)
+
+
+def _bus_resources_changed(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        bus.stage(session, "resources.changed", topics=["resources"])
+
+
+event.listen(Resource, "after_insert", _bus_resources_changed)
+event.listen(Resource, "after_update", _bus_resources_changed)
+event.listen(Resource, "after_delete", _bus_resources_changed)
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_bus_events(session):
+    bus.flush_staged(session)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_bus_events(session):
+    bus.discard_staged(session)
+
+
+# Expiry only happens as time passes, so tick the feed in the background
+# (no SQL unless it is due for its periodic reload). With several workers
+# only the holder of the "feed-ticker" lease expires and reloads.
+FEED_TICK_SECONDS = 1.0
+_feed_ticker_started = False
+
+if peers.shared:
+    request_feed.feed.use_cluster(peers)
+
+
+def _run_feed_ticker():
+    while True:
+        try:
+            with app.app_context():
+                request_feed.feed.tick(lead=peers.lead("feed-ticker"))
+        except Exception as e:
+            print(f"[BUS] Feed tick failed: {e}")
+        socketio.sleep(FEED_TICK_SECONDS)
+
+
+@app.before_request
+def _start_feed_ticker():
+    global _feed_ticker_started
+    if _feed_ticker_started:
+        return
+    _feed_ticker_started = True
+    socketio.start_background_task(_run_feed_ticker)
+
+
+# ------------------ BACKGROUND JOBS ------------------
+class Job(db.Model):
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")  # JSON
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued / running / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
+
+
+# Jobs run inside a request context so helpers can keep using url_for().
+job_queue.configure(db, Job, context_factory=lambda: app.test_request_context("/"))
+
+# "embedded": the web process also polls the queue (single-dyno deploys).
+# "external": only `python worker.py` processes jobs.
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "embedded").strip().lower()
+_embedded_job_worker_started = False
+
+
+@app.before_request
+def _start_embedded_job_worker():
+    global _embedded_job_worker_started
+    if _embedded_job_worker_started or JOB_WORKER_MODE != "embedded":
+        return
+    _embedded_job_worker_started = True
+    socketio.start_background_task(job_queue.work_forever, sleep=socketio.sleep)
+
+
+# Activity pings are buffered and written in batches ("buffered", default)
+# or committed one by one on the request ("sync").
+ACTIVITY_INGEST_MODE = os.getenv("ACTIVITY_INGEST_MODE", "buffered").strip().lower()
+_activity_flusher_started = False
+
+
+def _after_activity_flush(latest_positions):
+    # The coalesced bulk UPDATE skips mapper events; keep geo_index current.
+    for user_id, (lat, lng) in latest_positions.items():
+        geo_index.upsert("user", user_id, lat, lng)
+    if peers.shared and latest_positions:
+        peers.publish("users.moved", {str(uid): list(pos) for uid, pos in latest_positions.items()})
+
+
+activity_ingestor = ActivityIngestor(
+    db, UserActivity, User, context_factory=app.app_context, after_flush=_after_activity_flush
+)
+atexit.register(activity_ingestor.flush)
+
+
+@app.before_request
+def _start_activity_flusher():
+    global _activity_flusher_started
+    if _activity_flusher_started or ACTIVITY_INGEST_MODE != "buffered":
+        return
+    _activity_flusher_started = True
+    socketio.start_background_task(activity_ingestor.run_forever, sleep=socketio.sleep)
+
+
+ACTIVITY_RETENTION_INTERVAL_SECONDS = int(os.getenv("ACTIVITY_RETENTION_INTERVAL_SECONDS", "3600"))
+
+
+@job_queue.handler("activity_retention")
+def _job_activity_retention(payload):
+    activity_retention.run(
+        db, UserActivity, UserActivityHourly,
+        retention_hours=int(payload.get("retention_hours") or activity_retention.RETENTION_HOURS),
+        dry_run=bool(payload.get("dry_run")),
+    )
+    if not payload.get("dry_run"):
+        # The route-distance cache is insert-only; drop what reads no longer use.
+        purged = distance_provider.DbDistanceCache(db, DistanceCache).purge_expired()
+        if purged:
+            print(f"[DISTANCE] Purged {purged} expired cached distances")
+
+
+job_queue.recurring("activity_retention", ACTIVITY_RETENTION_INTERVAL_SECONDS)
+
+
+# Counters are maintained transactionally; this only repairs drift (e.g. rows
+# changed by hand in the database).
+UNREAD_COUNTERS_RECONCILE_SECONDS = int(os.getenv("UNREAD_COUNTERS_RECONCILE_SECONDS", "21600"))
+
+
+@job_queue.handler("unread_counters_reconcile")
+def _job_unread_counters_reconcile(payload):
+    reconcile_unread_counters()
+
+
+job_queue.recurring("unread_counters_reconcile", UNREAD_COUNTERS_RECONCILE_SECONDS)
+
+
+# Scores are maintained from Review writes; this rebuilds them all from
+# reviews to catch drift (and reports how many were off).
+USER_SCORES_RECONCILE_SECONDS = int(os.getenv("USER_SCORES_RECONCILE_SECONDS", "86400"))
+
+
+@job_queue.handler("user_scores_reconcile")
+def _job_user_scores_reconcile(payload):
+    reconcile_user_scores(fix=not payload.get("dry_run"))
+
+
+job_queue.recurring("user_scores_reconcile", USER_SCORES_RECONCILE_SECONDS)
+
+
+# Abandoned chat uploads and files no attachment refers to any more.
+CHAT_ATTACHMENT_CLEANUP_SECONDS = int(os.getenv("CHAT_ATTACHMENT_CLEANUP_SECONDS", "21600"))
+
+
+@job_queue.handler("chat_attachments_cleanup")
+def _job_chat_attachments_cleanup(payload):
+    cleanup_chat_attachments()
+
+
+job_queue.recurring("chat_attachments_cleanup", CHAT_ATTACHMENT_CLEANUP_SECONDS)
+
+
+@job_queue.handler("need_request_fanout")
+def _job_need_request_fanout(payload):
+    req = db.session.get(Request, int(payload["request_id"]))
+    if req is None:
+        return
+    fan_out_need_request(req)
+
+
+@job_queue.handler("need_request_bells")
+def _job_need_request_bells(payload):
+    req = db.session.get(Request, int(payload["request_id"]))
+    if req is None:
+        return
+    send_need_request_bells(req, payload.get("user_ids") or [])
+
+
+@job_queue.handler("need_request_push")
+def _job_need_request_push(payload):
+    req = db.session.get(Request, int(payload["request_id"]))
+    if req is None:
+        return
+    send_need_request_push(req, nearby=payload.get("nearby") or (), helper_ids=payload.get("helpers") or ())
+
+
 # ------------------- EVENT NOTIFICATION HELPERS -------------------
 def notify_interested_users(event, message):
     interests = EventInterest.query.filter_by(event_id=event.id).all()
@@ -1091,39 +2403,305 @@ def get_or_create_conversation(user1_id, user2_id):
     return conv
 
 
+# user_id -> (expires_monotonic, name) for chat sender names. Dropped on
+# User update/delete here; the TTL bounds staleness for renames made by
+# other workers.
+USER_NAME_CACHE_TTL_SECONDS = float(os.getenv("USER_NAME_CACHE_TTL_SECONDS", "300"))
+USER_NAME_CACHE_MAX = 50_000
+_user_name_cache = {}
+
+
+def user_names(user_ids):
+    """{user_id: name} for the given ids: cached ones plus one query for the rest."""
+    now = time.monotonic()
+    names, missing = {}, set()
+    for uid in user_ids:
+        if uid is None or uid in names:
+            continue
+        hit = _user_name_cache.get(uid)
+        if hit is not None and hit[0] > now:
+            names[uid] = hit[1]
+        else:
+            missing.add(uid)
+    if missing:
+        rows = dict(db.session.query(User.id, User.name).filter(User.id.in_(missing)).all())
+        if len(_user_name_cache) + len(rows) > USER_NAME_CACHE_MAX:
+            _user_name_cache.clear()
+        expires = now + USER_NAME_CACHE_TTL_SECONDS
+        for uid in missing:
+            names[uid] = rows.get(uid)
+            if uid in rows and USER_NAME_CACHE_TTL_SECONDS > 0:
+                _user_name_cache[uid] = (expires, rows[uid])
+    return names
+
+
+def _forget_user_name(mapper, connection, target):
+    _user_name_cache.pop(target.id, None)
+
+
+event.listen(User, "after_update", _forget_user_name)
+event.listen(User, "after_delete", _forget_user_name)
+
+
+def serialize_messages(msgs):
+    """
+    Payloads for a list of messages with one name lookup and one attachment
+    query for the whole list. Null language / attachment are left out.
+    """
+    names = user_names({m.sender_id for m in msgs})
+    unloaded = {
+        m.attachment_id for m in msgs
+        if m.attachment_id and "attachment" not in sa_inspect(m).dict
+    }
+    loaded = {}
+    if unloaded:
+        loaded = {a.id: a for a in ChatAttachment.query.filter(ChatAttachment.id.in_(unloaded))}
+
+    out = []
+    for msg in msgs:
+        item = {
+            "id": msg.id,
+            "conversation_id": msg.conversation_id,
+            "sender_id": msg.sender_id,
+            "sender_name": names.get(msg.sender_id),
+            "text": msg.text,
+            "created_at": int(msg.created_at.timestamp()),
+            "delivered": bool(msg.delivered),
+            "read": bool(msg.read),
+        }
+        if msg.language:
+            item["language"] = msg.language
+        if msg.attachment_id:
+            att = loaded.get(msg.attachment_id) or msg.attachment
+            if att is not None:
+                item["attachment"] = attachment_payload(att)
+        out.append(item)
+    return out
+
+
 def serialize_message(msg: ChatMessage):
+    return serialize_messages([msg])[0]
+
+
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_MAX = 200
+
+
+def chat_history_page(conv_id, before_id=None, after_id=None, limit=CHAT_PAGE_SIZE):
+    """
+    One page of a conversation, oldest first, walked by message id on the
+    (conversation_id, id) index so any page costs the same however long the
+    history is. Default: the latest `limit` messages; before_id: the ones
+    just older; after_id: the ones just newer. Returns (messages, has_more),
+    has_more meaning more in the same direction.
+    """
+    limit = max(1, min(int(limit or CHAT_PAGE_SIZE), CHAT_PAGE_MAX))
+    stmt = chat_history_select(conv_id, before_id=before_id, after_id=after_id).limit(limit + 1)
+    rows = db.session.scalars(stmt).all()
+    has_more = len(rows) > limit
+    if after_id is not None:
+        return rows[:limit], has_more
+    return rows[:limit][::-1], has_more
+
+
+def chat_history_select(conv_id, before_id=None, after_id=None):
+    """
+    The statement behind chat_history_page (without its limit): newest
+    first, or oldest first when reading on from after_id.
+    """
+    stmt = db.select(ChatMessage).where(ChatMessage.conversation_id == conv_id)
+    if after_id is not None:
+        return stmt.where(ChatMessage.id > after_id).order_by(ChatMessage.id.asc())
+    if before_id is not None:
+        stmt = stmt.where(ChatMessage.id < before_id)
+    return stmt.order_by(ChatMessage.id.desc())
+
+
+INBOX_PAGE_SIZE = 50
+INBOX_PAGE_MAX = 200
+
+
+def conversation_inbox_select(user_id):
+    """
+    The inbox statement for one user, most recent first: the counterpart
+    joined by id, the last message joined through the denormalized
+    conversations.last_message_id, and the unread count as a correlated COUNT
+    on ix_chat_messages_conv_read_sender. Plain joins and subqueries only, so
+    SQLite and Postgres run the same SQL. Conversations without messages come
+    last. Rows are (Conversation, User, last text, last created_at, unread).
+    """
+    other_id = db.case((Conversation.user_a == user_id, Conversation.user_b), else_=Conversation.user_a)
+    last = db.aliased(ChatMessage)
+    unread = (
+        db.select(func.count(ChatMessage.id))
+        .where(
+            ChatMessage.conversation_id == Conversation.id,
+            ChatMessage.read == False,  # noqa: E712
+            ChatMessage.sender_id != user_id,
+        )
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    return (
+        db.select(Conversation, User, last.text, last.created_at, unread)
+        .join(User, User.id == other_id)
+        .outerjoin(last, last.id == Conversation.last_message_id)
+        .where(or_(Conversation.user_a == user_id, Conversation.user_b == user_id))
+        .order_by(
+            Conversation.last_message_at.is_(None),
+            Conversation.last_message_at.desc(),
+            Conversation.id.desc(),
+        )
+    )
+
+
+def conversation_inbox(user_id, limit=INBOX_PAGE_SIZE, offset=0):
+    """
+    One page of the inbox in one query. Returns (entries, has_more); each
+    entry is a dict with conversation, other, last_message, last_message_at
+    and unread_count.
+    """
+    limit = max(1, min(int(limit or INBOX_PAGE_SIZE), INBOX_PAGE_MAX))
+    offset = max(0, int(offset or 0))
+    stmt = conversation_inbox_select(user_id).limit(limit + 1).offset(offset)
+    rows = db.session.execute(stmt).all()
+    return [_inbox_entry(row) for row in rows[:limit]], len(rows) > limit
+
+
+def conversation_inbox_entry(user_id, conv_id):
+    """The inbox entry for one conversation, wherever it falls in the order (or None)."""
+    row = db.session.execute(conversation_inbox_select(user_id).where(Conversation.id == conv_id)).first()
+    return _inbox_entry(row) if row is not None else None
+
+
+def _inbox_entry(row):
+    conv, other, text, created_at, n = row
     return {
-        "id": msg.id,
-        "conversation_id": msg.conversation_id,
-        "sender_id": msg.sender_id,
-        "sender_name": (User.query.get(msg.sender_id).name if User.query.get(msg.sender_id) else None),
-        "text": msg.text,
-        "created_at": int(msg.created_at.timestamp()),
-        "delivered": bool(msg.delivered),
-        "read": bool(msg.read),
-        "language": msg.language,
+        "conversation": conv,
+        "other": other,
+        "last_message": text,
+        "last_message_at": created_at,
+        "unread_count": int(n or 0),
     }
 
 
+def attachment_payload(att: ChatAttachment):
+    return {
+        "id": att.id,
+        "url": url_for("download_chat_attachment", attachment_id=att.id),
+        "file_name": att.file_name,
+        "size": att.size,
+        "content_type": att.content_type,
+        "is_image": attachments.is_inline_image(att.content_type),
+    }
+
+
+def _count_unread_from_source(user_ids, conn=None):
+    """
+    {user_id: (unread_notifications, unread_chat)} counted from the source
+    tables, on `conn` (a Session or Connection; default db.session).
+    """
+    conn = conn if conn is not None else db.session
+    notif_counts = dict(
+        conn.execute(
+            db.select(Notification.user_id, func.count(Notification.id))
+            .where(Notification.user_id.in_(user_ids), Notification.is_read == False)  # noqa: E712
+            .group_by(Notification.user_id)
+        ).all()
+    )
+    chat_counts = {}
+    for side in (Conversation.user_a, Conversation.user_b):
+        rows = conn.execute(
+            db.select(side, func.count(ChatMessage.id))
+            .join(Conversation, ChatMessage.conversation_id == Conversation.id)
+            .where(side.in_(user_ids), ChatMessage.read == False, ChatMessage.sender_id != side)  # noqa: E712
+            .group_by(side)
+        ).all()
+        for uid, n in rows:
+            chat_counts[uid] = chat_counts.get(uid, 0) + int(n or 0)
+    return {uid: (int(notif_counts.get(uid, 0)), chat_counts.get(uid, 0)) for uid in user_ids}
+
+
+def get_unread_counts(user_ids):
+    """
+    {user_id: (unread_notifications, unread_chat)} from user_counters: one
+    primary-key lookup per batch. Users without a counter row yet are counted
+    from the source tables once and their row is stored; a write that
+    commits meanwhile adds itself to that row (see _create_ledger_rows).
+    """
+    user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+    if not user_ids:
+        return {}
+    counts = {}
+    for i in range(0, len(user_ids), 1000):
+        rows = (
+            db.session.query(UserCounter.user_id, UserCounter.unread_notifications, UserCounter.unread_chat)
+            .filter(UserCounter.user_id.in_(user_ids[i:i + 1000]))
+            .all()
+        )
+        counts.update({uid: (int(n or 0), int(c or 0)) for uid, n, c in rows})
+
+    missing = [uid for uid in user_ids if uid not in counts]
+    if missing:
+        fresh = _count_unread_from_source(missing)
+        counts.update(fresh)
+        try:
+            db.session.execute(insert(UserCounter), [
+                {"user_id": uid, "unread_notifications": n, "unread_chat": c, "updated_at": datetime.utcnow()}
+                for uid, (n, c) in fresh.items()
+            ])
+            db.session.commit()
+        except Exception:
+            # e.g. a concurrent request created the row first; it will be read next time.
+            db.session.rollback()
+    return counts
+
+
+def reconcile_unread_counters(batch_size=1000):
+    """Recount every stored counter from the source tables; returns rows corrected."""
+    fixed = 0
+    last_id = 0
+    while True:
+        user_ids = [
+            uid for (uid,) in db.session.query(UserCounter.user_id)
+            .filter(UserCounter.user_id > last_id)
+            .order_by(UserCounter.user_id)
+            .limit(batch_size)
+            .all()
+        ]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        stored = {
+            uid: (n, c) for uid, n, c in db.session.query(
+                UserCounter.user_id, UserCounter.unread_notifications, UserCounter.unread_chat
+            ).filter(UserCounter.user_id.in_(user_ids))
+        }
+        for uid, (n, c) in _count_unread_from_source(user_ids).items():
+            if stored.get(uid) != (n, c):
+                db.session.query(UserCounter).filter(UserCounter.user_id == uid).update(
+                    {"unread_notifications": n, "unread_chat": c, "updated_at": datetime.utcnow()},
+                    synchronize_session=False,
+                )
+                fixed += 1
+        db.session.commit()
+    if fixed:
+        print(f"[COUNTERS] Corrected {fixed} unread counters")
+    return fixed
+
+
 def _compute_unread_chat_count(user_id: int) -> int:
     try:
-        return int(
-            ChatMessage.query.join(Conversation, ChatMessage.conversation_id == Conversation.id)
-            .filter(ChatMessage.read == False)
-            .filter(ChatMessage.sender_id != int(user_id))
-            .filter((Conversation.user_a == int(user_id)) | (Conversation.user_b == int(user_id)))
-            .count()
-        )
+        return get_unread_counts([user_id]).get(int(user_id), (0, 0))[1]
     except Exception:
+        db.session.rollback()
         return 0
 
 
 def _emit_counts_update(user_id: int):
     """Push authoritative unread counts to the user's personal socket room."""
     try:
-        u = User.query.get(int(user_id))
-        notif_count = get_notification_count(u) if u else 0
-        chat_unread = _compute_unread_chat_count(int(user_id))
+        notif_count, chat_unread = get_unread_counts([user_id]).get(int(user_id), (0, 0))
         socketio.emit(
             "counts_update",
             {
@@ -1152,10 +2730,15 @@ def logout_user():
 
 
 def current_user():
+    """The logged-in User, loaded at most once per request (cached on g)."""
     uid = session.get("user_id")
     if not uid:
         return None
 
+    cached = g.get("_current_user")
+    if cached is not None and cached[0] == uid:
+        return cached[1]
+
     try:
         user = db.session.get(User, uid)
     except Exception:
@@ -1164,20 +2747,244 @@ def current_user():
     # If the DB was reset or user deleted, avoid hard-crashing downstream.
     if user is None:
         logout_user()
+        invalidate_identity(uid)
+        if g.get("_login_required"):
+            # @login_required passed on a cached identity that outlived the
+            # row: treat it as logged out rather than handing the view None.
+            abort(redirect(url_for("login", next=request.path)))
         return None
 
+    g._current_user = (uid, user)
     return user
 
 
+# Cross-request cache of the rarely-changing bits of a user, so auth checks
+# and badge polls don't need a User row. Dropped on any User update/delete.
+Identity = namedtuple("Identity", "id name email is_trusted_helper is_admin")
+IDENTITY_CACHE_TTL_SECONDS = float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "30"))
+_identity_cache = {}  # user_id -> (expires_monotonic, Identity)
+
+
+def current_identity():
+    """Identity of the logged-in user, from the TTL cache when possible."""
+    uid = session.get("user_id")
+    if not uid:
+        return None
+
+    hit = _identity_cache.get(uid)
+    if hit is not None and hit[0] > time.monotonic():
+        return hit[1]
+
+    user = current_user()
+    if user is None:
+        return None
+    ident = Identity(
+        id=user.id,
+        name=user.name,
+        email=user.email,
+        is_trusted_helper=bool(user.is_trusted_helper),
+        is_admin=bool(user.is_admin),
+    )
+    if IDENTITY_CACHE_TTL_SECONDS > 0:
+        _identity_cache[uid] = (time.monotonic() + IDENTITY_CACHE_TTL_SECONDS, ident)
+    return ident
+
+
+def invalidate_identity(user_id):
+    _identity_cache.pop(int(user_id), None)
+
+
+def _invalidate_identity(mapper, connection, target):
+    invalidate_identity(target.id)
+
+
+event.listen(User, "after_update", _invalidate_identity)
+event.listen(User, "after_delete", _invalidate_identity)
+
+
+# ------------------ CROSS-WORKER SYNC (cluster.py) ------------------
+# The mapper events above only reach this process's caches and indexes.
+# With several workers the same changes go to the others once the
+# transaction commits (the live feed shares its own batches, see
+# request_feed.use_cluster).
+
+def _share_user(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        peers.stage(session, "user.changed", {
+            "id": target.id,
+            "name": target.name,
+            "is_trusted_helper": bool(target.is_trusted_helper),
+            "lat": target.lat,
+            "lng": target.lng,
+        })
+
+
+def _share_user_delete(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        peers.stage(session, "user.changed", {"id": target.id, "deleted": True})
+
+
+def _share_request(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is None:
+        return
+    live = (
+        target.status == "open"
+        and target.completed_at is None
+        and target.expires_at is not None
+        and target.expires_at > datetime.utcnow()
+    )
+    data = {"id": target.id}
+    if live:
+        data.update(lat=target.lat, lng=target.lng, expires_at=target.expires_at.isoformat())
+    peers.stage(session, "request.indexed", data)
+
+
+def _share_request_delete(mapper, connection, target):
+    session = sa_inspect(target).session
+    if session is not None:
+        peers.stage(session, "request.indexed", {"id": target.id})
+
+
+if peers.shared:
+    event.listen(User, "after_insert", _share_user)
+    event.listen(User, "after_update", _share_user)
+    event.listen(User, "after_delete", _share_user_delete)
+    event.listen(Request, "after_insert", _share_request)
+    event.listen(Request, "after_update", _share_request)
+    event.listen(Request, "after_delete", _share_request_delete)
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_peer_messages(session):
+    peers.flush_staged(session)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_peer_messages(session):
+    peers.discard_staged(session)
+
+
+def _peer_user_changed(data):
+    uid = int(data["id"])
+    invalidate_identity(uid)
+    _user_name_cache.pop(uid, None)
+    request_feed.feed.forget_user_name(uid)
+    if data.get("deleted"):
+        geo_index.remove("user", uid)
+        return
+    geo_index.upsert("user", uid, data.get("lat"), data.get("lng"))
+    radar_service.radar.update_user(uid, name=data.get("name"), is_helper=data.get("is_trusted_helper"))
+
+
+def _peer_request_indexed(data):
+    if data.get("expires_at"):
+        geo_index.upsert(
+            "request", int(data["id"]), data.get("lat"), data.get("lng"),
+            expires_at=datetime.fromisoformat(data["expires_at"]),
+        )
+    else:
+        geo_index.remove("request", int(data["id"]))
+
+
+def _peer_users_moved(data):
+    for uid, (lat, lng) in (data or {}).items():
+        geo_index.upsert("user", int(uid), lat, lng)
+
+
+def _peer_radar_ping(data):
+    radar_service.radar.record(
+        int(data["user_id"]), data.get("lat"), data.get("lng"), data.get("device_motion"),
+        at=datetime.fromisoformat(data["at"]), name=data.get("name"), is_helper=data.get("is_helper"),
+    )
+
+
+peers.on("user.changed", _peer_user_changed)
+peers.on("request.indexed", _peer_request_indexed)
+peers.on("users.moved", _peer_users_moved)
+peers.on("radar.ping", _peer_radar_ping)
+# Updates sent while the listener was down are lost: reload on (re)subscribe.
+peers.on_subscribed(geo_index.invalidate)
+_peer_listener_started = False
+_serving_requests = False
+
+
+@app.before_request
+def _start_peer_listener():
+    global _peer_listener_started, _serving_requests
+    _serving_requests = True
+    if _peer_listener_started or not peers.shared:
+        return
+    _peer_listener_started = True
+    socketio.start_background_task(peers.run)
+
+
+def _geo_index_live():
+    """
+    Whether this process's geo_index sees every user/request write: a web
+    process whose peer listener is subscribed, or, without a shared store,
+    the single web process that also runs the jobs. Scripts and worker.py
+    never qualify, so their lookups go to the lat/lng columns.
+    """
+    if not _serving_requests:
+        return False
+    if peers.shared:
+        return peers.listening()
+    return JOB_WORKER_MODE == "embedded"
+
+
+geo_index.set_live_check(_geo_index_live)
+
+
+# ------------------ SQL STATEMENT COUNTING ------------------
+# SQL_QUERY_STATS=1 adds X-SQL-Queries / X-SQL-Time-ms headers to every
+# response and logs requests above SQL_QUERY_LOG_THRESHOLD statements.
+SQL_QUERY_STATS = os.getenv("SQL_QUERY_STATS", "0").lower() in ("1", "true", "yes")
+SQL_QUERY_LOG_THRESHOLD = int(os.getenv("SQL_QUERY_LOG_THRESHOLD", "25"))
+
+
+def _count_sql_start(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g._sql_count = g.get("_sql_count", 0) + 1
+        conn.info.setdefault("_sql_started", []).append(time.perf_counter())
+
+
+def _count_sql_end(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("_sql_started")
+    if started and has_request_context():
+        g._sql_ms = g.get("_sql_ms", 0.0) + (time.perf_counter() - started.pop()) * 1000.0
+
+
+if SQL_QUERY_STATS:
+    event.listen(Engine, "before_cursor_execute", _count_sql_start)
+    event.listen(Engine, "after_cursor_execute", _count_sql_end)
+
+
+@app.after_request
+def _sql_stats_headers(response):
+    if SQL_QUERY_STATS:
+        count = g.get("_sql_count", 0)
+        response.headers["X-SQL-Queries"] = str(count)
+        response.headers["X-SQL-Time-ms"] = f"{g.get('_sql_ms', 0.0):.1f}"
+        if count > SQL_QUERY_LOG_THRESHOLD:
+            print(f"[SQL] {request.method} {request.path}: {count} statements")
+    return response
+
+
 def login_required(view_func):
     from functools import wraps
 
     @wraps(view_func)
     def wrapper(*args, **kwargs):
-        # Require both a session user_id and a resolvable User row.
-        if current_user() is None:
+        # Require a session user_id that resolves to a user (cached identity).
+        # A view that then loads the row gets the same redirect if it is gone
+        # (see current_user).
+        if current_identity() is None:
             next_url = request.path
             return redirect(url_for("login", next=next_url))
+        g._login_required = True
         return view_func(*args, **kwargs)
 
     return wrapper
@@ -1232,16 +3039,97 @@ def push_notification(user_id, type, message, link=None):
         print(f"[NOTIFICATION] Error creating notification: {e}")
 
 
+def push_notifications_bulk(recipients, type, message, link=None):
+    """
+    Create the same bell notification for many users at once.
+
+    `recipients` may be user ids or User objects (duplicates are dropped).
+    All rows go in with one executemany INSERT per 1000 users and a single
+    commit, then counts_update is emitted to the online recipients in one
+    pass. Returns the number of notifications written.
+    """
+    user_ids = list(dict.fromkeys(
+        _user_id_of(r) for r in recipients if r is not None
+    ))
+    if not user_ids:
+        return 0
+
+    now = datetime.utcnow()
+    try:
+        for i in range(0, len(user_ids), 1000):
+            db.session.execute(
+                insert(Notification),
+                [
+                    {
+                        "user_id": uid,
+                        "type": type,
+                        "message": message,
+                        "link": link,
+                        "is_read": False,
+                        "created_at": now,
+                    }
+                    for uid in user_ids[i:i + 1000]
+                ],
+            )
+        _bump_unread_counters(db.session, notifications={uid: 1 for uid in user_ids})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[NOTIFICATION] Error creating {len(user_ids)} notifications: {e}")
+        return 0
+
+    _emit_counts_update_many(user_ids)
+    online = sorted(online_presence.online_among(user_ids))
+    if online:
+        bus.publish("notification.created", {"type": type}, users=online)
+    return len(user_ids)
+
+
+def _user_id_of(user_or_id):
+    if isinstance(user_or_id, User):
+        # identity avoids a refresh SELECT when the object was expired by a commit
+        identity = sa_inspect(user_or_id).identity
+        return int(identity[0]) if identity else int(user_or_id.id)
+    return int(user_or_id)
+
+
+def _emit_counts_update_many(user_ids):
+    """counts_update for several users from their counters (online users only)."""
+    targets = sorted(online_presence.online_among(user_ids))
+    if not targets:
+        return
+
+    try:
+        counts = get_unread_counts(targets)
+    except Exception as e:
+        print(f"[NOTIFICATION] counts_update batch failed: {e}")
+        return
+
+    for uid in targets:
+        notif_count, chat_unread = counts.get(uid, (0, 0))
+        try:
+            socketio.emit(
+                "counts_update",
+                {
+                    "notification_count": int(notif_count),
+                    "unread_chat_count": int(chat_unread),
+                },
+                room=f"user_{uid}",
+            )
+        except Exception:
+            pass
+
+
 @app.route("/api/notifications", methods=["GET"])
 @login_required
 def api_notifications():
     """Return unread notifications for the current user (used by the bell UI)."""
-    user = current_user()
-    if not user:
+    ident = current_identity()
+    if not ident:
         return jsonify([])
 
     rows = (
-        Notification.query.filter_by(user_id=user.id, is_read=False)
+        Notification.query.filter_by(user_id=ident.id, is_read=False)
         .order_by(Notification.created_at.desc())
         .limit(20)
         .all()
@@ -1258,7 +3146,7 @@ def api_notifications_mark_all_read():
         return jsonify({"ok": False}), 401
 
     try:
-        Notification.query.filter_by(user_id=user.id, is_read=False).update({"is_read": True})
+        mark_notifications_read(user.id)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -1266,110 +3154,136 @@ def api_notifications_mark_all_read():
     return jsonify({"ok": True})
 
 
-def get_notification_count(user: User) -> int:
+def mark_notifications_read(user_id, **filters):
+    """Mark the user's unread notifications (optionally narrowed by column
+    filters, e.g. type/link) read and update their counter; caller commits."""
+    n = (
+        Notification.query.filter_by(user_id=user_id, is_read=False, **filters)
+        .update({"is_read": True}, synchronize_session=False)
+    )
+    if n:
+        _bump_unread_counters(db.session, notifications={user_id: -n})
+    return n
+
+
+def get_notification_count(user) -> int:
+    """Unread bell count for a User (or user id)."""
     if not user:
         return 0
-    return Notification.query.filter_by(user_id=user.id, is_read=False).count()
+    try:
+        return get_unread_counts([_user_id_of(user)]).get(_user_id_of(user), (0, 0))[0]
+    except Exception:
+        db.session.rollback()
+        return 0
 
 
 @app.route("/api/notification-count", methods=["GET"])
 @login_required
 def api_notification_count():
-    user = current_user()
-    if not user:
+    ident = current_identity()
+    if not ident:
         return jsonify({"count": 0})
-    return jsonify({"count": get_notification_count(user)})
+    return jsonify({"count": get_notification_count(ident.id)})
     
 
 
-# Make current user available in all templates as `current_user`
-@app.context_processor
-def inject_user():
-    # Expose whether translation is available to templates
-    translation_enabled = False
-    if globals().get('gcloud_translate_client'):
-        translation_enabled = True
-    elif globals().get('gt_translator'):
-        translation_enabled = True
+# Make current user available in all templates as `current_user`.
+# The globals are lazy proxies: nothing is computed unless a template reads
+# them, and each value is computed at most once per request (kept on g).
+def _template_translation_enabled():
+    if "_translation_enabled" not in g:
+        g._translation_enabled = bool(globals().get('gcloud_translate_client') or globals().get('gt_translator'))
+    return g._translation_enabled
+
+
+def _template_unread_chat_count():
+    if "_unread_chat_count" not in g:
+        user = current_user()
+        g._unread_chat_count = int(_compute_unread_chat_count(user.id) or 0) if user else 0
+    return g._unread_chat_count
 
-    user = current_user()
 
-    unread_chat_count = _compute_unread_chat_count(user.id) if user else 0
+_lazy_current_user = LocalProxy(current_user)
+_lazy_translation_enabled = LocalProxy(_template_translation_enabled)
+_lazy_unread_chat_count = LocalProxy(_template_unread_chat_count)
 
+
+@app.context_processor
+def inject_user():
     return dict(
-        current_user=user,
-        translation_enabled=translation_enabled,
-        unread_chat_count=int(unread_chat_count or 0),
+        current_user=_lazy_current_user,
+        translation_enabled=_lazy_translation_enabled,
+        unread_chat_count=_lazy_unread_chat_count,
+        socketio_transports=SOCKETIO_TRANSPORTS,
     )
 
 # ------------------ GEO UTILS ------------------
 def haversine_distance_km(lat1, lon1, lat2, lon2):
-    R = 6371.0  # Earth radius in KM
-    lat1_r, lon1_r = math.radians(lat1), math.radians(lon1)
-    lat2_r, lon2_r = math.radians(lat2), math.radians(lon2)
-    dlat = lat2_r - lat1_r
-    dlon = lon2_r - lon1_r
-
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1_r) * math.cos(lat2_r) * math.sin(dlon / 2) ** 2
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    return R * c
+    # Single pair; for many points use geo.distances_km with column lists.
+    return geo.haversine_km(lat1, lon1, lat2, lon2)
 
 # ------------------ EVENT NOTIFICATION SERVICE ------------------
-def notify_nearby_users(event):
-    users = User.query.filter(User.lat.isnot(None), User.lng.isnot(None)).all()
-    notified_count = 0
-
-    for u in users:
-        # Skip the event creator
-        if u.id == event.creator_id:
-            continue
+EVENT_NOTIFY_RADIUS_M = 3000  # 3 km
 
-        try:
-            url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-            params = {
-                "origins": f"{u.lat},{u.lng}",
-                "destinations": f"{event.lat},{event.lng}",
-                "key": GOOGLE_MAPS_API_KEY,
-                "units": "metric"  # Ensure we get meters
-            }
 
-            res = requests.get(url, params=params, timeout=10).json()
+def notify_nearby_users(event):
+    """
+    Notify users within EVENT_NOTIFY_RADIUS_M (route distance) of an event.
 
-            # Check if API response is valid
-            if res.get("status") != "OK":
-                print(f"[DISTANCE API] Error for user {u.email}: {res.get('status')}")
-                continue
+    Road distance is never shorter than straight-line distance, so only users
+    inside the straight-line radius (via geo_index) are sent to the distance
+    provider, in batched and cached matrix calls.
+    """
+    radius_km = EVENT_NOTIFY_RADIUS_M / 1000.0
+    q = User.query.filter(User.id != event.creator_id)
+    candidates = geo_index.filter_query(q, User, "user", event.lat, event.lng, radius_km).all()
+
+    straight = geo.distances_km(event.lat, event.lng, [u.lat for u in candidates], [u.lng for u in candidates])
+    candidates = [u for u, km in zip(candidates, straight) if km <= radius_km]
+    if not candidates:
+        print(f"[EVENT] No users near event '{event.title}'")
+        return 0
 
-            # Check if we have valid elements
-            if not res.get("rows") or not res["rows"][0].get("elements"):
-                print(f"[DISTANCE API] No elements in response for user {u.email}")
-                continue
+    provider = distance_provider.build_provider(
+        api_key=GOOGLE_MAPS_API_KEY,
+        cache=distance_provider.DbDistanceCache(db, DistanceCache),
+    )
+    dest = (float(event.lat), float(event.lng))
+    try:
+        matrix = provider.matrix([(u.lat, u.lng) for u in candidates], [dest])
+    except Exception as e:
+        print(f"[DISTANCE API] Unexpected error for event {event.id}: {e}")
+        return 0
 
-            element = res["rows"][0]["elements"][0]
-            if element.get("status") != "OK":
-                print(f"[DISTANCE API] Element status not OK for user {u.email}: {element.get('status')}")
-                continue
+    notified_count = 0
+    for u in candidates:
+        distance_m = matrix.get(((float(u.lat), float(u.lng)), dest))
+        if distance_m is None or distance_m > EVENT_NOTIFY_RADIUS_M:
+            continue
+        try:
+            send_event_notification(u, event)
+            notified_count += 1
+        except Exception as e:
+            print(f"[EVENT] Failed to notify user {u.email}: {e}")
 
-            distance_m = element["distance"]["value"]
-            print(f"[DISTANCE API] User {u.email} is {distance_m}m from event")
+    print(
+        f"[EVENT] Notified {notified_count} users about event '{event.title}' "
+        f"({len(candidates)} within {radius_km:g} km, provider={provider.name})"
+    )
+    return notified_count
 
-            if distance_m <= 3000:  # 3 km = 3000 meters
-                send_event_notification(u, event)
-                notified_count += 1
-                print(f"[EVENT] Notified user {u.email} about event '{event.title}'")
 
-        except requests.exceptions.RequestException as e:
-            print(f"[DISTANCE API] Request error for user {u.email}: {e}")
-        except (KeyError, IndexError, ValueError) as e:
-            print(f"[DISTANCE API] Parsing error for user {u.email}: {e}")
+def _notify_nearby_users_task(event_id):
+    with app.app_context():
+        try:
+            event = db.session.get(Event, event_id)
+            if event:
+                notify_nearby_users(event)
         except Exception as e:
-            print(f"[DISTANCE API] Unexpected error for user {u.email}: {e}")
+            print(f"[EVENT] Nearby notification failed for event {event_id}: {e}")
+        finally:
+            db.session.remove()
 
-    print(f"[EVENT] Notified {notified_count} users about event '{event.title}'")
 
 def send_event_notification(user, event):
     # Send FCM push notification for nearby event
@@ -1383,37 +3297,120 @@ def send_event_notification(user, event):
 
 
 # ------------------ COMPLETE REQUEST ------------------
-def update_user_scores(user):
-    """Recompute and store user's trust_score and kindness_score based on completed requests."""
-    if not user:
-        return
-
-    # IMPORTANT: use verified Review.duration_hours.
-    # Using (completed_at - created_at) is unreliable because a request may stay open for days.
-    helped_count = (
-        db.session.query(func.count(func.distinct(Review.request_id)))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0
-
-    total_hours = (
-        db.session.query(func.coalesce(func.sum(Review.duration_hours), 0.0))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0.0
-    total_hours = round(float(total_hours), 2)
-
+def compute_user_scores(helped_count, total_hours):
+    """(trust_score, kindness_score) from completed helps and verified hours."""
+    helped_count = int(helped_count or 0)
+    total_hours = round(float(total_hours or 0.0), 2)
     # Simple scoring (tweak if Module-1 has other rules)
     trust_score = min(100, helped_count * 5)           # example: +5 trust per complete
     kindness_score = helped_count * 10 + int(total_hours * 2) + trust_score
+    return int(trust_score), int(kindness_score)
 
-    # Save to DB
-    user.trust_score = int(trust_score)
-    user.kindness_score = int(kindness_score)
 
+def _review_totals(conn, helper_ids=None):
+    """
+    {helper_id: (helped_count, total_hours)} from reviews.
+
+    IMPORTANT: use verified Review.duration_hours.
+    Using (completed_at - created_at) is unreliable because a request may stay open for days.
+    """
+    q = (
+        db.select(
+            Review.helper_id,
+            func.count(func.distinct(Review.request_id)),
+            func.coalesce(func.sum(Review.duration_hours), 0.0),
+        )
+        .group_by(Review.helper_id)
+    )
+    if helper_ids is not None:
+        q = q.where(Review.helper_id.in_(list(helper_ids)))
+    return {int(uid): (int(n or 0), float(h or 0.0)) for uid, n, h in conn.execute(q)}
+
+
+def _store_user_scores(conn, scores):
+    """Write {user_id: (trust, kindness)} with one executemany UPDATE."""
+    if not scores:
+        return
+    table = User.__table__
+    stmt = (
+        table.update()
+        .where(table.c.id == db.bindparam("uid"))
+        .values(trust_score=db.bindparam("trust"), kindness_score=db.bindparam("kindness"))
+    )
+    conn.execute(stmt, [
+        {"uid": int(uid), "trust": trust, "kindness": kindness}
+        for uid, (trust, kindness) in scores.items()
+    ])
+
+
+def _refresh_user_scores(conn, user_ids):
+    """
+    Recompute the scores of just these users (`conn`: Session or Connection)
+    from their user_stats rows, or from reviews for users without one.
+
+    Scores change only when reviews do, so this runs from the Review ledger
+    events inside the writer's transaction; read paths never write.
+    """
+    user_ids = {int(uid) for uid in user_ids if uid is not None}
+    if not user_ids:
+        return
+    totals = {
+        int(uid): (helped, hours)
+        for uid, helped, hours in conn.execute(
+            db.select(UserStats.user_id, UserStats.helped_count, UserStats.review_hours)
+            .where(UserStats.user_id.in_(list(user_ids)))
+        )
+    }
+    missing = user_ids - set(totals)
+    if missing:
+        totals.update(_review_totals(conn, missing))
+    _store_user_scores(conn, {uid: compute_user_scores(*totals.get(uid, (0, 0.0))) for uid in user_ids})
+
+
+def update_user_scores(user):
+    """Recompute and store user's trust_score and kindness_score based on completed requests."""
+    if not user:
+        return
+    _refresh_user_scores(db.session, [_user_id_of(user)])
     db.session.commit()
 
 
+def reconcile_user_scores(batch_size=1000, fix=True):
+    """
+    Rebuild every user's scores in bulk from reviews (one grouped query) and
+    compare with what is stored. Returns {"checked", "mismatched", "fixed"}.
+    """
+    totals = _review_totals(db.session)
+    checked = mismatched = 0
+    fixes = {}
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(User.id, User.trust_score, User.kindness_score)
+            .filter(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for uid, trust, kindness in rows:
+            checked += 1
+            expected = compute_user_scores(*totals.get(uid, (0, 0.0)))
+            if (int(trust or 0), int(kindness or 0)) != expected:
+                mismatched += 1
+                fixes[uid] = expected
+        if fix and fixes:
+            _store_user_scores(db.session, fixes)
+            db.session.commit()
+            fixes = {}
+    if mismatched:
+        verb = "Corrected" if fix else "Found"
+        print(f"[SCORES] {verb} {mismatched} of {checked} user scores")
+    return {"checked": checked, "mismatched": mismatched, "fixed": mismatched if fix else 0}
+
+
 def send_push_to_user(user: User, title: str, body: str, data: dict | None = None):
     """Send a push notification to the user (FCM)."""
     return send_fcm_to_user(user, title=title, body=body, data=data)
@@ -1753,33 +3750,30 @@ def api_emotional_ping():
             helpers = []
             print("EMOTIONAL_PING helpers lookup error:", e)
 
-        for helper in helpers:
-            try:
-                push_notification(
-                    user_id=helper.id,
-                    type="emotional_ping",
-                    message=f"{user.name} is feeling {mood}",
-                    link=url_for("emotional_ping_placeholder"),
-                )
-                notified += 1
-            except Exception as e:
-                print("EMOTIONAL_PING notification error:", e)
+        try:
+            notified = push_notifications_bulk(
+                helpers,
+                type="emotional_ping",
+                message=f"{user.name} is feeling {mood}",
+                link=url_for("emotional_ping_placeholder"),
+            )
+        except Exception as e:
+            print("EMOTIONAL_PING notification error:", e)
 
-            # 3️⃣ Optional FCM push (best-effort)
-            try:
-                if helper.fcm_tokens.count() > 0:
-                    send_fcm_to_user(
-                        helper,
-                        title="New Emotional Ping 💙",
-                        body=f"{user.name} is feeling {mood}",
-                        data={
-                            "type": "EMOTIONAL_PING",
-                            "sender_id": str(user.id),
-                            "ping_id": str(ping.id),
-                        },
-                    )
-            except Exception as e:
-                print("EMOTIONAL_PING FCM error:", e)
+        # 3️⃣ Optional FCM push (best-effort)
+        try:
+            fcm_dispatcher.send(
+                [_user_id_of(h) for h in helpers],
+                title="New Emotional Ping 💙",
+                body=f"{user.name} is feeling {mood}",
+                data={
+                    "type": "EMOTIONAL_PING",
+                    "sender_id": str(user.id),
+                    "ping_id": str(ping.id),
+                },
+            )
+        except Exception as e:
+            print("EMOTIONAL_PING FCM error:", e)
 
         return jsonify({"message": "Ping sent", "ping_id": ping.id, "notified": notified}), 200
 
@@ -2346,12 +4340,40 @@ def api_activity_ping():
     except (TypeError, ValueError):
         device_motion = None
 
+    activity_type = activity_type[:50]
+    created_at = datetime.utcnow()
+
+    radar_service.radar.record(
+        user.id, lat, lng, device_motion,
+        at=created_at, name=user.name, is_helper=user.is_trusted_helper,
+    )
+    if peers.shared:
+        peers.publish("radar.ping", {
+            "user_id": user.id, "lat": lat, "lng": lng, "device_motion": device_motion,
+            "at": created_at.isoformat(), "name": user.name, "is_helper": bool(user.is_trusted_helper),
+        })
+
+    if ACTIVITY_INGEST_MODE == "buffered":
+        activity_ingestor.submit(user.id, lat, lng, activity_type, device_motion, created_at=created_at)
+        return (
+            jsonify({
+                "ok": True,
+                "queued": True,
+                "lat": lat,
+                "lng": lng,
+                "activity_type": activity_type,
+                "device_motion": device_motion,
+            }),
+            202,
+        )
+
     activity = UserActivity(
         user_id=user.id,
         lat=lat,
         lng=lng,
-        activity_type=activity_type[:50],
+        activity_type=activity_type,
         device_motion=device_motion,
+        created_at=created_at,
     )
 
     if lat is not None and lng is not None:
@@ -2412,62 +4434,26 @@ def api_radar_heatmap():
         window_min = 10
     window_min = max(5, min(window_min, 180))
 
-    cutoff = datetime.utcnow() - timedelta(minutes=window_min)
-
-    activities = UserActivity.query.filter(
-        UserActivity.created_at >= cutoff,
-        UserActivity.lat.isnot(None),
-        UserActivity.lng.isnot(None),
-    ).all()
-
-    aggregated = {}
-    for activity in activities:
-        dist = haversine_distance_km(user_lat, user_lng, activity.lat, activity.lng)
-        if dist > radius_km:
-            continue
-
-        entry = aggregated.get(activity.user_id)
-        if not entry:
-            u = User.query.get(activity.user_id)
-            if not u:
-                continue
-            entry = {
-                "user": u,
-                "lat_sum": 0.0,
-                "lng_sum": 0.0,
-                "count": 0,
-                "motion_sum": 0.0,
-                "distance": dist,
-            }
-            aggregated[activity.user_id] = entry
-
-        entry["lat_sum"] += activity.lat
-        entry["lng_sum"] += activity.lng
-        entry["count"] += 1
-        entry["distance"] = min(entry["distance"], dist)
-        if activity.device_motion is not None:
-            entry["motion_sum"] += activity.device_motion
-
+    # Served from the in-memory radar snapshot (no DB reads).
     heatmap_points = []
-    for uid, entry in aggregated.items():
+    for entry in radar_service.radar.heatmap(user_lat, user_lng, radius_km, window_min):
         count = entry["count"] or 1
         motion_avg = (entry["motion_sum"] / count) if entry["motion_sum"] else 0
         activity_intensity = min(100, count * 15)
         if motion_avg > 20:
             activity_intensity = min(100, activity_intensity + (motion_avg / 2))
         weight = round(min(1.0, activity_intensity / 100), 3)
-        user_obj = entry["user"]
 
         heatmap_points.append({
-            "user_id": uid,
-            "name": user_obj.name if user_obj else "User",
+            "user_id": entry["user_id"],
+            "name": entry["name"] or "User",
             "lat": entry["lat_sum"] / count,
             "lng": entry["lng_sum"] / count,
             "weight": weight,
-            "is_helper": bool(user_obj.is_trusted_helper) if user_obj else False,
+            "is_helper": bool(entry["is_helper"]),
             "activity_count": count,
             "motion_avg": round(motion_avg, 1) if motion_avg else 0,
-            "distance_km": round(entry["distance"], 2),
+            "distance_km": round(float(entry["distance"]), 2),
         })
 
     heatmap_points.sort(key=lambda x: x["weight"], reverse=True)
@@ -2483,6 +4469,32 @@ def api_radar_heatmap():
     })
 
 
+@app.route("/api/radar/tiles/<int:z>/<int:x>/<int:y>", methods=["GET"])
+@login_required
+def api_radar_tile(z, x, y):
+    """Pre-aggregated heatmap cells for one map tile, shared across viewers."""
+    if not (radar_service.MIN_TILE_ZOOM <= z <= radar_service.MAX_TILE_ZOOM):
+        return jsonify({
+            "ok": False,
+            "error": f"z must be between {radar_service.MIN_TILE_ZOOM} and {radar_service.MAX_TILE_ZOOM}",
+        }), 400
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"ok": False, "error": "tile out of range"}), 400
+
+    try:
+        window_min = int(request.args.get("window_min", 10))
+    except (TypeError, ValueError):
+        window_min = 10
+    window_min = max(5, min(window_min, 180))
+
+    etag, body = radar_service.radar.tile_payload(z, x, y, window_min)
+    resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = radar_service.TILE_TTL_SECONDS
+    return resp.make_conditional(request)
+
+
 @app.route("/api/radar/active-users", methods=["POST"])
 @login_required
 def api_radar_active_users():
@@ -2505,43 +4517,18 @@ def api_radar_active_users():
         window_min = 10
     window_min = max(5, min(window_min, 180))
 
-    cutoff = datetime.utcnow() - timedelta(minutes=window_min)
-
-    recent_activities = (
-        db.session.query(
-            UserActivity.user_id,
-            func.max(UserActivity.created_at).label("last_activity"),
-            func.avg(UserActivity.lat).label("avg_lat"),
-            func.avg(UserActivity.lng).label("avg_lng"),
-            func.count(UserActivity.id).label("activity_count"),
-            func.avg(UserActivity.device_motion).label("avg_motion"),
-        )
-        .filter(UserActivity.created_at >= cutoff)
-        .group_by(UserActivity.user_id)
-        .all()
-    )
-
+    # Served from the in-memory radar snapshot (no DB reads).
     active_users = []
     now = datetime.utcnow()
 
-    for record in recent_activities:
-        user_id = record[0]
-        last_activity = record[1]
-        avg_lat = record[2]
-        avg_lng = record[3]
-        activity_count = record[4]
-        avg_motion = record[5] or 0
-
-        if avg_lat is None or avg_lng is None:
-            continue
-
-        dist = haversine_distance_km(user_lat, user_lng, avg_lat, avg_lng)
-        if dist > radius_km:
-            continue
-
-        u = User.query.get(user_id)
-        if not u:
-            continue
+    for record in radar_service.radar.active_users(user_lat, user_lng, radius_km, window_min, now=now):
+        user_id = record["user_id"]
+        last_activity = record["last_activity"]
+        avg_lat = record["avg_lat"]
+        avg_lng = record["avg_lng"]
+        activity_count = record["activity_count"]
+        avg_motion = record["avg_motion"] or 0
+        dist = record["distance_km"]
 
         age_secs = (now - last_activity).total_seconds() if last_activity else 0
         recency = max(0, 100 - (age_secs / 3))
@@ -2551,11 +4538,11 @@ def api_radar_active_users():
 
         active_users.append({
             "user_id": user_id,
-            "name": u.name,
-            "is_helper": bool(u.is_trusted_helper),
+            "name": record["name"] or "User",
+            "is_helper": bool(record["is_helper"]),
             "lat": avg_lat,
             "lng": avg_lng,
-            "distance_km": round(dist, 2),
+            "distance_km": round(float(dist), 2),
             "availability_score": availability_score,
             "activity_count": int(activity_count),
             "recency": round(recency, 1),
@@ -2601,25 +4588,21 @@ def api_requests_nearby():
     max_age_seconds = 60 * 60  # last 1 hour
     cutoff = now - timedelta(seconds=max_age_seconds)
 
-    # Base query: only open, not expired, created in last hour, with coordinates
-    q = Request.query.filter(
-        Request.status == "open",
-        Request.expires_at > now,
-        Request.created_at >= cutoff,
-        Request.lat.isnot(None),
-        Request.lng.isnot(None),
-    )
+    # Only open, not expired, created in last hour, with coordinates
+    stmt = requests_nearby_select(now, user_lat, user_lng, radius_km, created_after=cutoff)
 
     viewer = current_user()
     nearby = []
     sos_ids = []
 
-    for r in q.all():
-        dist = haversine_distance_km(user_lat, user_lng, r.lat, r.lng)
+    rows = db.session.scalars(stmt).all()
+    dists = geo.distances_km(user_lat, user_lng, [r.lat for r in rows], [r.lng for r in rows])
+
+    for r, dist in zip(rows, dists):
         if dist > radius_km:
             continue
 
-        item = r.to_dict(include_user=True, user_lat=user_lat, user_lng=user_lng)
+        item = r.to_dict(include_user=True)
 
         cat = (r.category or "").lower()
         if cat == "medicine":
@@ -2630,7 +4613,7 @@ def api_requests_nearby():
             t = "help"
 
         item["type"] = t
-        item["distance_km"] = round(dist, 2)
+        item["distance_km"] = round(float(dist), 2)
 
         is_sos = cat == "sos"
         item["is_sos"] = is_sos
@@ -2718,28 +4701,27 @@ def api_list_requests():
     include_offers = request.args.get("include_offers", "true").lower() == "true"
 
     now = datetime.utcnow()
-    q = Request.query.filter(Request.expires_at > now, Request.status == "open")
-
-    if category:
-        q = q.filter(func.lower(Request.category) == category.lower())
+    stmt = requests_search_select(
+        now, user_lat, user_lng, radius_km, category=category, include_offers=include_offers,
+    )
 
-    if not include_offers:
-        q = q.filter(Request.is_offer == False)  # noqa: E712
+    rows = db.session.scalars(stmt).all()
+    results = []
+    if user_lat is not None and user_lng is not None:
+        located = [r for r in rows if r.lat is not None and r.lng is not None]
+        dists = geo.distances_km(user_lat, user_lng, [r.lat for r in located], [r.lng for r in located])
+        dist_by_id = {r.id: dist for r, dist in zip(located, dists)}
+    else:
+        dist_by_id = {}
 
-    results = []
-    for r in q.all():
-        if (
-            user_lat is not None
-            and user_lng is not None
-            and r.lat is not None
-            and r.lng is not None
-        ):
-            dist = haversine_distance_km(user_lat, user_lng, r.lat, r.lng)
+    for r in rows:
+        if r.id in dist_by_id:
+            dist = dist_by_id[r.id]
             if dist > radius_km:
                 continue
-            results.append(
-                r.to_dict(include_user=True, user_lat=user_lat, user_lng=user_lng)
-            )
+            item = r.to_dict(include_user=True)
+            item["distance_km"] = round(float(dist), 2)
+            results.append(item)
         else:
             results.append(r.to_dict(include_user=True))
 
@@ -2872,30 +4854,13 @@ def need_help():
             expires_at=expires_at,
         )
         db.session.add(req)
-        db.session.commit()
-
+        db.session.flush()
 
         # ---- Push notifications to helpers ----
-        try:
-            print(f"[FCM] Trigger nearby helpers for req {req.id}")
-            send_fcm_for_need_request(req)
-
-        except Exception as e:
-            print("[FCM] nearby help push error:", e)
-
-        # Fallback / additional broadcast: notify all trusted helpers with FCM tokens
-        try:
-            send_fcm_to_trusted_helpers(
-                title="Someone nearby needs help",
-                body=f"{user.name} posted: “{title}” (category: {category})",
-                data={
-                    "type": "NEED_HELP",
-                    "request_id": req.id,
-                    "category": category,
-                },
-            )
-        except Exception as e:
-            print("[FCM] Failed to broadcast need_help notification:", e)
+        # Queued in the same transaction as the post; a worker does the
+        # fan-out (see fan_out_need_request), so posting stays fast.
+        job_queue.enqueue("need_request_fanout", {"request_id": req.id}, commit=False)
+        db.session.commit()
 
         # ---- Flash + redirect as before ----
 
@@ -2909,35 +4874,13 @@ def need_help():
     # ---------- GET: show form + sidebar stats ----------
     now = datetime.utcnow()
 
-    posts = (
-        Request.query.filter(
-            Request.expires_at > now,
-            Request.is_offer == False,  # noqa: E712
-            Request.status == "open",
-        )
-        .order_by(Request.created_at.desc())
-        .limit(50)
-        .all()
-    )
+    posts = db.session.scalars(open_posts_select(now, is_offer=False).limit(50)).all()
 
     flagged_map = build_flagged_map_for_requests(posts)
 
-    total_need = Request.query.filter(
-        Request.is_offer == False,
-        Request.expires_at > now,
-    ).count()
-
-    total_offer = Request.query.filter(
-        Request.is_offer == True,
-        Request.expires_at > now,
-    ).count()
-
-    categories = (
-        db.session.query(Request.category, func.count(Request.id))
-        .filter(Request.expires_at > now)
-        .group_by(Request.category)
-        .all()
-    )
+    total_need = db.session.scalar(posts_count_select(now, is_offer=False))
+    total_offer = db.session.scalar(posts_count_select(now, is_offer=True))
+    categories = db.session.execute(category_counts_select(now)).all()
 
     return render_template(
         "need_help.html",
@@ -3020,31 +4963,11 @@ def can_help():
         return redirect(url_for("can_help"))
 
     now = datetime.utcnow()
-    posts = (
-        Request.query.filter(
-            Request.expires_at > now,
-            Request.is_offer == True,  # noqa: E712
-            Request.status == "open",
-        )
-        .order_by(Request.created_at.desc())
-        .limit(50)
-        .all()
-    )
+    posts = db.session.scalars(open_posts_select(now, is_offer=True).limit(50)).all()
 
-    total_need = Request.query.filter(
-        Request.is_offer == False,
-        Request.expires_at > now,
-    ).count()
-    total_offer = Request.query.filter(
-        Request.is_offer == True,
-        Request.expires_at > now,
-    ).count()
-    categories = (
-        db.session.query(Request.category, func.count(Request.id))
-        .filter(Request.expires_at > now)
-        .group_by(Request.category)
-        .all()
-    )
+    total_need = db.session.scalar(posts_count_select(now, is_offer=False))
+    total_offer = db.session.scalar(posts_count_select(now, is_offer=True))
+    categories = db.session.execute(category_counts_select(now)).all()
 
     return render_template(
         "can_help.html",
@@ -3243,9 +5166,8 @@ def complete_request(request_id):
     db.session.add(review)
     db.session.commit()
 
-    # 6. UPDATE SCORES
+    # 6. Stats and scores were updated with the review (see _review_ledger)
     giver_user = User.query.get(giver_id)
-    update_user_scores(giver_user)
 
     flash(f"Verified! {actual_hours} hours added to {giver_user.name}'s profile.", "success")
     return redirect(url_for("dashboard"))
@@ -3302,7 +5224,6 @@ def complete_sos(request_id: int, helper_id: int):
 
     helper_user = User.query.get(helper_id)
     if helper_user:
-        update_user_scores(helper_user)
         flash(f"SOS marked complete. {actual_hours} hours added to {helper_user.name}.", "success")
     else:
         flash("SOS marked complete.", "success")
@@ -3323,18 +5244,9 @@ def list_requests():
     now = datetime.utcnow()
     mode = request.args.get("mode", "need")  # default: show need-help posts
 
-    q = Request.query.filter(
-        Request.expires_at > now,
-        Request.status == "open",
-    )
-
-    if mode == "offer":
-        q = q.filter(Request.is_offer == True)  # noqa: E712
-    elif mode == "need":
-        q = q.filter(Request.is_offer == False)  # noqa: E712
-    # if mode == "all" -> no extra filter
-
-    requests_list = q.order_by(Request.created_at.desc()).all()
+    # mode == "all" -> both kinds
+    is_offer = {"offer": True, "need": False}.get(mode)
+    requests_list = db.session.scalars(open_posts_select(now, is_offer=is_offer)).all()
 
     flagged_map = build_flagged_map_for_requests(requests_list)
 
@@ -3534,7 +5446,8 @@ def create_event():
         db.session.add(event)
         db.session.commit()
 
-        notify_nearby_users(event)
+        # Distance lookups + pushes can take a while; keep them off the request.
+        socketio.start_background_task(_notify_nearby_users_task, event.id)
 
         flash("Event created & nearby users notified!", "success")
         return redirect(url_for("dashboard"))
@@ -3672,34 +5585,8 @@ def chat_with_user(other_user_id):
     other = User.query.get_or_404(other_user_id)
     conv = get_or_create_conversation(user.id, other.id)
     
-    # Get all conversations for sidebar
-    all_convs = Conversation.query.filter(
-        (Conversation.user_a == user.id) | (Conversation.user_b == user.id)
-    ).all()
-    
-    # Build conversation list with details
-    conversations_list = []
-    for c in all_convs:
-        other_user_in_conv = User.query.get(c.user_a if c.user_b == user.id else c.user_b)
-        if other_user_in_conv:
-            last_msg = ChatMessage.query.filter_by(conversation_id=c.id).order_by(ChatMessage.created_at.desc()).first()
-            unread_count = ChatMessage.query.filter_by(conversation_id=c.id, read=False).filter(ChatMessage.sender_id != user.id).count()
-            conversations_list.append({
-                'id': c.id,
-                'other_user': other_user_in_conv,
-                'last_message': last_msg.text if last_msg else '',
-                'last_message_time': last_msg.created_at if last_msg else None,
-                'unread_count': unread_count,
-                'is_active': c.id == conv.id
-            })
-    
-    # Sort by last message time (newest first)
-    conversations_list.sort(key=lambda x: x['last_message_time'] if x['last_message_time'] else datetime.min, reverse=True)
-    
-    # prefetch last 100 messages
-    messages = (
-        ChatMessage.query.filter_by(conversation_id=conv.id).order_by(ChatMessage.created_at.asc()).limit(100).all()
-    )
+    # latest page; older ones are loaded by chat.js as the user scrolls up
+    messages, has_more_messages = chat_history_page(conv.id)
     # mark unread messages (sent by other user) as read when opening the conversation
     try:
         unread_msgs = ChatMessage.query.filter_by(conversation_id=conv.id, read=False).filter(ChatMessage.sender_id != user.id).all()
@@ -3720,7 +5607,7 @@ def chat_with_user(other_user_id):
     # Best-effort: mark chat notifications for this conversation as read.
     try:
         link = url_for("chat_with_user", other_user_id=other.id)
-        Notification.query.filter_by(user_id=user.id, is_read=False, type="chat", link=link).update({"is_read": True})
+        mark_notifications_read(user.id, type="chat", link=link)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -3730,9 +5617,32 @@ def chat_with_user(other_user_id):
         _emit_counts_update(user.id)
     except Exception:
         pass
+    # Sidebar: the most recent conversations, one query (conversation_inbox); built
+    # after the commits above so the rows are not expired before rendering
+    inbox, _ = conversation_inbox(user.id)
+    if not any(item['conversation'].id == conv.id for item in inbox):
+        # past the first page (e.g. just opened, no messages yet): list it first
+        current = conversation_inbox_entry(user.id, conv.id)
+        if current is not None:
+            inbox.insert(0, current)
+    conversations_list = [
+        {
+            'id': item['conversation'].id,
+            'other_user': item['other'],
+            'last_message': item['last_message'] or '',
+            'last_message_time': item['last_message_at'],
+            'unread_count': item['unread_count'],
+            'is_active': item['conversation'].id == conv.id,
+        }
+        for item in inbox
+    ]
+
     # serialize messages for JSON/template safety
-    messages_serialized = [serialize_message(m) for m in messages]
-    return render_template("chat.html", conversation=conv, other_user=other, messages=messages_serialized, conversations=conversations_list)
+    messages_serialized = serialize_messages(messages)
+    return render_template(
+        "chat.html", conversation=conv, other_user=other, messages=messages_serialized,
+        has_more_messages=has_more_messages, conversations=conversations_list,
+    )
 
 
 @app.route("/chat")
@@ -3742,30 +5652,14 @@ def chat_index():
         # allow quick guest access to chat via Emergency Guest account
         user = get_emergency_user()
         login_user(user)
-    # list conversations for the user
-    convs = Conversation.query.filter(
-        (Conversation.user_a == user.id) | (Conversation.user_b == user.id)
-    ).all()
-
-    conversations = []
-    for c in convs:
-        other_id = c.user_a if c.user_b == user.id else c.user_b
-        other = User.query.get(other_id)
-        last = (
-            ChatMessage.query.filter_by(conversation_id=c.id).order_by(ChatMessage.created_at.desc()).first()
-        )
-        # count unread messages in this conversation that were sent by the other user
-        unread_count = ChatMessage.query.filter_by(conversation_id=c.id, read=False).filter(ChatMessage.sender_id != user.id).count()
-        conversations.append({
-            "conversation": c,
-            "other": other,
-            "last_message": last.text if last else None,
-            "last_time": int(last.created_at.timestamp()) if last else None,
-            "unread_count": unread_count,
-        })
-
-    # Sort by newest last message so recent chats appear at top.
-    conversations.sort(key=lambda x: (x.get("last_time") or 0), reverse=True)
+    # list conversations for the user, newest first, a page at a time
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except (TypeError, ValueError):
+        page = 1
+    conversations, has_more = conversation_inbox(
+        user.id, limit=INBOX_PAGE_SIZE, offset=(page - 1) * INBOX_PAGE_SIZE
+    )
 
     conversation_ids = [item["conversation"].id for item in conversations]
 
@@ -3776,6 +5670,8 @@ def chat_index():
         conversations=conversations,
         helpers=helpers,
         conversation_ids=conversation_ids,
+        page=page,
+        has_more=has_more,
     )
 
 @app.route("/suggestions")
@@ -3789,53 +5685,62 @@ def suggestions_dashboard():
 
 @app.route("/api/nearby-requests", methods=["GET"])
 def api_nearby_requests():
-    """Get nearby requests using user or fallback location"""
+    """
+    Nearby live requests, served from the versioned feed snapshot.
+
+    Clients pass back the `version` they last saw as `?since_version=`:
+    304 if nothing changed since, otherwise a delta (`upserts` within the
+    radius and `removed` ids) while that version is still in the feed's
+    change log, or the full nearest-first list (`requests`).
+    """
     try:
-        user = current_user()
-        limit = request.args.get("limit", type=int, default=10)
+        feed = request_feed.feed
+        since_version = request.args.get("since_version", type=int)
 
-        fallback_lat = float(os.getenv("DEFAULT_LAT", "23.8103"))
-        fallback_lng = float(os.getenv("DEFAULT_LNG", "90.4125"))
+        # Idle poll: no database work at all.
+        feed.ensure_current()
+        if since_version is not None and since_version == feed.version:
+            return "", 304
+
+        ident = current_identity()
+        limit = request.args.get("limit", type=int, default=10)
 
         user_lat = request.args.get("lat", type=float)
         user_lng = request.args.get("lng", type=float)
-
-        if user_lat is None:
-            user_lat = getattr(user, "lat", None) or fallback_lat
-        if user_lng is None:
-            user_lng = getattr(user, "lng", None) or fallback_lng
-
-        exclude_user_id = getattr(user, "id", None)
-
-        nearby = LocationMatcher.get_nearby_requests(
-            db=db,
-            Request=Request,
-            user_lat=user_lat,
-            user_lng=user_lng,
-            exclude_user_id=exclude_user_id,
-            limit=limit
+        if user_lat is None or user_lng is None:
+            user = current_user() if ident else None
+            if user_lat is None:
+                user_lat = getattr(user, "lat", None) or float(os.getenv("DEFAULT_LAT", "23.8103"))
+            if user_lng is None:
+                user_lng = getattr(user, "lng", None) or float(os.getenv("DEFAULT_LNG", "90.4125"))
+
+        user_id = ident.id if ident else None
+        result = feed.view(
+            user_lat, user_lng, SUGGESTION_RADIUS_KM, limit,
+            exclude_user_id=user_id, since_version=since_version,
         )
+        if result.get("unchanged"):
+            return "", 304
 
         # Mark which requests already have an offer from this user
+        rows = result.get("requests") if result["full"] else result.get("upserts")
         try:
-            user_id = getattr(user, "id", None)
-            if user_id and nearby:
-                nearby_ids = [int(r.get("id")) for r in nearby if r.get("id") is not None]
-                if nearby_ids:
-                    offered_rows = (
-                        Offer.query.filter(Offer.request_id.in_(nearby_ids))
-                        .filter((Offer.helper_id == user_id) | (Offer.user_id == user_id))
-                        .all()
-                    )
-                    offered_ids = {int(o.request_id) for o in offered_rows if getattr(o, "request_id", None) is not None}
-                    for r in nearby:
-                        rid = r.get("id")
-                        if rid is not None:
-                            r["already_offered"] = int(rid) in offered_ids
+            if user_id and rows:
+                nearby_ids = [int(r["id"]) for r in rows]
+                offered_ids = {
+                    int(rid)
+                    for (rid,) in db.session.query(Offer.request_id)
+                    .filter(Offer.request_id.in_(nearby_ids))
+                    .filter((Offer.helper_id == user_id) | (Offer.user_id == user_id))
+                    .all()
+                    if rid is not None
+                }
+                for r in rows:
+                    r["already_offered"] = int(r["id"]) in offered_ids
         except Exception:
             pass
 
-        return jsonify({"requests": nearby}), 200
+        return jsonify(result), 200
     except Exception as e:
         print(f"[API] Error in api_nearby_requests: {e}")
         return jsonify({"error": str(e)}), 500
@@ -3845,8 +5750,7 @@ def api_nearby_requests():
 def dashboard():
     user = current_user()
 
-    # Make sure scores are up to date
-    update_user_scores(user)
+    # Scores are kept current by the Review events; this page only reads.
 
     # Badge label + Tailwind color class
     badge, badge_color = user.calculate_badge()
@@ -3899,7 +5803,7 @@ def dashboard():
         "badge_color": badge_color,       # e.g. "text-yellow-300"
         "helped": helped_count,          # total people helped
         "total_hours": total_hours_all,      # total hours volunteered (all-time)
-        "trust": user.trust_score or 0,  # 0–100 (we already cap in update_user_scores)
+        "trust": user.trust_score or 0,  # 0–100 (capped in compute_user_scores)
         "kindness": user.kindness_score or 0,
     }
 
@@ -3958,28 +5862,12 @@ def dashboard():
     # Dashboard task lists: query explicitly (avoid relying on relationship loader behavior)
     now = datetime.utcnow()
 
-    my_posts = (
-        Request.query.filter(
-            Request.user_id == user.id,
-            Request.status.in_(["open", "in_progress", "claimed"]),
-        )
-        .order_by(Request.created_at.desc())
-        .all()
-    )
+    my_posts = db.session.scalars(user_active_posts_select(user.id)).all()
 
     # Also include expired posts that received no responses, so the user can remove them.
     # (These are often auto-closed and would otherwise not show up in the dashboard list.)
     try:
-        expired_candidates = (
-            Request.query.filter(
-                Request.user_id == user.id,
-                Request.expires_at <= now,
-                Request.helper_id == None,  # noqa: E711
-            )
-            .order_by(Request.created_at.desc())
-            .limit(200)
-            .all()
-        )
+        expired_candidates = db.session.scalars(user_expired_unanswered_candidates_select(user.id, now)).all()
         expired_unanswered = []
         for r in expired_candidates:
             cat = (getattr(r, "category", "") or "").lower()
@@ -4004,14 +5892,7 @@ def dashboard():
             my_posts.sort(key=lambda x: x.created_at or datetime.min, reverse=True)
     except Exception:
         pass
-    active_engagements = (
-        Request.query.filter(
-            Request.helper_id == user.id,
-            Request.status.in_(["in_progress", "claimed"]),
-        )
-        .order_by(Request.created_at.desc())
-        .all()
-    )
+    active_engagements = db.session.scalars(helper_engagements_select(user.id)).all()
     pending_offers = (
         Offer.query.filter(
             Offer.user_id == user.id,
@@ -4102,23 +5983,13 @@ def remove_expired_unanswered_request(request_id):
 @login_required
 def api_dashboard_summary():
     user = current_user()
-    # update scores (make sure values are fresh)
-    update_user_scores(user)
+    # Pure read: scores are maintained when reviews are written.
 
+    stats = get_user_stat(user.id)
     # total hours volunteered (verified review durations)
-    total_hours = (
-        db.session.query(func.coalesce(func.sum(Review.duration_hours), 0.0))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0.0
-    total_hours = round(float(total_hours), 2)
-
+    total_hours = round(float(stats["review_hours"]), 2)
     # people helped: distinct reviewers who left a completion review for this helper
-    people_helped = (
-        db.session.query(func.count(func.distinct(Review.reviewer_id)))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0
+    people_helped = stats["people_helped"]
 
     return jsonify({
         "total_hours": total_hours,
@@ -4279,6 +6150,30 @@ def submit_manual_payment():
         flash(f"Payment submitted (৳{int(amount)}). Wait for Admin approval to activate Premium.", "success")
     return redirect(url_for('dashboard'))
 
+@app.route("/admin/jobs/stats")
+@login_required
+def admin_job_stats():
+    """Queue depth and per-kind job timings (JSON)."""
+    user = current_user()
+    if not user.is_admin and user.email != "admin@lifeline.com":
+        return jsonify({"error": "Admins only"}), 403
+    return jsonify(job_queue.stats())
+
+
+@app.route("/admin/activity/stats")
+@login_required
+def admin_activity_stats():
+    """Activity ping buffer depth, flush latency and retention runs (JSON)."""
+    user = current_user()
+    if not user.is_admin and user.email != "admin@lifeline.com":
+        return jsonify({"error": "Admins only"}), 403
+    return jsonify(dict(
+        activity_ingestor.stats(),
+        mode=ACTIVITY_INGEST_MODE,
+        retention={"last_run": activity_retention.last_run, "totals": activity_retention.totals},
+    ))
+
+
 # --- ADMIN DASHBOARD ---
 @app.route("/admin/dashboard")
 @login_required
@@ -4422,19 +6317,11 @@ def api_impact_summary():
 
     # resources shared count (Resource model exists)
     resources_shared = Resource.query.filter(Resource.user_id == user.id).count()
+    stats = get_user_stat(user.id)
     # hours volunteered (verified review durations)
-    hours_vol = (
-        db.session.query(func.coalesce(func.sum(Review.duration_hours), 0.0))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0.0
-    hours_vol = float(hours_vol)
+    hours_vol = float(stats["review_hours"])
     # helped people
-    helped_people = (
-        db.session.query(func.count(func.distinct(Review.reviewer_id)))
-        .filter(Review.helper_id == user.id)
-        .scalar()
-    ) or 0
+    helped_people = stats["people_helped"]
     # carbon saved estimate (example: each resource share counts as 0.5 "unit" saved)
     carbon_units = db.session.query(func.coalesce(func.sum(Resource.quantity), 0)).filter(Resource.user_id == user.id).scalar() or 0
     # convert to percent (arbitrary scale for UI)
@@ -4668,17 +6555,11 @@ def api_home_summary():
         now = datetime.utcnow()
         week_ago = now - timedelta(days=7)
 
-        open_requests = (
-            Request.query.filter(Request.status == "open")
-            .filter(Request.expires_at > now)
-            .count()
-        )
+        open_requests = db.session.scalar(open_requests_count_select(now))
 
         helpers = User.query.filter(User.is_trusted_helper == True).count()  # noqa: E712
 
-        matched_requests = (
-            Request.query.filter(Request.status.in_(["claimed", "closed"])).count()
-        )
+        matched_requests = db.session.scalar(matched_requests_count_select())
 
         # Home stats:
         # - "Helped this week" reflects how many *people* the logged-in user helped (unique counterparts)
@@ -4711,22 +6592,11 @@ def api_home_summary():
 
             helped_recent = len(helped_user_ids)
 
-            # All-time hours credited to this user:
+            # All-time hours credited to this user (user_stats ledger):
             # - Review.duration_hours for completed requests where this user was credited as helper
             # - ImpactLog.hours for completed events attributed to this user
-            review_hours = (
-                db.session.query(func.coalesce(func.sum(Review.duration_hours), 0.0))
-                .filter(Review.helper_id == user.id)
-                .scalar()
-                or 0.0
-            )
-            event_hours = (
-                db.session.query(func.coalesce(func.sum(ImpactLog.hours), 0.0))
-                .filter(ImpactLog.helper_id == user.id)
-                .scalar()
-                or 0.0
-            )
-            volunteer_hours_total = float(review_hours) + float(event_hours)
+            stats = get_user_stat(user.id)
+            volunteer_hours_total = float(stats["review_hours"]) + float(stats["event_hours"])
 
         return jsonify(
             {
@@ -4879,31 +6749,13 @@ def trigger_sos():
         except Exception:
             db.session.rollback()
 
-    # Broadcast to all trusted helpers (verified helpers). Location filtering can be
-    # added later; for now "all trusted helpers" matches the SOS broadcast intent.
-    helpers = User.query.filter(User.is_trusted_helper == True, User.id != user.id).all()  # noqa: E712
-
-    for h in helpers:
-        try:
-            push_notification(
-                user_id=h.id,
-                type="sos",
-                message=f"🚨 SOS: {user.name} needs immediate help nearby!",
-                link=url_for("map_page", focus_request_id=sos_req.id),
-            )
-        except Exception:
-            pass
-
-        try:
-            if h.fcm_tokens.count() > 0:
-                send_fcm_to_user(
-                    h,
-                    title="🚨 SOS ALERT!",
-                    body=f"EMERGENCY: {user.name} needs help nearby!",
-                    data={"type": "SOS_ALERT", "request_id": str(sos_req.id)},
-                )
-        except Exception:
-            pass
+    # Alert trusted helpers ring by ring (1 km, 3 km, 10 km, everyone); later
+    # rings are queued jobs that only fire while nobody has responded.
+    try:
+        dispatch_sos_ring(sos_req, 0)
+    except Exception as e:
+        db.session.rollback()
+        print(f"[SOS] Ring dispatch failed for request {sos_req.id}: {e}")
 
     # Persist active SOS id so the UI can keep the fallback timer across pages.
     try:
@@ -5048,6 +6900,11 @@ def api_sos_respond(request_id):
     db.session.add(resp)
     db.session.commit()
 
+    try:
+        record_sos_response_latency(req_obj.id)
+    except Exception:
+        db.session.rollback()
+
     try:
         push_notification(
             user_id=req_obj.user_id,
@@ -5174,8 +7031,24 @@ def api_get_messages(conv_id):
     user = current_user()
     if user.id not in conv.participants():
         return jsonify({"error": "Unauthorized"}), 403
-    msgs = ChatMessage.query.filter_by(conversation_id=conv.id).order_by(ChatMessage.created_at.asc()).all()
-    return jsonify({"messages": [serialize_message(m) for m in msgs]})
+
+    # ?before_id= (older) / ?after_id= (newer) / neither (latest); &limit=
+    try:
+        before_id = int(request.args["before_id"]) if request.args.get("before_id") else None
+        after_id = int(request.args["after_id"]) if request.args.get("after_id") else None
+        limit = int(request.args.get("limit") or CHAT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "before_id, after_id and limit must be integers"}), 400
+    if before_id is not None and after_id is not None:
+        return jsonify({"error": "use before_id or after_id, not both"}), 400
+
+    msgs, has_more = chat_history_page(conv.id, before_id=before_id, after_id=after_id, limit=limit)
+    return jsonify({
+        "messages": serialize_messages(msgs),
+        "has_more": has_more,
+        "before_id": msgs[0].id if msgs else before_id,
+        "after_id": msgs[-1].id if msgs else after_id,
+    })
 
 
 @app.route("/api/conversations/<int:conv_id>/mark_read", methods=["POST"])
@@ -5205,7 +7078,7 @@ def api_mark_conversation_read(conv_id):
         try:
             other_id = conv.user_a if conv.user_b == user.id else conv.user_b
             link = url_for("chat_with_user", other_user_id=other_id)
-            Notification.query.filter_by(user_id=user.id, is_read=False, type="chat", link=link).update({"is_read": True})
+            mark_notifications_read(user.id, type="chat", link=link)
             db.session.commit()
         except Exception:
             db.session.rollback()
@@ -5221,6 +7094,253 @@ def api_mark_conversation_read(conv_id):
         return jsonify({"error": "failed"}), 500
 
 
+# ------------------ CHAT ATTACHMENTS ------------------
+# Chunked, resumable uploads (see attachments.py). The chat message then
+# carries only the attachment id and URL.
+chat_attachment_store = attachments.LocalObjectStore(
+    os.getenv("CHAT_ATTACHMENT_DIR") or os.path.join(app.instance_path, "chat_attachments")
+)
+CHAT_ATTACHMENT_STALE_HOURS = int(os.getenv("CHAT_ATTACHMENT_STALE_HOURS", "24"))
+
+
+def _upload_state(att):
+    state = {
+        "attachment_id": att.id,
+        "status": att.status,
+        "size": att.size,
+        "offset": att.size if att.status == "ready" else chat_attachment_store.received(str(att.id)),
+        "chunk_size": attachments.CHUNK_SIZE_BYTES,
+    }
+    if att.status == "ready":
+        state["attachment"] = attachment_payload(att)
+    return state
+
+
+def _own_upload(attachment_id):
+    """The current user's attachment, or an error response."""
+    att = db.session.get(ChatAttachment, attachment_id)
+    if att is None or att.uploader_id != current_identity().id:
+        return None, (jsonify({"error": "Not found"}), 404)
+    return att, None
+
+
+def _can_reuse_attachment(sha256, size, user_id, conv_id):
+    """
+    Whether a client-supplied sha256 may stand in for the upload: only for
+    a file the user could already read. Otherwise knowing a hash would hand
+    out another chat's file (and reveal that it exists).
+    """
+    return db.session.query(
+        ChatAttachment.query.filter(
+            ChatAttachment.sha256 == sha256,
+            ChatAttachment.size == size,
+            ChatAttachment.status == "ready",
+            or_(ChatAttachment.uploader_id == user_id, ChatAttachment.conversation_id == conv_id),
+        ).exists()
+    ).scalar()
+
+
+@app.route("/api/chat/<int:conv_id>/attachments", methods=["POST"])
+@login_required
+def api_create_chat_attachment(conv_id):
+    """
+    Start an upload: {file_name, size, content_type?, sha256?}. When this
+    user uploaded the same file (sha256 and size) before, or it was already
+    sent in this conversation, the attachment is ready at once and nothing
+    needs to be uploaded. Any other file goes through the upload; finish()
+    still stores identical content only once.
+    """
+    conv = Conversation.query.get_or_404(conv_id)
+    user_id = current_identity().id
+    if user_id not in conv.participants():
+        return jsonify({"error": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "size required"}), 400
+    if size <= 0 or size > attachments.MAX_ATTACHMENT_BYTES:
+        return jsonify({"error": f"size must be 1..{attachments.MAX_ATTACHMENT_BYTES} bytes"}), 413
+
+    att = ChatAttachment(
+        conversation_id=conv.id,
+        uploader_id=user_id,
+        file_name=attachments.clean_file_name(data.get("file_name")),
+        content_type=(data.get("content_type") or "application/octet-stream")[:100],
+        size=size,
+    )
+    sha256 = attachments.normalize_sha256(data.get("sha256"))
+    if (
+        sha256
+        and _can_reuse_attachment(sha256, size, user_id, conv.id)
+        and chat_attachment_store.has_object(sha256, size)
+    ):
+        att.sha256 = sha256
+        att.status = "ready"
+        att.completed_at = datetime.utcnow()
+    db.session.add(att)
+    db.session.commit()
+    return jsonify(_upload_state(att)), 201
+
+
+@app.route("/api/chat/attachments/<int:attachment_id>", methods=["GET"])
+@login_required
+def api_chat_attachment_status(attachment_id):
+    """Upload progress, to resume after a dropped connection."""
+    att, error = _own_upload(attachment_id)
+    if error:
+        return error
+    return jsonify(_upload_state(att))
+
+
+@app.route("/api/chat/attachments/<int:attachment_id>", methods=["PUT"])
+@login_required
+def api_upload_chat_attachment_chunk(attachment_id):
+    """Raw chunk bytes in the body, written at ?offset= (streamed to disk)."""
+    att, error = _own_upload(attachment_id)
+    if error:
+        return error
+    if att.status == "ready":
+        return jsonify(_upload_state(att))
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return jsonify({"error": "offset required"}), 400
+    length = request.content_length or 0
+
+    try:
+        new_offset = chat_attachment_store.append(str(att.id), offset, request.stream, length, att.size)
+    except attachments.UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+    return jsonify({"attachment_id": att.id, "status": att.status, "offset": new_offset, "size": att.size})
+
+
+@app.route("/api/chat/attachments/<int:attachment_id>/complete", methods=["POST"])
+@login_required
+def api_complete_chat_attachment(attachment_id):
+    """Verify and store the uploaded file; the body may repeat {sha256}."""
+    att, error = _own_upload(attachment_id)
+    if error:
+        return error
+    if att.status == "ready":
+        return jsonify(_upload_state(att))
+
+    key = str(att.id)
+    received = chat_attachment_store.received(key)
+    if received != att.size:
+        return jsonify({"error": "upload incomplete", "offset": received}), 409
+
+    sha256, size = chat_attachment_store.finish(key)
+    expected = attachments.normalize_sha256((request.get_json(silent=True) or {}).get("sha256"))
+    if expected and expected != sha256:
+        # Corrupted on the way: start over (the stored object is just unreferenced).
+        return jsonify({"error": "sha256 mismatch", "offset": 0}), 422
+
+    att.sha256 = sha256
+    att.size = size
+    att.status = "ready"
+    att.completed_at = datetime.utcnow()
+    db.session.commit()
+    return jsonify(_upload_state(att))
+
+
+@app.route("/chat/attachments/<int:attachment_id>")
+@login_required
+def download_chat_attachment(attachment_id):
+    att = db.session.get(ChatAttachment, attachment_id)
+    if att is None or att.status != "ready":
+        abort(404)
+    conv = db.session.get(Conversation, att.conversation_id)
+    if conv is None or current_identity().id not in conv.participants():
+        abort(404)
+    path = chat_attachment_store.object_path(att.sha256)
+    if not os.path.exists(path):
+        abort(404)
+
+    inline = attachments.is_inline_image(att.content_type)
+    response = send_file(
+        path,
+        mimetype=att.content_type if inline else "application/octet-stream",
+        as_attachment=not inline,
+        download_name=att.file_name,
+        conditional=True,
+        etag=att.sha256,
+        max_age=86400,
+    )
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+def store_legacy_attachment(conv, user_id, file_data, file_name, content_type=None):
+    """
+    Persist a base64 file sent inside a socket event by older clients, so it
+    is broadcast as an attachment URL like any other. Returns None when the
+    data is not valid base64.
+    """
+    if isinstance(file_data, str) and file_data.startswith("data:") and "," in file_data:
+        header, file_data = file_data.split(",", 1)
+        content_type = content_type or header[5:].split(";")[0]
+    try:
+        raw = base64.b64decode(file_data or "", validate=True)
+    except (TypeError, ValueError):
+        return None
+    if not raw or len(raw) > attachments.MAX_ATTACHMENT_BYTES:
+        return None
+
+    sha256, size = chat_attachment_store.put_bytes(raw)
+    att = ChatAttachment(
+        conversation_id=conv.id,
+        uploader_id=user_id,
+        file_name=attachments.clean_file_name(file_name),
+        content_type=(content_type or "application/octet-stream")[:100],
+        size=size,
+        sha256=sha256,
+        status="ready",
+        completed_at=datetime.utcnow(),
+    )
+    db.session.add(att)
+    return att
+
+
+def cleanup_chat_attachments(stale_hours=None):
+    """
+    Drop uploads left unfinished for CHAT_ATTACHMENT_STALE_HOURS and stored
+    files that no attachment refers to any more.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=stale_hours or CHAT_ATTACHMENT_STALE_HOURS)
+    stale = (
+        ChatAttachment.query.filter(ChatAttachment.status == "uploading", ChatAttachment.created_at < cutoff)
+        .filter(~db.session.query(ChatMessage.id).filter(ChatMessage.attachment_id == ChatAttachment.id).exists())
+        .all()
+    )
+    for att in stale:
+        chat_attachment_store.discard(str(att.id))
+        db.session.delete(att)
+    db.session.commit()
+
+    uploading = {str(i) for (i,) in db.session.query(ChatAttachment.id).filter(ChatAttachment.status == "uploading")}
+    orphan_parts = 0
+    for key in list(chat_attachment_store.partial_keys()):
+        if key.isdigit() and key not in uploading:
+            chat_attachment_store.discard(key)
+            orphan_parts += 1
+
+    referenced = {h for (h,) in db.session.query(ChatAttachment.sha256).filter(ChatAttachment.sha256 != None).distinct()}  # noqa: E711
+    removed = 0
+    for sha256 in list(chat_attachment_store.object_hashes()):
+        if sha256 in referenced:
+            continue
+        # Skip files stored moments ago whose attachment row is not committed yet.
+        if chat_attachment_store.object_mtime(sha256) < cutoff.timestamp() and chat_attachment_store.remove_object(sha256):
+            removed += 1
+
+    if stale or orphan_parts or removed:
+        print(f"[ATTACHMENTS] Removed {len(stale)} stale uploads, {orphan_parts} partial files, {removed} unused files")
+    return {"stale_uploads": len(stale), "partial_files": orphan_parts, "unused_files": removed}
+
 
 @app.route("/api/translate", methods=["POST"])
 @login_required
@@ -5302,8 +7422,19 @@ def firebase_sw():
 
 
 # ------------------ SOCKET.IO EVENTS ------------------ 
-online_users = set()
-sid_to_user = {}
+# Connected sockets per user; shared between workers when a message queue
+# is configured (presence.py).
+_presence_heartbeat_started = False
+
+
+@app.before_request
+def _start_presence_heartbeat():
+    global _presence_heartbeat_started
+    if _presence_heartbeat_started:
+        return
+    _presence_heartbeat_started = True
+    socketio.start_background_task(online_presence.run_heartbeat, sleep=socketio.sleep)
+
 
 @socketio.on("join")
 def on_join(data):
@@ -5335,8 +7466,9 @@ def on_join(data):
     if user_id is None:
         return
 
-    sid_to_user[request.sid] = user_id
-    online_users.add(user_id)
+    online_presence.add(request.sid, user_id)
+    # Socket traffic skips before_request; a worker may only ever see sockets.
+    _start_presence_heartbeat()
 
     # Personal room for notifications/pings.
     join_room(f"user_{user_id}")
@@ -5355,11 +7487,33 @@ def on_join(data):
     print(f"[SOCKETIO] User {user_id} joined personal room user_{user_id}")
 
 
+@socketio.on("subscribe")
+def on_subscribe(data):
+    """Subscribe this socket to event bus topics.
+
+    Payload: {topics: [...], lat?, lng?, radius_km?}. With a position, the
+    "requests" topic becomes the geo-cell rooms around it. Replaces any
+    earlier subscription of the same socket.
+    """
+    data = data or {}
+    topics = data.get("topics") or []
+    if not isinstance(topics, list):
+        return
+    try:
+        lat = float(data["lat"]) if data.get("lat") is not None else None
+        lng = float(data["lng"]) if data.get("lng") is not None else None
+        radius_km = float(data["radius_km"]) if data.get("radius_km") is not None else None
+    except (TypeError, ValueError):
+        lat = lng = radius_km = None
+    rooms = bus.subscribe(request.sid, join_room, leave_room, topics, lat=lat, lng=lng, radius_km=radius_km)
+    emit("subscribed", {"rooms": len(rooms), "feed_version": request_feed.feed.version})
+
+
 @socketio.on("disconnect")
 def on_disconnect():
-    uid = sid_to_user.pop(request.sid, None)
+    bus.forget(request.sid)
+    uid = online_presence.remove(request.sid)
     if uid:
-        online_users.discard(uid)
         print(f"[SOCKETIO] User {uid} disconnected")
 
 
@@ -5425,36 +7579,50 @@ def on_stop_typing(data):
 
 @socketio.on("send_message")
 def on_send_message(data):
-    # data: {conversation_id, text, language (optional), file_data, file_name, file_size, is_image}
+    # data: {conversation_id, text, language (optional), attachment_id (optional), temp_id}
+    # Files are uploaded first (/api/chat/<conv>/attachments); older clients
+    # may still send a small base64 file_data (+ file_name, content_type).
     conv_id = data.get("conversation_id")
     text = data.get("text", "")
     temp_id = data.get("temp_id")
     lang = data.get("language")
+    attachment_id = data.get("attachment_id")
     file_data = data.get("file_data")
-    file_name = data.get("file_name")
-    file_size = data.get("file_size")
-    is_image = data.get("is_image", False)
-    
+
     user = current_user()
-    
-    # Log file attachment info
-    if file_data:
-        file_data_preview = file_data[:50] if file_data else None
-        print(f"[SEND_MESSAGE] Has file attachment: {file_name} ({file_size}), is_image: {is_image}, data preview: {file_data_preview}...")
-    
+
     print(f"[SEND_MESSAGE] From user {user.id if user else 'None'} to conv {conv_id}: {text[:50] if text else '[File attachment]'}")
-    
+
     # Allow empty text if there's a file attachment
-    if not user or not conv_id or (not text and not file_data):
+    if not user or not conv_id or (not text and not attachment_id and not file_data):
         print(f"[SEND_MESSAGE] Rejected: missing user, conv_id, or content")
         return
-        
+
     conv = Conversation.query.get(conv_id)
     if not conv or user.id not in conv.participants():
         print(f"[SEND_MESSAGE] Rejected: conv not found or user not participant")
         return
 
-    msg = ChatMessage(conversation_id=conv.id, sender_id=user.id, text=text or "", language=lang)
+    attachment = None
+    if attachment_id:
+        try:
+            attachment = db.session.get(ChatAttachment, int(attachment_id))
+        except (TypeError, ValueError):
+            attachment = None
+        if (attachment is None or attachment.uploader_id != user.id
+                or attachment.conversation_id != conv.id or attachment.status != "ready"):
+            print(f"[SEND_MESSAGE] Rejected: attachment {attachment_id} is not a finished upload of this user")
+            return
+    elif file_data:
+        attachment = store_legacy_attachment(
+            conv, user.id, file_data, data.get("file_name"), data.get("content_type")
+        )
+        if attachment is None and not text:
+            print("[SEND_MESSAGE] Rejected: unreadable file_data")
+            return
+
+    msg = ChatMessage(conversation_id=conv.id, sender_id=user.id, text=text or "", language=lang,
+                      attachment=attachment)
     db.session.add(msg)
     db.session.commit()
     print(f"[SEND_MESSAGE] Saved message {msg.id} to DB")
@@ -5483,14 +7651,6 @@ def on_send_message(data):
 
     payload = serialize_message(msg)
 
-    # Include file data in payload if present (not persisted to DB)
-    if file_data:
-        payload['file_data'] = file_data
-        payload['file_name'] = file_name
-        payload['file_size'] = file_size
-        payload['is_image'] = is_image
-        print(f"[SEND_MESSAGE] Including file in payload: {file_name}, is_image: {is_image}")
-
     # include the client's temporary id so client can replace optimistic UI
     if temp_id:
         payload['temp_id'] = temp_id
@@ -5583,7 +7743,7 @@ def on_message_read(data):
     # If receiver read it, clear related chat notification and push updated counts.
     try:
         link = url_for("chat_with_user", other_user_id=msg.sender_id)
-        Notification.query.filter_by(user_id=user.id, is_read=False, type="chat", link=link).update({"is_read": True})
+        mark_notifications_read(user.id, type="chat", link=link)
         db.session.commit()
     except Exception:
         db.session.rollback()
@@ -5603,8 +7763,20 @@ def delete_conversation(conv_id):
         flash("You are not allowed to delete this conversation.", "error")
         return redirect(url_for("chat_index"))
     
-    # Delete all messages in this conversation
+    # Delete all messages in this conversation (and their unread badges)
+    unread_by_sender = dict(
+        db.session.query(ChatMessage.sender_id, func.count(ChatMessage.id))
+        .filter(ChatMessage.conversation_id == conv.id, ChatMessage.read == False)  # noqa: E712
+        .group_by(ChatMessage.sender_id)
+        .all()
+    )
     ChatMessage.query.filter_by(conversation_id=conv.id).delete()
+    _bump_unread_counters(db.session, chat={
+        (conv.user_a if sender == conv.user_b else conv.user_b): -n
+        for sender, n in unread_by_sender.items()
+    })
+    # Stored files are removed by the chat_attachments_cleanup job.
+    ChatAttachment.query.filter_by(conversation_id=conv.id).delete()
     # Delete the conversation
     db.session.delete(conv)
     db.session.commit()
@@ -5982,6 +8154,88 @@ def _run_startup_migrations_and_bootstrap_admin():
     except Exception as e:
         print(f"Migration note (offers): {e}")
 
+    # 2c) Migrate: geohash column on requests (spatial prefilter) + backfill
+    try:
+        if "requests" in table_names:
+            cols = [c["name"] for c in inspector.get_columns("requests")]
+            if "geohash" not in cols:
+                with db.engine.connect() as conn:
+                    conn.execute(db.text("ALTER TABLE requests ADD COLUMN geohash VARCHAR(12)"))
+                    conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_requests_geohash ON requests (geohash)"))
+                    conn.commit()
+                print("✓ Added geohash column to requests")
+            filled = backfill_request_geohashes()
+            if filled:
+                print(f"✓ Backfilled geohash for {filled} requests")
+    except Exception as e:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        print(f"Migration note (requests.geohash): {e}")
+
+    # 2c2) Migrate: attachment_id on chat_messages (files uploaded out of band)
+    try:
+        if "chat_messages" in table_names:
+            cols = [c["name"] for c in inspector.get_columns("chat_messages")]
+            if "attachment_id" not in cols:
+                with db.engine.connect() as conn:
+                    conn.execute(db.text(
+                        "ALTER TABLE chat_messages ADD COLUMN attachment_id INTEGER REFERENCES chat_attachments(id)"
+                    ))
+                    conn.commit()
+                print("✓ Added attachment_id column to chat_messages")
+    except Exception as e:
+        print(f"Migration note (chat_messages.attachment_id): {e}")
+
+    # 2c3) Migrate: conversations.last_message_id / last_message_at (inbox) + backfill
+    try:
+        if "conversations" in table_names:
+            cols = [c["name"] for c in inspector.get_columns("conversations")]
+            stmts = []
+            if "last_message_id" not in cols:
+                stmts.append("ALTER TABLE conversations ADD COLUMN last_message_id INTEGER")
+            if "last_message_at" not in cols:
+                stmts.append("ALTER TABLE conversations ADD COLUMN last_message_at TIMESTAMP")
+            if stmts:
+                with db.engine.connect() as conn:
+                    for stmt in stmts:
+                        conn.execute(db.text(stmt))
+                    conn.commit()
+                print("✓ Added last_message columns to conversations")
+            filled = backfill_conversation_last_messages()
+            if filled:
+                print(f"✓ Backfilled last message for {filled} conversations")
+    except Exception as e:
+        print(f"Migration note (conversations.last_message): {e}")
+
+    # 2c4) Migrate: sos_dispatch_rings.error (failed SOS deliveries)
+    try:
+        if "sos_dispatch_rings" in table_names:
+            cols = [c["name"] for c in inspector.get_columns("sos_dispatch_rings")]
+            if "error" not in cols:
+                with db.engine.connect() as conn:
+                    conn.execute(db.text("ALTER TABLE sos_dispatch_rings ADD COLUMN error TEXT"))
+                    conn.commit()
+                print("✓ Added error column to sos_dispatch_rings")
+    except Exception as e:
+        print(f"Migration note (sos_dispatch_rings.error): {e}")
+
+    # 2d) Migrate: hot-path indexes (create_all skips existing tables)
+    for model in (Request, Notification, ChatMessage, Conversation, Review):
+        table = model.__table__
+        try:
+            if table.name in table_names:
+                existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+                for ix in table.indexes:
+                    if ix.name not in existing:
+                        ix.create(db.engine, checkfirst=True)  # Postgres-only ones are skipped elsewhere
+                created = {ix["name"] for ix in inspect(db.engine).get_indexes(table.name)} - existing
+                if created:
+                    print(f"✓ Added indexes on {table.name}: {', '.join(sorted(created))}")
+        except Exception as e:
+            print(f"Migration note ({table.name} indexes): {e}")
+
     # 3) Bootstrap default admin
     try:
         admin = User.query.filter_by(email="admin@lifeline.com").first()
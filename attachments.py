@@ -0,0 +1,200 @@
+"""
+Chat attachment storage: chunked, resumable uploads into a content-addressed
+store.
+
+Files no longer travel inside Socket.IO events. The client uploads them over
+HTTP in chunks (app.py, /api/chat/<conv>/attachments):
+
+1. create    -> attachment id; nothing to upload when the client sent the
+                SHA-256 of a file the store already holds (dedup)
+2. PUT chunk -> appended at `offset` to a partial file, streamed to disk in
+                READ_BUFFER_BYTES pieces; a wrong offset is answered with
+                the current one so the client can resume
+3. complete  -> the partial file is hashed and moved to objects/<sha256>;
+                identical content is stored once
+
+and the chat message only carries the attachment id and URL.
+
+LocalObjectStore keeps everything under one directory:
+
+    <root>/partial/<upload key>.part
+    <root>/objects/<sha256[:2]>/<sha256>
+"""
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+from typing import BinaryIO, Dict, Optional, Tuple
+
+# Chunk size suggested to clients, and the largest chunk accepted.
+CHUNK_SIZE_BYTES = 1024 * 1024
+MAX_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_ATTACHMENT_BYTES = int(os.getenv("CHAT_ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+READ_BUFFER_BYTES = 64 * 1024
+
+# Shown inline; anything else (SVG and HTML included) is served as a download.
+INLINE_IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(ValueError):
+    """Rejected upload step; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def normalize_sha256(value) -> Optional[str]:
+    value = (value or "").strip().lower()
+    return value if _SHA256_RE.match(value) else None
+
+
+def is_inline_image(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in INLINE_IMAGE_TYPES
+
+
+def clean_file_name(name: Optional[str]) -> str:
+    name = os.path.basename((name or "").replace("\\", "/")).strip()
+    name = re.sub(r"[\x00-\x1f\x7f]", "", name)
+    return name[:255] or "attachment"
+
+
+class LocalObjectStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(os.path.join(root, "partial"), exist_ok=True)
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+    # ---------- paths ----------
+
+    def part_path(self, key: str) -> str:
+        return os.path.join(self.root, "partial", f"{key}.part")
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def has_object(self, sha256: str, size: Optional[int] = None) -> bool:
+        try:
+            actual = os.path.getsize(self.object_path(sha256))
+        except OSError:
+            return False
+        return size is None or actual == size
+
+    def _lock(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    # ---------- partial uploads ----------
+
+    def received(self, key: str) -> int:
+        try:
+            return os.path.getsize(self.part_path(key))
+        except OSError:
+            return 0
+
+    def append(self, key: str, offset: int, stream: BinaryIO, length: int, total_size: int) -> int:
+        """
+        Append `length` bytes read from `stream` at `offset`; returns the new
+        offset. The chunk is rejected unless `offset` is exactly what has been
+        received so far.
+        """
+        if length <= 0 or length > MAX_CHUNK_BYTES:
+            raise UploadError(f"chunk must be 1..{MAX_CHUNK_BYTES} bytes", 413)
+        with self._lock(key):
+            path = self.part_path(key)
+            received = self.received(key)
+            if offset != received:
+                raise UploadError("offset mismatch", 409, offset=received)
+            if received + length > total_size:
+                raise UploadError("chunk goes past the declared size", 413, offset=received)
+
+            written = 0
+            with open(path, "ab") as out:
+                while written < length:
+                    buf = stream.read(min(READ_BUFFER_BYTES, length - written))
+                    if not buf:
+                        break
+                    out.write(buf)
+                    written += len(buf)
+            if written != length:
+                # Client went away mid-chunk: keep only whole chunks.
+                with open(path, "ab") as out:
+                    out.truncate(received)
+                raise UploadError("incomplete chunk", 400, offset=received)
+            return received + written
+
+    def finish(self, key: str) -> Tuple[str, int]:
+        """Hash the partial file and move it into the object store."""
+        with self._lock(key):
+            path = self.part_path(key)
+            digest = hashlib.sha256()
+            size = 0
+            with open(path, "rb") as f:
+                for buf in iter(lambda: f.read(READ_BUFFER_BYTES), b""):
+                    digest.update(buf)
+                    size += len(buf)
+            sha256 = digest.hexdigest()
+            if self.has_object(sha256, size):
+                os.remove(path)  # same content already stored
+                os.utime(self.object_path(sha256))
+            else:
+                os.makedirs(os.path.dirname(self.object_path(sha256)), exist_ok=True)
+                os.replace(path, self.object_path(sha256))
+        with self._locks_guard:
+            self._locks.pop(key, None)
+        return sha256, size
+
+    def discard(self, key: str) -> None:
+        try:
+            os.remove(self.part_path(key))
+        except OSError:
+            pass
+
+    # ---------- whole objects ----------
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        """Store a small in-memory file (legacy base64 messages)."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self.has_object(sha256, len(data)):
+            os.utime(self.object_path(sha256))
+        else:
+            tmp = self.part_path(f"put-{uuid.uuid4().hex}")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(self.object_path(sha256)), exist_ok=True)
+            os.replace(tmp, self.object_path(sha256))
+        return sha256, len(data)
+
+    def object_mtime(self, sha256: str) -> float:
+        try:
+            return os.path.getmtime(self.object_path(sha256))
+        except OSError:
+            return 0.0
+
+    def remove_object(self, sha256: str) -> bool:
+        try:
+            os.remove(self.object_path(sha256))
+            return True
+        except OSError:
+            return False
+
+    def object_hashes(self):
+        objects = os.path.join(self.root, "objects")
+        for prefix in os.listdir(objects):
+            folder = os.path.join(objects, prefix)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    if _SHA256_RE.match(name):
+                        yield name
+
+    def partial_keys(self):
+        for name in os.listdir(os.path.join(self.root, "partial")):
+            if name.endswith(".part"):
+                yield name[: -len(".part")]
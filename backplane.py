@@ -0,0 +1,395 @@
+"""
+Socket.IO backplane: lets several web workers share rooms and presence.
+
+With SOCKETIO_MESSAGE_QUEUE unset the app runs as before (one worker, rooms
+and presence in process memory). With it set, every emit goes through a
+pub/sub channel so `emit(..., room="chat_<id>")` and `user_<id>` delivery
+reach sockets held by any worker, and presence (presence.py) is kept in a
+shared store:
+
+- redis://, rediss://   python-socketio's RedisManager (needs `redis`)
+- amqp://, kafka://...  passed to Flask-SocketIO as message_queue
+- local://host:port     the in-repo LocalBroker below: a small TCP pub/sub
+                        server with a presence store, for development,
+                        tests and single-machine multi-core deploys
+
+Run the local broker next to the workers:
+
+    python backplane.py --port 6390
+    SOCKETIO_MESSAGE_QUEUE=local://127.0.0.1:6390 \
+        gunicorn --worker-class eventlet --workers 4 wsgi:app
+
+The broker also keeps named counters and leases for cluster.py, which uses
+the same store to keep the workers' in-memory caches in step.
+
+The wire protocol is one JSON object per line. A connection either sends
+commands ({"op": ...} -> {"ok": true, "result": ...}) or, after
+{"op": "subscribe", "channel": ...} (acknowledged the same way), only
+receives {"channel", "data"} lines.
+"""
+
+import argparse
+import json
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set
+from urllib.parse import urlparse
+
+import socketio
+
+LOCAL_SCHEME = "local"
+DEFAULT_PORT = 6390
+DEFAULT_CHANNEL = "lifeline-socketio"
+CONNECT_TIMEOUT_SECONDS = 5.0
+RECONNECT_DELAY_SECONDS = 1.0
+
+
+def parse_local_url(url: str):
+    """("host", port) for a local://host:port URL."""
+    parsed = urlparse(url)
+    if parsed.scheme != LOCAL_SCHEME:
+        raise ValueError(f"not a {LOCAL_SCHEME}:// URL: {url}")
+    return parsed.hostname or "127.0.0.1", parsed.port or DEFAULT_PORT
+
+
+def is_local_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(LOCAL_SCHEME + "://")
+
+
+def socketio_options(url: Optional[str], channel: str = DEFAULT_CHANNEL, write_only: bool = False) -> Dict[str, Any]:
+    """
+    Extra SocketIO(...) kwargs for the configured message queue. write_only
+    is for processes that only emit (worker.py): they publish to the queue
+    but do not subscribe to it.
+    """
+    if not url:
+        return {}
+    if is_local_url(url):
+        return {"client_manager": BrokerManager(url, channel=channel, write_only=write_only)}
+    if write_only:
+        if url.startswith(("redis://", "rediss://")):
+            return {"client_manager": socketio.RedisManager(url, channel=channel, write_only=True)}
+        return {"client_manager": socketio.KombuManager(url, channel=channel, write_only=True)}
+    return {"message_queue": url, "channel": channel}
+
+
+# ---------- broker (server side) ----------
+
+class _BrokerState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # channel -> subscriber handlers
+        self.subscribers: Dict[str, Set["_BrokerHandler"]] = {}
+        # user id -> {member: expires_at}; a member is "<worker>/<sid>"
+        self.presence: Dict[int, Dict[str, float]] = {}
+        # counter name -> last value; seeded from the clock so values handed
+        # out before a broker restart are not reused
+        self.sequences: Dict[str, int] = {}
+        self.seq_lock = threading.Lock()
+        # lease name -> (holder, expires_at)
+        self.leases: Dict[str, tuple] = {}
+        self.stats = {"published": 0, "delivered": 0}
+
+    def publish(self, channel: str, data: Any) -> int:
+        line = (json.dumps({"channel": channel, "data": data}) + "\n").encode()
+        with self.lock:
+            targets = list(self.subscribers.get(channel, ()))
+            self.stats["published"] += 1
+        delivered = 0
+        for handler in targets:
+            if handler.send_line(line):
+                delivered += 1
+            else:
+                self.unsubscribe(channel, handler)
+        with self.lock:
+            self.stats["delivered"] += delivered
+        return delivered
+
+    def current_seq(self, counter: str) -> int:
+        with self.lock:
+            return self.sequences.setdefault(counter, int(time.time() * 1000))
+
+    def publish_seq(self, channel: str, counter: str, data: Any) -> int:
+        """
+        Number `data` with the next value of `counter` and publish it as
+        {"seq", "msg"}. Numbering and sending happen under one lock, so every
+        subscriber sees the messages of a counter in order.
+        """
+        with self.seq_lock:
+            with self.lock:
+                seq = self.sequences.get(counter) or int(time.time() * 1000)
+                seq += 1
+                self.sequences[counter] = seq
+            self.publish(channel, {"seq": seq, "msg": data})
+        return seq
+
+    def lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease `name` for `holder`; False while someone else holds it."""
+        now = time.time()
+        with self.lock:
+            current = self.leases.get(name)
+            if current is not None and current[0] != holder and current[1] > now:
+                return False
+            self.leases[name] = (holder, now + float(ttl))
+            return True
+
+    def unsubscribe(self, channel: str, handler) -> None:
+        with self.lock:
+            self.subscribers.get(channel, set()).discard(handler)
+
+    def presence_set(self, entries: Iterable, ttl: float) -> int:
+        expires = time.time() + float(ttl)
+        count = 0
+        with self.lock:
+            for member, user_id in entries:
+                self.presence.setdefault(int(user_id), {})[member] = expires
+                count += 1
+        return count
+
+    def presence_remove(self, member: str, user_id: int) -> None:
+        with self.lock:
+            members = self.presence.get(int(user_id))
+            if members is not None:
+                members.pop(member, None)
+                if not members:
+                    self.presence.pop(int(user_id), None)
+
+    def presence_online(self, user_ids: Iterable[int]):
+        now = time.time()
+        online = []
+        with self.lock:
+            for uid in user_ids:
+                members = self.presence.get(int(uid))
+                if not members:
+                    continue
+                for member, expires in list(members.items()):
+                    if expires <= now:
+                        del members[member]
+                if members:
+                    online.append(int(uid))
+                else:
+                    self.presence.pop(int(uid), None)
+        return online
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    server: "LocalBroker"
+
+    def setup(self):
+        super().setup()
+        self._send_lock = threading.Lock()
+
+    def send_line(self, line: bytes) -> bool:
+        try:
+            with self._send_lock:
+                self.wfile.write(line)
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+    def handle(self):
+        state = self.server.state
+        subscribed = None
+        try:
+            for raw in self.rfile:
+                cmd = {}
+                try:
+                    cmd = json.loads(raw)
+                    op = cmd.get("op")
+                    if op == "subscribe":
+                        subscribed = cmd["channel"]
+                        with state.lock:
+                            state.subscribers.setdefault(subscribed, set()).add(self)
+                        result = True
+                    elif op == "publish":
+                        result = state.publish(cmd["channel"], cmd.get("data"))
+                    elif op == "publish_seq":
+                        result = state.publish_seq(cmd["channel"], cmd["counter"], cmd.get("data"))
+                    elif op == "current_seq":
+                        result = state.current_seq(cmd["counter"])
+                    elif op == "lease":
+                        result = state.lease(cmd["name"], cmd["holder"], cmd.get("ttl", 10))
+                    elif op == "presence_set":
+                        result = state.presence_set(cmd.get("entries") or [], cmd.get("ttl", 60))
+                    elif op == "presence_remove":
+                        result = state.presence_remove(cmd["member"], cmd["user_id"])
+                    elif op == "presence_online":
+                        result = state.presence_online(cmd.get("user_ids") or [])
+                    elif op == "stats":
+                        with state.lock:
+                            result = dict(state.stats, subscribers=sum(len(s) for s in state.subscribers.values()))
+                    else:
+                        raise ValueError(f"unknown op {op!r}")
+                    reply = {"ok": True, "result": result}
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                self.send_line((json.dumps(reply) + "\n").encode())
+        finally:
+            if subscribed is not None:
+                state.unsubscribe(subscribed, self)
+
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """In-process pub/sub + presence server (see module docstring)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        super().__init__((host, port), _BrokerHandler)
+        self.state = _BrokerState()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{LOCAL_SCHEME}://{host}:{port}"
+
+    def start(self) -> "LocalBroker":
+        """Serve from a daemon thread (tests); returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, name="local-broker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+# ---------- broker client ----------
+
+class BrokerClient:
+    """Command connection to a LocalBroker, reconnecting on failure."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.host, self.port = parse_local_url(url)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT_SECONDS)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, sock.makefile("rb")
+
+    def call(self, op: str, **args) -> Any:
+        line = (json.dumps(dict(args, op=op)) + "\n").encode()
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._sock, self._file = self._connect()
+                    self._sock.sendall(line)
+                    raw = self._file.readline()
+                    if not raw:
+                        raise ConnectionError("broker closed the connection")
+                    break
+                except OSError:
+                    self.close_locked()
+                    if attempt == 2:
+                        raise
+        reply = json.loads(raw)
+        if not reply.get("ok"):
+            raise RuntimeError(f"broker {op} failed: {reply.get('error')}")
+        return reply.get("result")
+
+    def close_locked(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def publish(self, channel: str, data: Any) -> int:
+        return self.call("publish", channel=channel, data=data)
+
+    def publish_seq(self, channel: str, counter: str, data: Any) -> int:
+        return self.call("publish_seq", channel=channel, counter=counter, data=data)
+
+    def current_seq(self, counter: str) -> int:
+        return self.call("current_seq", counter=counter)
+
+    def lease(self, name: str, holder: str, ttl: float) -> bool:
+        return bool(self.call("lease", name=name, holder=holder, ttl=ttl))
+
+    def listen(self, channel: str, on_subscribed: Optional[Callable[[], None]] = None,
+               on_lost: Optional[Callable[[], None]] = None) -> Iterator[Any]:
+        """
+        Yield messages published on `channel`, reconnecting forever.
+        `on_subscribed` runs each time the subscription is (re)established and
+        `on_lost` each time it drops; messages published while it was down are
+        lost.
+        """
+        while True:
+            try:
+                sock, rfile = self._connect()
+                sock.settimeout(None)
+                sock.sendall((json.dumps({"op": "subscribe", "channel": channel}) + "\n").encode())
+                for raw in rfile:
+                    msg = json.loads(raw)
+                    if msg.get("channel") == channel:
+                        yield msg.get("data")
+                    elif msg.get("ok") and on_subscribed is not None:
+                        on_subscribed()
+            except (OSError, ValueError) as e:
+                print(f"[BACKPLANE] Subscription to {channel} lost: {e}")
+            if on_lost is not None:
+                on_lost()
+            time.sleep(RECONNECT_DELAY_SECONDS)
+
+    # presence store (see presence.SharedPresence)
+
+    def presence_set(self, entries, ttl: float) -> None:
+        self.call("presence_set", entries=[[m, int(u)] for m, u in entries], ttl=ttl)
+
+    def presence_remove(self, member: str, user_id: int) -> None:
+        self.call("presence_remove", member=member, user_id=int(user_id))
+
+    def presence_online(self, user_ids) -> Set[int]:
+        return set(self.call("presence_online", user_ids=[int(u) for u in user_ids]))
+
+
+class BrokerManager(socketio.PubSubManager):
+    """python-socketio client manager on top of a LocalBroker."""
+
+    name = "local"
+
+    def __init__(self, url: str = f"{LOCAL_SCHEME}://127.0.0.1:{DEFAULT_PORT}", channel: str = DEFAULT_CHANNEL,
+                 write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self.client = BrokerClient(url)
+
+    def _publish(self, data):
+        try:
+            self.client.publish(self.channel, data)
+        except Exception as e:
+            print(f"[BACKPLANE] Publish to {self.url} failed: {e}")
+
+    def _listen(self):
+        yield from self.client.listen(self.channel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LifeLine local Socket.IO broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    broker = LocalBroker(args.host, args.port)
+    print(f"[BACKPLANE] Local broker listening on {broker.url}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Keeps the web workers' in-memory state in step.
+
+Every worker holds its own snapshots (request_feed, geo_index,
+radar_service) and caches (identities, sender names). With one worker that
+is all there is; with several (SOCKETIO_MESSAGE_QUEUE, backplane.py) a write
+handled by one worker has to reach the others. SharedCluster does that
+through the same store as presence (the local broker or Redis):
+
+- publish(topic, data)        broadcast to the other processes, e.g. a cache
+                              invalidation or index update; stage() holds it
+                              on the session until the transaction commits
+- publish_sequenced(...)      broadcast numbered by one shared counter and
+                              delivered to every subscribed process, the
+                              sender included, in counter order; the
+                              live-requests feed uses the number as its
+                              version, so versions mean the same everywhere
+- lead(name, ttl)             a renewable lease, so periodic work (feed
+                              expiry and reloads) runs in one process only
+
+Handlers registered with on() / on_sequenced() run on the listener started
+with run(). Messages sent while a process is not subscribed are lost;
+on_subscribed() handlers run after every (re)subscription so they can
+reload, and listening() tells whether the subscription is up right now.
+
+LocalCluster is the single-process default: nothing is sent and it always
+holds every lease.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+import backplane
+
+LEASE_SECONDS = 10
+RECONNECT_DELAY_SECONDS = 1.0
+REDIS_KEY_PREFIX = "lifeline:cluster:"
+
+_STAGED_KEY = "cluster_messages"
+
+
+class LocalCluster:
+    shared = False
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def on(self, topic: str, handler: Callable[[Any], None]) -> None:
+        pass
+
+    def on_sequenced(self, topic: str, handler: Callable[[int, Any], None]) -> None:
+        pass
+
+    def on_subscribed(self, handler: Callable[[], None]) -> None:
+        pass
+
+    def publish(self, topic: str, data: Any) -> bool:
+        return False
+
+    def stage(self, session, topic: str, data: Any) -> None:
+        pass
+
+    def flush_staged(self, session) -> int:
+        return 0
+
+    def discard_staged(self, session) -> None:
+        pass
+
+    def lead(self, name: str, ttl: float = LEASE_SECONDS) -> bool:
+        return True
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def listening(self) -> bool:
+        return False
+
+    def run(self) -> None:
+        pass
+
+
+class SharedCluster(LocalCluster):
+    shared = True
+
+    def __init__(self, store, channel: str, worker_id: Optional[str] = None,
+                 context_factory: Optional[Callable] = None):
+        super().__init__(worker_id)
+        self.store = store
+        self.channel = channel
+        self.context_factory = context_factory
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._sequenced: Dict[str, List[Callable]] = {}
+        self._subscribed: List[Callable] = []
+        self._ready = threading.Event()
+        self._listening = False
+        self._failing = False
+        self.stats = {"sent": 0, "received": 0, "failed": 0}
+
+    # ---------- registration ----------
+
+    def on(self, topic, handler):
+        """handler(data) for `topic` messages sent by other processes."""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def on_sequenced(self, topic, handler):
+        """handler(seq, data) for every sequenced `topic` message, own ones included."""
+        self._sequenced.setdefault(topic, []).append(handler)
+
+    def on_subscribed(self, handler):
+        self._subscribed.append(handler)
+
+    # ---------- sending ----------
+
+    def _message(self, topic, data):
+        return {"origin": self.worker_id, "topic": topic, "data": data}
+
+    def publish(self, topic, data):
+        try:
+            self.store.publish(self.channel, self._message(topic, data))
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"[CLUSTER] Publish {topic} failed: {e}")
+            return False
+        self.stats["sent"] += 1
+        return True
+
+    def publish_sequenced(self, topic: str, data: Any) -> int:
+        """Publish under the next value of the `topic` counter; returns it. Raises on store errors."""
+        seq = int(self.store.publish_seq(self.channel, topic, self._message(topic, data)))
+        self.stats["sent"] += 1
+        return seq
+
+    def current_seq(self, topic: str) -> int:
+        return int(self.store.current_seq(topic))
+
+    def stage(self, session, topic, data):
+        """Publish once `session` commits (dropped on rollback)."""
+        session.info.setdefault(_STAGED_KEY, []).append((topic, data))
+
+    def flush_staged(self, session):
+        staged = session.info.pop(_STAGED_KEY, None)
+        for topic, data in staged or ():
+            self.publish(topic, data)
+        return len(staged or ())
+
+    def discard_staged(self, session):
+        session.info.pop(_STAGED_KEY, None)
+
+    def lead(self, name, ttl=LEASE_SECONDS):
+        try:
+            held = bool(self.store.lease(name, self.worker_id, ttl))
+        except Exception as e:
+            if not self._failing:
+                print(f"[CLUSTER] Store unavailable, not leading {name}: {e}")
+            self._failing = True
+            return False
+        if self._failing:
+            print("[CLUSTER] Store reachable again")
+            self._failing = False
+        return held
+
+    # ---------- receiving ----------
+
+    def wait_ready(self, timeout=None):
+        """True once the listener is subscribed."""
+        return self._ready.wait(timeout)
+
+    def listening(self):
+        """True while subscribed, i.e. no message sent now can be missed."""
+        return self._listening
+
+    def run(self) -> None:
+        """Listen forever (background task)."""
+        for message in self.store.listen(self.channel, on_subscribed=self._on_subscribed, on_lost=self._on_lost):
+            self.dispatch(message)
+
+    def _on_subscribed(self):
+        # Handlers first: nothing waiting in wait_ready() has loaded yet, so
+        # the first subscription does not trigger a reload.
+        for handler in self._subscribed:
+            self._call(handler)
+        self._listening = True
+        self._ready.set()
+
+    def _on_lost(self):
+        self._listening = False
+
+    def dispatch(self, message: Dict[str, Any]) -> None:
+        seq = None
+        if isinstance(message, dict) and "seq" in message:
+            seq, message = int(message["seq"]), message.get("msg")
+        if not isinstance(message, dict):
+            return
+        self.stats["received"] += 1
+        topic = message.get("topic")
+        if seq is not None:
+            for handler in self._sequenced.get(topic, ()):
+                self._call(handler, seq, message.get("data"))
+        elif message.get("origin") != self.worker_id:
+            for handler in self._handlers.get(topic, ()):
+                self._call(handler, message.get("data"))
+
+    def _call(self, handler, *args):
+        try:
+            with (self.context_factory() if self.context_factory else nullcontext()):
+                handler(*args)
+        except Exception as e:
+            print(f"[CLUSTER] Handler {getattr(handler, '__name__', handler)} failed: {e}")
+
+
+class RedisClusterStore:
+    """Counters, leases and pub/sub on Redis for SharedCluster."""
+
+    # Seed a missing counter from the clock (like the local broker), take the
+    # next value and publish, atomically, so subscribers see counter order.
+    _PUBLISH_SEQ = """
+    if redis.call('exists', KEYS[1]) == 0 then redis.call('set', KEYS[1], ARGV[1]) end
+    local seq = redis.call('incr', KEYS[1])
+    redis.call('publish', ARGV[2], '{"seq":' .. seq .. ',"msg":' .. ARGV[3] .. '}')
+    return seq
+    """
+    _LEASE = """
+    local holder = redis.call('get', KEYS[1])
+    if holder == ARGV[1] then
+        redis.call('pexpire', KEYS[1], ARGV[2])
+        return 1
+    end
+    if not holder then
+        redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for redis:// queues
+
+        self.redis = redis.Redis.from_url(url)
+        self._publish_seq = self.redis.register_script(self._PUBLISH_SEQ)
+        self._lease = self.redis.register_script(self._LEASE)
+
+    def publish(self, channel: str, data: Any) -> int:
+        return self.redis.publish(channel, json.dumps(data))
+
+    def publish_seq(self, channel: str, counter: str, data: Any) -> int:
+        return int(self._publish_seq(
+            keys=[f"{REDIS_KEY_PREFIX}seq:{counter}"],
+            args=[int(time.time() * 1000), channel, json.dumps(data)],
+        ))
+
+    def current_seq(self, counter: str) -> int:
+        key = f"{REDIS_KEY_PREFIX}seq:{counter}"
+        self.redis.set(key, int(time.time() * 1000), nx=True)
+        return int(self.redis.get(key))
+
+    def lease(self, name: str, holder: str, ttl: float) -> bool:
+        return bool(self._lease(keys=[f"{REDIS_KEY_PREFIX}lease:{name}"], args=[holder, int(ttl * 1000)]))
+
+    def listen(self, channel: str, on_subscribed: Optional[Callable[[], None]] = None,
+               on_lost: Optional[Callable[[], None]] = None):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(channel)
+                for item in pubsub.listen():
+                    if item["type"] == "subscribe":
+                        if on_subscribed is not None:
+                            on_subscribed()
+                    elif item["type"] == "message":
+                        yield json.loads(item["data"])
+            except Exception as e:
+                print(f"[CLUSTER] Subscription to {channel} lost: {e}")
+            if on_lost is not None:
+                on_lost()
+            time.sleep(RECONNECT_DELAY_SECONDS)
+
+
+def cluster_for_url(url: Optional[str], channel: str, context_factory: Optional[Callable] = None) -> LocalCluster:
+    """The cluster matching the shared store URL (the same one presence uses)."""
+    if not url:
+        return LocalCluster()
+    try:
+        if backplane.is_local_url(url):
+            return SharedCluster(backplane.BrokerClient(url), channel, context_factory=context_factory)
+        if url.startswith(("redis://", "rediss://")):
+            return SharedCluster(RedisClusterStore(url), channel, context_factory=context_factory)
+    except Exception as e:
+        print(f"[CLUSTER] Cannot use {url.split('://')[0]}:// to share caches: {e}")
+        return LocalCluster()
+    print(f"[CLUSTER] No shared store for {url.split('://')[0]}://; "
+          "set PRESENCE_URL to a redis:// or local:// URL")
+    return LocalCluster()
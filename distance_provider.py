@@ -0,0 +1,261 @@
+"""
+Route-distance providers used when notifying users about nearby events.
+
+- StraightLineProvider: great-circle distance, no network (dev/tests).
+- GoogleDistanceMatrixProvider: batches origins x destinations into as few
+  Distance Matrix calls as the API limits allow.
+- CachedDistanceProvider: wraps another provider with a persistent cache
+  keyed by rounded coordinates, so repeated pairs never hit the API twice.
+
+All providers share one call: `matrix(origins, destinations)` returns
+{(origin, destination): meters or None}, where points are (lat, lng) tuples
+and None means no route was found.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+
+import geo
+
+Point = Tuple[float, float]
+Matrix = Dict[Tuple[Point, Point], Optional[int]]
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+# Distance Matrix limits: 25 origins / 25 destinations per call, and a cap on
+# elements (origins x destinations) per call that depends on the plan.
+MAX_POINTS_PER_SIDE = 25
+MAX_ELEMENTS_PER_CALL = int(os.getenv("DISTANCE_MATRIX_MAX_ELEMENTS", "100"))
+
+# Cache keys round to 3 decimals (~110 m), plenty for a 3 km radius check.
+CACHE_KEY_DECIMALS = 3
+CACHE_TTL_DAYS = int(os.getenv("DISTANCE_CACHE_TTL_DAYS", "30"))
+
+
+def _chunks(items: Sequence, size: int) -> Iterable[Sequence]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _unique(points: Iterable[Point]) -> List[Point]:
+    return list(dict.fromkeys((float(lat), float(lng)) for lat, lng in points))
+
+
+class StraightLineProvider:
+    """Great-circle distances; deterministic and free."""
+
+    name = "straight_line"
+
+    def matrix(self, origins: Sequence[Point], destinations: Sequence[Point]) -> Matrix:
+        origins = _unique(origins)
+        out: Matrix = {}
+        for dest in _unique(destinations):
+            dists = geo.distances_km(dest[0], dest[1], [o[0] for o in origins], [o[1] for o in origins])
+            for origin, km in zip(origins, dists):
+                out[(origin, dest)] = int(round(float(km) * 1000))
+        return out
+
+
+class GoogleDistanceMatrixProvider:
+    """Google Distance Matrix API, batched up to the per-call limits."""
+
+    name = "google"
+
+    def __init__(self, api_key: str, timeout: float = 10, session=None):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = session or requests
+        self.calls = 0
+
+    def matrix(self, origins: Sequence[Point], destinations: Sequence[Point]) -> Matrix:
+        origins = _unique(origins)
+        destinations = _unique(destinations)
+        out: Matrix = {}
+
+        for dest_chunk in _chunks(destinations, MAX_POINTS_PER_SIDE):
+            per_call = max(1, min(MAX_POINTS_PER_SIDE, MAX_ELEMENTS_PER_CALL // len(dest_chunk)))
+            for origin_chunk in _chunks(origins, per_call):
+                out.update(self._call(origin_chunk, dest_chunk))
+        return out
+
+    def _call(self, origins: Sequence[Point], destinations: Sequence[Point]) -> Matrix:
+        out: Matrix = {(o, d): None for o in origins for d in destinations}
+        params = {
+            "origins": "|".join(f"{lat},{lng}" for lat, lng in origins),
+            "destinations": "|".join(f"{lat},{lng}" for lat, lng in destinations),
+            "key": self.api_key,
+            "units": "metric",
+        }
+        self.calls += 1
+        try:
+            res = self.session.get(DISTANCE_MATRIX_URL, params=params, timeout=self.timeout).json()
+        except requests.exceptions.RequestException as e:
+            print(f"[DISTANCE API] Request error for {len(origins)}x{len(destinations)} batch: {e}")
+            return out
+        except ValueError as e:
+            print(f"[DISTANCE API] Invalid response: {e}")
+            return out
+
+        if res.get("status") != "OK":
+            print(f"[DISTANCE API] Error: {res.get('status')}")
+            return out
+
+        for origin, row in zip(origins, res.get("rows") or []):
+            for dest, element in zip(destinations, row.get("elements") or []):
+                if element.get("status") == "OK":
+                    try:
+                        out[(origin, dest)] = int(element["distance"]["value"])
+                    except (KeyError, TypeError, ValueError):
+                        pass
+        return out
+
+
+class DbDistanceCache:
+    """Distance cache stored in a table with provider/origin_key/dest_key/meters/created_at."""
+
+    def __init__(self, db, model, ttl_days: int = CACHE_TTL_DAYS):
+        self.db = db
+        self.model = model
+        self.ttl_days = ttl_days
+
+    def get_many(self, provider: str, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[int]]:
+        pairs = list(pairs)
+        if not pairs:
+            return {}
+        M = self.model
+        cutoff = datetime.utcnow() - timedelta(days=self.ttl_days)
+        found = {}
+        origin_keys = list({o for o, _ in pairs})
+        dest_keys = list({d for _, d in pairs})
+        wanted = set(pairs)
+        for dest_chunk in _chunks(dest_keys, 500):
+            for origin_chunk in _chunks(origin_keys, 500):
+                rows = (
+                    self.db.session.query(M.origin_key, M.dest_key, M.meters)
+                    .filter(
+                        M.provider == provider,
+                        M.origin_key.in_(origin_chunk),
+                        M.dest_key.in_(dest_chunk),
+                        M.created_at >= cutoff,
+                    )
+                    .order_by(M.created_at)
+                    .all()
+                )
+                for origin_key, dest_key, meters in rows:
+                    if (origin_key, dest_key) in wanted:
+                        found[(origin_key, dest_key)] = meters
+        return found
+
+    def put_many(self, provider: str, values: Dict[Tuple[str, str], Optional[int]]) -> None:
+        if not values:
+            return
+        M = self.model
+        now = datetime.utcnow()
+        # Insert-only: reads take the newest row per pair, so a refreshed
+        # pair simply shadows its expired predecessor (purge_expired drops it).
+        for chunk in _chunks(list(values.items()), 500):
+            self.db.session.bulk_insert_mappings(M, [
+                {
+                    "provider": provider,
+                    "origin_key": origin_key,
+                    "dest_key": dest_key,
+                    "meters": meters,
+                    "created_at": now,
+                }
+                for (origin_key, dest_key), meters in chunk
+            ])
+        self.db.session.commit()
+
+    def purge_expired(self) -> int:
+        """Delete rows past the TTL (reads ignore them); returns how many."""
+        M = self.model
+        cutoff = datetime.utcnow() - timedelta(days=self.ttl_days)
+        n = self.db.session.query(M).filter(M.created_at < cutoff).delete(synchronize_session=False)
+        self.db.session.commit()
+        return n
+
+
+def cache_key(point: Point) -> str:
+    return f"{point[0]:.{CACHE_KEY_DECIMALS}f},{point[1]:.{CACHE_KEY_DECIMALS}f}"
+
+
+class CachedDistanceProvider:
+    """Serve pairs from the cache; only misses go to the wrapped provider."""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+        self.name = inner.name
+
+    def matrix(self, origins: Sequence[Point], destinations: Sequence[Point]) -> Matrix:
+        origins = _unique(origins)
+        destinations = _unique(destinations)
+
+        # Many users share a rounded key; ask the inner provider once per key.
+        origin_rep = {}
+        for o in origins:
+            origin_rep.setdefault(cache_key(o), o)
+        dest_rep = {}
+        for d in destinations:
+            dest_rep.setdefault(cache_key(d), d)
+
+        pairs = [(ok, dk) for ok in origin_rep for dk in dest_rep]
+        try:
+            cached = self.cache.get_many(self.name, pairs)
+        except Exception as e:
+            print(f"[DISTANCE CACHE] Read failed, continuing uncached: {e}")
+            self._rollback()
+            cached = {}
+
+        missing = [p for p in pairs if p not in cached]
+        if missing:
+            miss_origins = [origin_rep[k] for k in dict.fromkeys(ok for ok, _ in missing)]
+            miss_dests = [dest_rep[k] for k in dict.fromkeys(dk for _, dk in missing)]
+            fresh = self.inner.matrix(miss_origins, miss_dests)
+            computed = {}
+            for ok, dk in missing:
+                meters = fresh.get((origin_rep[ok], dest_rep[dk]))
+                cached[(ok, dk)] = meters
+                # Don't persist failures; they may be transient API errors.
+                if meters is not None:
+                    computed[(ok, dk)] = meters
+            try:
+                self.cache.put_many(self.name, computed)
+            except Exception as e:
+                print(f"[DISTANCE CACHE] Write failed: {e}")
+                self._rollback()
+
+        return {
+            (o, d): cached.get((cache_key(o), cache_key(d)))
+            for o in origins
+            for d in destinations
+        }
+
+    def _rollback(self):
+        db = getattr(self.cache, "db", None)
+        if db is not None:
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+
+
+def build_provider(name: Optional[str] = None, api_key: str = "", cache=None):
+    """
+    Provider selected by `name` (or the DISTANCE_PROVIDER env var):
+    "google" or "straight_line". Defaults to Google when an API key is set.
+    """
+    name = (name or os.getenv("DISTANCE_PROVIDER") or ("google" if api_key else "straight_line")).strip().lower()
+    if name == "google" and api_key:
+        provider = GoogleDistanceMatrixProvider(api_key)
+    else:
+        if name == "google":
+            print("[DISTANCE API] No GOOGLE_MAPS_API_KEY; using straight-line distances")
+        provider = StraightLineProvider()
+    # Straight-line distances are cheaper to recompute than to look up.
+    if cache is not None and provider.name != StraightLineProvider.name:
+        provider = CachedDistanceProvider(provider, cache)
+    return provider
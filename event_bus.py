@@ -0,0 +1,184 @@
+"""
+Server-side event bus on top of Flask-SocketIO.
+
+Pages subscribe to what they show instead of polling for it. Domain events
+("request.changed", "request.removed", "offer.accepted",
+"notification.created", "impact.changed", "resources.changed") are emitted as a single
+"bus_event" socket event ({type, data, ts}) to one or more rooms:
+
+- topic rooms   "topic:<name>"   public streams (PUBLIC_TOPICS)
+- geo-cell rooms "cell:<geohash>" fixed-precision geohash cells, so a page
+  only hears about requests around the area it shows
+- user rooms    "user_<id>"     the personal rooms the app already uses
+
+Events raised while a database transaction is open are staged on the
+session (`stage`) and only published after it commits (`flush_staged`, from
+the app's after_commit listener); a rollback discards them. Staged
+events with the same type and data are merged and sent once.
+
+Clients keep their old pollers as a fallback for when the socket is down
+(static/js/event_bus.js).
+"""
+
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import geo
+
+PUBLIC_TOPICS = {"requests", "impact", "summary", "resources"}
+
+# Geohash precision of the cell rooms (5 = about 4.9 x 4.9 km).
+CELL_PRECISION = 5
+# A subscription covering more cells than this gets the whole topic instead.
+MAX_SUBSCRIBED_CELLS = 48
+MAX_SUBSCRIBE_RADIUS_KM = 50.0
+
+SOCKET_EVENT = "bus_event"
+
+_STAGED_KEY = "bus_events"
+
+
+def cell_for(lat: Optional[float], lng: Optional[float]) -> Optional[str]:
+    if lat is None or lng is None:
+        return None
+    try:
+        return geo.encode_geohash(lat, lng, CELL_PRECISION)
+    except (TypeError, ValueError):
+        return None
+
+
+def cells_around(lat: float, lng: float, radius_km: float) -> Optional[List[str]]:
+    """
+    Cell rooms covering the circle, or None when that would take more than
+    MAX_SUBSCRIBED_CELLS rooms (subscribe to the topic instead).
+    """
+    min_lat, max_lat, min_lng, max_lng = geo.bounding_box(lat, lng, radius_km)
+    if min_lng is None:
+        return None
+    dlat, dlng = geo.cell_size_deg(CELL_PRECISION)
+    rows = int(math.ceil((max_lat - min_lat) / dlat)) + 1
+    cols = int(math.ceil((max_lng - min_lng) / dlng)) + 1
+    if rows * cols > MAX_SUBSCRIBED_CELLS * 2:
+        return None
+
+    cells = []
+    for i in range(rows + 1):
+        c_lat = min(max_lat, min_lat + i * dlat)
+        for j in range(cols + 1):
+            c_lng = min(max_lng, min_lng + j * dlng)
+            cell = cell_for(c_lat, c_lng)
+            if cell and cell not in cells:
+                cells.append(cell)
+    if len(cells) > MAX_SUBSCRIBED_CELLS:
+        return None
+    return cells
+
+
+class EventBus:
+    def __init__(self, socketio=None):
+        self.socketio = socketio
+        self._lock = threading.Lock()
+        # sid -> rooms joined through subscribe()
+        self._subscriptions: Dict[str, List[str]] = {}
+        self.stats = {"published": 0, "emits": 0, "staged": 0, "discarded": 0}
+
+    # ---------- publishing ----------
+
+    def publish(self, type: str, data: Optional[Dict[str, Any]] = None, topics: Iterable[str] = (),
+                cells: Iterable[Optional[str]] = (), users: Iterable[Optional[int]] = ()) -> int:
+        """Emit now; returns the number of rooms the event went to."""
+        rooms = self._rooms(topics, cells, users)
+        if not rooms or self.socketio is None:
+            return 0
+        self._emit(type, data, rooms)
+        return len(rooms)
+
+    def stage(self, session, type: str, data: Optional[Dict[str, Any]] = None, topics: Iterable[str] = (),
+              cells: Iterable[Optional[str]] = (), users: Iterable[Optional[int]] = ()) -> None:
+        """Publish once `session` commits (dropped on rollback)."""
+        rooms = self._rooms(topics, cells, users)
+        if not rooms:
+            return
+        key = (type, json.dumps(data or {}, sort_keys=True, default=str))
+        staged = session.info.setdefault(_STAGED_KEY, {})
+        if key in staged:
+            rooms = list(dict.fromkeys(staged[key][2] + rooms))
+        staged[key] = (type, data, rooms)
+        self.stats["staged"] += 1
+
+    def flush_staged(self, session) -> int:
+        staged = session.info.pop(_STAGED_KEY, None)
+        if not staged:
+            return 0
+        for type, data, rooms in staged.values():
+            self._emit(type, data, rooms)
+        return len(staged)
+
+    def discard_staged(self, session) -> None:
+        staged = session.info.pop(_STAGED_KEY, None)
+        if staged:
+            self.stats["discarded"] += len(staged)
+
+    def _emit(self, type, data, rooms):
+        if self.socketio is None:
+            return
+        payload = {"type": type, "data": data or {}, "ts": int(time.time() * 1000)}
+        try:
+            # One emit to all rooms: a socket in several of them gets it once.
+            self.socketio.emit(SOCKET_EVENT, payload, to=rooms)
+        except Exception as e:
+            print(f"[BUS] emit {type} to {rooms} failed: {e}")
+            return
+        self.stats["published"] += 1
+        self.stats["emits"] += len(rooms)
+
+    @staticmethod
+    def _rooms(topics, cells, users) -> List[str]:
+        rooms = [f"topic:{t}" for t in topics if t]
+        rooms += [f"cell:{c}" for c in cells if c]
+        rooms += [f"user_{int(u)}" for u in users if u]
+        return list(dict.fromkeys(rooms))
+
+    # ---------- subscriptions ----------
+
+    def subscribe(self, sid: str, join, leave, topics: Iterable[str] = (), lat: Optional[float] = None,
+                  lng: Optional[float] = None, radius_km: Optional[float] = None) -> List[str]:
+        """
+        Replace the bus rooms of socket `sid` (`join` / `leave` are the
+        flask_socketio functions). Unknown topics are ignored; a geo
+        subscription turns into cell rooms, or into the plain topic when the
+        area is too large. Returns the rooms joined.
+        """
+        topics = [t for t in topics if t in PUBLIC_TOPICS]
+        rooms = []
+        cells = None
+        if lat is not None and lng is not None:
+            radius = min(max(float(radius_km or 5.0), 0.5), MAX_SUBSCRIBE_RADIUS_KM)
+            cells = cells_around(float(lat), float(lng), radius)
+        for topic in topics:
+            if topic == "requests" and cells is not None:
+                rooms += [f"cell:{c}" for c in cells]
+            else:
+                rooms.append(f"topic:{topic}")
+        rooms = list(dict.fromkeys(rooms))
+
+        with self._lock:
+            previous = self._subscriptions.get(sid, [])
+            self._subscriptions[sid] = rooms
+        for room in previous:
+            if room not in rooms:
+                leave(room)
+        for room in rooms:
+            if room not in previous:
+                join(room)
+        return rooms
+
+    def forget(self, sid: str) -> None:
+        with self._lock:
+            self._subscriptions.pop(sid, None)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
@@ -0,0 +1,220 @@
+"""
+Batched FCM sending for notifications that go to many users.
+
+FCMDispatcher takes user ids instead of User objects:
+- loads every FCMToken row for all of them in one query,
+- groups recipients that get an identical payload,
+- sends each payload in chunks of up to 500 tokens (the multicast limit)
+  on a small thread pool,
+- deletes every token FCM reported as unregistered in one DELETE.
+
+The Firebase client is pluggable: FirebaseClient talks to firebase_admin,
+FakeFCMClient answers locally (optionally with latency and dead tokens) so
+throughput can be measured offline (scripts/bench_fcm_dispatch.py).
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+MULTICAST_LIMIT = 500
+DEFAULT_WORKERS = 8
+
+
+@dataclass
+class DispatchResult:
+    users: int = 0
+    tokens: int = 0
+    success: int = 0
+    failure: int = 0
+    pruned: int = 0
+    batches: int = 0
+    elapsed_ms: float = 0.0
+    # user ids with at least one successful delivery
+    delivered_user_ids: Set[int] = field(default_factory=set)
+
+
+@dataclass
+class _Outcome:
+    ok: bool
+    unregistered: bool = False
+
+
+class FirebaseClient:
+    """firebase_admin.messaging, one multicast call per chunk."""
+
+    def __init__(self):
+        import firebase_admin
+        from firebase_admin import messaging
+
+        self._firebase_admin = firebase_admin
+        self._messaging = messaging
+
+    def available(self) -> bool:
+        return bool(self._firebase_admin._apps)
+
+    def send_multicast(self, tokens: Sequence[str], title: str, body: str, data: Dict[str, str]) -> List[_Outcome]:
+        messaging = self._messaging
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+            tokens=list(tokens),
+            android=messaging.AndroidConfig(priority="high"),
+            apns=messaging.APNSConfig(headers={"apns-priority": "10"}),
+        )
+        # send_multicast was removed in firebase-admin 7; keep it for old installs.
+        send = getattr(messaging, "send_each_for_multicast", None) or messaging.send_multicast
+        response = send(message)
+
+        outcomes = []
+        for resp in response.responses:
+            if resp.success:
+                outcomes.append(_Outcome(ok=True))
+                continue
+            exc = getattr(resp, "exception", None)
+            unregistered = isinstance(exc, messaging.UnregisteredError) or getattr(exc, "code", None) == "UNREGISTERED"
+            outcomes.append(_Outcome(ok=False, unregistered=unregistered))
+        return outcomes
+
+
+class FakeFCMClient:
+    """Local stand-in: every token succeeds unless listed in `unregistered`."""
+
+    def __init__(self, latency_s: float = 0.0, unregistered: Iterable[str] = ()):
+        self.latency_s = latency_s
+        self.unregistered = set(unregistered)
+        self.calls = 0
+        self.sent: List[Tuple[str, str, str]] = []  # (token, title, body)
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return True
+
+    def send_multicast(self, tokens: Sequence[str], title: str, body: str, data: Dict[str, str]) -> List[_Outcome]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        with self._lock:
+            self.calls += 1
+            self.sent.extend((t, title, body) for t in tokens)
+        return [_Outcome(ok=t not in self.unregistered, unregistered=t in self.unregistered) for t in tokens]
+
+
+def _payload_key(title: str, body: str, data: Optional[dict]) -> tuple:
+    # FCM data must be string:string
+    return (title, body, tuple(sorted((str(k), str(v)) for k, v in (data or {}).items())))
+
+
+class FCMDispatcher:
+    def __init__(self, db, token_model, client=None, max_workers: int = DEFAULT_WORKERS,
+                 chunk_size: int = MULTICAST_LIMIT):
+        self.db = db
+        self.token_model = token_model
+        self._client = client
+        self.max_workers = max_workers
+        self.chunk_size = min(chunk_size, MULTICAST_LIMIT)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = FirebaseClient()
+        return self._client
+
+    def send(self, user_ids: Iterable[int], title: str, body: str, data: Optional[dict] = None) -> DispatchResult:
+        """Same notification to every user in `user_ids`."""
+        return self.send_many([(user_ids, title, body, data)])
+
+    def send_many(self, notifications: Iterable[Tuple[Iterable[int], str, str, Optional[dict]]]) -> DispatchResult:
+        """
+        Several notifications at once: [(user_ids, title, body, data), ...].
+        Recipients of identical payloads are merged before sending.
+        """
+        started = time.perf_counter()
+        result = DispatchResult()
+
+        groups: Dict[tuple, Set[int]] = {}
+        for user_ids, title, body, data in notifications:
+            groups.setdefault(_payload_key(title, body, data), set()).update(int(u) for u in user_ids)
+        all_users = set().union(*groups.values()) if groups else set()
+        result.users = len(all_users)
+        if not all_users:
+            return result
+
+        client = self.client
+        if not client.available():
+            print("[FCM] Firebase not initialized, cannot send notification.")
+            return result
+
+        tokens_by_user = self._load_tokens(all_users)
+
+        # (payload, [(token, user_id), ...]) chunks of <= chunk_size tokens
+        work = []
+        for (title, body, data_items), user_ids in groups.items():
+            pairs = [(tok, uid) for uid in user_ids for tok in tokens_by_user.get(uid, ())]
+            for i in range(0, len(pairs), self.chunk_size):
+                work.append(((title, body, dict(data_items)), pairs[i:i + self.chunk_size]))
+        result.batches = len(work)
+        result.tokens = sum(len(chunk) for _, chunk in work)
+
+        def run(item):
+            (title, body, data), chunk = item
+            try:
+                return chunk, client.send_multicast([t for t, _ in chunk], title, body, data)
+            except Exception as e:
+                print(f"[FCM] Multicast batch of {len(chunk)} failed: {e}")
+                return chunk, [_Outcome(ok=False)] * len(chunk)
+
+        if len(work) == 1 or self.max_workers <= 1:
+            outcomes = [run(item) for item in work]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(work))) as pool:
+                outcomes = list(pool.map(run, work))
+
+        dead_tokens = set()
+        for chunk, chunk_outcomes in outcomes:
+            for (token, uid), outcome in zip(chunk, chunk_outcomes):
+                if outcome.ok:
+                    result.success += 1
+                    result.delivered_user_ids.add(uid)
+                else:
+                    result.failure += 1
+                    if outcome.unregistered:
+                        dead_tokens.add(token)
+
+        if dead_tokens:
+            result.pruned = self._prune(dead_tokens)
+
+        result.elapsed_ms = (time.perf_counter() - started) * 1000.0
+        print(
+            f"[FCM] Dispatched to {result.users} users / {result.tokens} tokens in {result.batches} batches: "
+            f"Success={result.success}, Failures={result.failure}, Pruned={result.pruned} "
+            f"({result.elapsed_ms:.0f}ms)"
+        )
+        return result
+
+    def _load_tokens(self, user_ids: Set[int]) -> Dict[int, List[str]]:
+        T = self.token_model
+        ids = list(user_ids)
+        tokens: Dict[int, List[str]] = {}
+        for i in range(0, len(ids), 1000):
+            rows = self.db.session.query(T.user_id, T.token).filter(T.user_id.in_(ids[i:i + 1000])).all()
+            for uid, token in rows:
+                tokens.setdefault(uid, []).append(token)
+        return tokens
+
+    def _prune(self, dead_tokens: Set[str]) -> int:
+        T = self.token_model
+        try:
+            n = (
+                self.db.session.query(T)
+                .filter(T.token.in_(list(dead_tokens)))
+                .delete(synchronize_session=False)
+            )
+            self.db.session.commit()
+            print(f"[FCM] Cleaned up {n} unregistered tokens.")
+            return n
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"[FCM] Token cleanup failed: {e}")
+            return 0
@@ -0,0 +1,241 @@
+"""
+Geo helpers shared by the request map, nearby search and notifications.
+
+Provides:
+- Geohash encoding/decoding (base32, same alphabet as geohash.org)
+- Cell coverage for a radius query (center cell + 8 neighbours)
+- Bounding boxes for cheap SQL prefilters before exact haversine checks
+- Great-circle (haversine) distance in kilometers, scalar and batched
+  (NumPy when installed, pure Python otherwise)
+- Web-mercator (slippy map) tile bounds, for tiled map layers
+"""
+
+import math
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional; distances_km falls back to pure Python
+    np = None
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+# Precision stored on rows (~153m x 153m cells). Queries use a prefix of it.
+GEOHASH_PRECISION = 7
+
+# Below this many points the NumPy call overhead outweighs the vector speedup.
+NUMPY_MIN_BATCH = 32
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {ch: i for i, ch in enumerate(_BASE32)}
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points, in kilometers."""
+    lat1_r, lng1_r = math.radians(lat1), math.radians(lng1)
+    lat2_r, lng2_r = math.radians(lat2), math.radians(lng2)
+    dlat = lat2_r - lat1_r
+    dlng = lng2_r - lng1_r
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_r) * math.cos(lat2_r) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distances_km(lat: float, lng: float, lats: Sequence[float], lngs: Sequence[float]):
+    """
+    Great-circle distances from (lat, lng) to every (lats[i], lngs[i]).
+
+    Returns a NumPy float array when NumPy is available and the batch is big
+    enough to benefit, otherwise a list of floats. Either way the result
+    indexes, iterates and compares like a sequence of floats.
+    """
+    n = len(lats)
+    if np is None or n < NUMPY_MIN_BATCH:
+        return _distances_km_py(lat, lng, lats, lngs)
+
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlng = np.radians(np.asarray(lngs, dtype=np.float64)) - math.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _distances_km_py(lat: float, lng: float, lats: Sequence[float], lngs: Sequence[float]) -> List[float]:
+    lat1 = math.radians(lat)
+    lng1 = math.radians(lng)
+    cos_lat1 = math.cos(lat1)
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+    out = []
+    for p_lat, p_lng in zip(lats, lngs):
+        lat2 = radians(p_lat)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos(lat2) * sin((radians(p_lng) - lng1) / 2) ** 2
+        out.append(2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a))))
+    return out
+
+
+def encode_geohash(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode a coordinate into a geohash string of the given precision."""
+    lat = max(-90.0, min(90.0, float(lat)))
+    lng = float(lng)
+    if lng < -180.0 or lng > 180.0:
+        lng = ((lng + 180.0) % 360.0) - 180.0
+
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash interleaves starting with longitude
+
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                bits = (bits << 1) | 1
+                lng_lo = mid
+            else:
+                bits <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def decode_geohash_bbox(geohash: str) -> Tuple[float, float, float, float]:
+    """Return (min_lat, max_lat, min_lng, max_lng) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for ch in geohash:
+        value = _BASE32_INDEX[ch]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if bit:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lat_hi, lng_lo, lng_hi
+
+
+def cell_size_deg(precision: int) -> Tuple[float, float]:
+    """Return (lat_degrees, lng_degrees) spanned by a cell at this precision."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    """
+    Bounding box (min_lat, max_lat, min_lng, max_lng) around a circle.
+
+    The longitude bounds are None when the box touches a pole or crosses the
+    antimeridian; callers should then skip the longitude prefilter.
+    """
+    dlat = radius_km / KM_PER_DEG_LAT
+    min_lat = lat - dlat
+    max_lat = lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return max(-90.0, min_lat), min(90.0, max_lat), None, None
+
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    dlng = radius_km / (KM_PER_DEG_LAT * max(cos_lat, 1e-6))
+    min_lng = lng - dlng
+    max_lng = lng + dlng
+    if min_lng < -180.0 or max_lng > 180.0:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def covering_precision(lat: float, radius_km: float) -> int:
+    """
+    Largest geohash precision whose cells are at least `radius_km` wide and
+    tall around `lat`, so the 3x3 block around the center cell covers the
+    whole circle. Returns 0 when the radius is too large to be worth it.
+    """
+    cos_lat = math.cos(math.radians(min(89.0, abs(lat) + radius_km / KM_PER_DEG_LAT)))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        dlat, dlng = cell_size_deg(precision)
+        height_km = dlat * KM_PER_DEG_LAT
+        width_km = dlng * KM_PER_DEG_LAT * cos_lat
+        if height_km >= radius_km and width_km >= radius_km:
+            return precision
+    return 0
+
+
+def covering_cells(lat: float, lng: float, radius_km: float) -> List[str]:
+    """
+    Geohash prefixes whose union covers the circle (center + 8 neighbours).
+
+    Returns an empty list when the radius is too large for a useful cell
+    filter; callers should fall back to the bounding box alone.
+    """
+    precision = covering_precision(lat, radius_km)
+    if precision <= 0:
+        return []
+
+    center = encode_geohash(lat, lng, precision)
+    lat_lo, lat_hi, lng_lo, lng_hi = decode_geohash_bbox(center)
+    dlat = lat_hi - lat_lo
+    dlng = lng_hi - lng_lo
+    mid_lat = (lat_lo + lat_hi) / 2
+    mid_lng = (lng_lo + lng_hi) / 2
+
+    cells = []
+    for i in (-1, 0, 1):
+        n_lat = mid_lat + i * dlat
+        if n_lat <= -90.0 or n_lat >= 90.0:
+            continue
+        for j in (-1, 0, 1):
+            n_lng = mid_lng + j * dlng
+            if n_lng > 180.0:
+                n_lng -= 360.0
+            elif n_lng < -180.0:
+                n_lng += 360.0
+            cell = encode_geohash(n_lat, n_lng, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def geohash_range(prefix: str, precision: int = GEOHASH_PRECISION) -> Tuple[str, str]:
+    """
+    Inclusive [low, high] string range holding every stored geohash that
+    starts with `prefix`. Range comparisons use a plain btree index on both
+    SQLite and Postgres (unlike LIKE 'prefix%' under non-C collations).
+    """
+    pad = max(0, precision - len(prefix))
+    return prefix, prefix + (_BASE32[-1] * pad)
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) in degrees of web-mercator tile z/x/y."""
+    n = 2 ** z
+
+    def lat_at(row: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat_at(y + 1), x / n * 360.0 - 180.0, lat_at(y), (x + 1) / n * 360.0 - 180.0
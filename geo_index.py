@@ -0,0 +1,286 @@
+"""
+In-memory spatial index shared by every proximity lookup.
+
+Keeps the positions of users and open requests in a uniform lat/lng grid so
+radius queries only touch the handful of cells around the center instead of
+scanning whole tables. (Radar pings have their own snapshot, radar_service.)
+
+- Each kind ("user", "request") is loaded lazily from the
+  database through a loader registered by the app, then kept up to date
+  incrementally (upsert/remove from SQLAlchemy mapper events).
+- Entries may carry an `expires_at`; expired entries are skipped and dropped
+  while querying, and `purge_expired` sweeps them in bulk.
+- Each kind is reloaded every `refresh_seconds` so other processes' writes
+  (e.g. a separate worker) are picked up eventually.
+
+The index only narrows candidates: callers re-check their own filters in SQL
+(`filter_query`) so a stale entry can never leak a row that no longer
+matches. A missing entry would silently drop a row, though, so the index is
+only used while the app's live check (`set_live_check`) says every write
+reaches it; until then `filter_query` uses a lat/lng bounding box.
+"""
+
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import geo
+
+DEFAULT_CELL_KM = 1.0
+
+# Reload each kind from the database at most this often (seconds).
+REFRESH_SECONDS = int(os.getenv("GEO_INDEX_REFRESH_SECONDS", "300"))
+
+# Above this many candidates an `id IN (...)` filter stops being a win (and
+# SQLite caps bound parameters), so filter_query falls back to a bounding box.
+MAX_CANDIDATE_IDS = 5000
+
+ENABLED = os.getenv("GEO_INDEX_ENABLED", "1").lower() not in ("0", "false", "no")
+
+_live_check: Optional[Callable[[], bool]] = None
+
+Cell = Tuple[int, int]
+# loader() -> iterable of (key, lat, lng) or (key, lat, lng, expires_at)
+Loader = Callable[[], Iterable[tuple]]
+
+
+class GeoIndex:
+    """Uniform grid of points, bucketed per kind."""
+
+    def __init__(self, cell_km: float = DEFAULT_CELL_KM, refresh_seconds: int = REFRESH_SECONDS):
+        self.cell_deg = cell_km / geo.KM_PER_DEG_LAT
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._cells: Dict[str, Dict[Cell, Set]] = {}
+        self._points: Dict[str, Dict[object, tuple]] = {}
+        self._loaders: Dict[str, Loader] = {}
+        self._loaded_at: Dict[str, float] = {}
+
+    # ---------- loading ----------
+
+    def register_loader(self, kind: str, loader: Loader) -> None:
+        self._loaders[kind] = loader
+
+    def ensure_loaded(self, kind: str) -> bool:
+        """Load (or periodically reload) `kind`. Returns False if it can't be used."""
+        loaded_at = self._loaded_at.get(kind)
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_seconds:
+            return True
+
+        loader = self._loaders.get(kind)
+        if loader is None:
+            return loaded_at is not None
+
+        try:
+            rows = list(loader())
+        except Exception as e:
+            print(f"[GeoIndex] Failed to load '{kind}': {e}")
+            return False
+
+        cells: Dict[Cell, Set] = {}
+        points: Dict[object, tuple] = {}
+        for row in rows:
+            key, lat, lng = row[0], row[1], row[2]
+            expires_at = row[3] if len(row) > 3 else None
+            if lat is None or lng is None:
+                continue
+            cell = self._cell_for(lat, lng)
+            points[key] = (float(lat), float(lng), cell, expires_at)
+            cells.setdefault(cell, set()).add(key)
+
+        with self._lock:
+            self._cells[kind] = cells
+            self._points[kind] = points
+            self._loaded_at[kind] = time.monotonic()
+        return True
+
+    def invalidate(self, kind: Optional[str] = None) -> None:
+        """Force a reload of `kind` (or every kind) on the next query."""
+        with self._lock:
+            if kind is None:
+                self._loaded_at.clear()
+            else:
+                self._loaded_at.pop(kind, None)
+
+    # ---------- incremental updates ----------
+
+    def upsert(self, kind: str, key, lat: Optional[float], lng: Optional[float], expires_at: Optional[datetime] = None) -> None:
+        if lat is None or lng is None:
+            self.remove(kind, key)
+            return
+        lat, lng = float(lat), float(lng)
+        cell = self._cell_for(lat, lng)
+        with self._lock:
+            points = self._points.setdefault(kind, {})
+            cells = self._cells.setdefault(kind, {})
+            old = points.get(key)
+            if old is not None and old[2] != cell:
+                self._discard(cells, old[2], key)
+            points[key] = (lat, lng, cell, expires_at)
+            cells.setdefault(cell, set()).add(key)
+
+    def remove(self, kind: str, key) -> None:
+        with self._lock:
+            points = self._points.get(kind)
+            if not points:
+                return
+            old = points.pop(key, None)
+            if old is not None:
+                self._discard(self._cells[kind], old[2], key)
+
+    def purge_expired(self, kind: Optional[str] = None, now: Optional[datetime] = None) -> int:
+        """Drop expired entries; returns how many were removed."""
+        now = now or datetime.utcnow()
+        kinds = [kind] if kind is not None else list(self._points)
+        removed = 0
+        with self._lock:
+            for k in kinds:
+                points = self._points.get(k) or {}
+                expired = [key for key, p in points.items() if p[3] is not None and p[3] <= now]
+                for key in expired:
+                    self._discard(self._cells[k], points.pop(key)[2], key)
+                removed += len(expired)
+        return removed
+
+    # ---------- queries ----------
+
+    def query_radius(self, lat: float, lng: float, km: float, kind: str, now: Optional[datetime] = None) -> List[Tuple[object, float]]:
+        """
+        Return [(key, distance_km), ...] for every live `kind` entry within
+        `km` of (lat, lng), nearest first.
+        """
+        self.ensure_loaded(kind)
+        now = now or datetime.utcnow()
+        min_lat, max_lat, min_lng, max_lng = geo.bounding_box(lat, lng, km)
+
+        results = []
+        expired = []
+        with self._lock:
+            points = self._points.get(kind)
+            if not points:
+                return []
+            cells = self._cells[kind]
+
+            if min_lng is None:
+                candidate_keys = points.keys()
+            else:
+                row_lo, col_lo = self._cell_for(min_lat, min_lng)
+                row_hi, col_hi = self._cell_for(max_lat, max_lng)
+                n_cells = (row_hi - row_lo + 1) * (col_hi - col_lo + 1)
+                if n_cells >= len(cells):
+                    candidate_keys = points.keys()
+                else:
+                    candidate_keys = []
+                    for row in range(row_lo, row_hi + 1):
+                        for col in range(col_lo, col_hi + 1):
+                            bucket = cells.get((row, col))
+                            if bucket:
+                                candidate_keys.extend(bucket)
+
+            keys, lats, lngs = [], [], []
+            for key in candidate_keys:
+                p_lat, p_lng, _, expires_at = points[key]
+                if expires_at is not None and expires_at <= now:
+                    expired.append(key)
+                    continue
+                if not (min_lat <= p_lat <= max_lat):
+                    continue
+                keys.append(key)
+                lats.append(p_lat)
+                lngs.append(p_lng)
+
+            if keys:
+                dists = geo.distances_km(lat, lng, lats, lngs)
+                results = [(key, float(d)) for key, d in zip(keys, dists) if d <= km]
+
+            for key in expired:
+                self.remove(kind, key)
+
+        results.sort(key=lambda t: t[1])
+        return results
+
+    def size(self, kind: str) -> int:
+        return len(self._points.get(kind) or {})
+
+    # ---------- internals ----------
+
+    def _cell_for(self, lat: float, lng: float) -> Cell:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    @staticmethod
+    def _discard(cells: Dict[Cell, Set], cell: Cell, key) -> None:
+        bucket = cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del cells[cell]
+
+
+_default = GeoIndex()
+
+register_loader = _default.register_loader
+ensure_loaded = _default.ensure_loaded
+invalidate = _default.invalidate
+upsert = _default.upsert
+remove = _default.remove
+purge_expired = _default.purge_expired
+query_radius = _default.query_radius
+size = _default.size
+
+
+def set_live_check(check: Callable[[], bool]) -> None:
+    """
+    `check()` is True while this process sees every write to the indexed
+    tables (its own mapper events plus other processes' updates).
+    """
+    global _live_check
+    _live_check = check
+
+
+def is_live() -> bool:
+    try:
+        return _live_check is not None and bool(_live_check())
+    except Exception:
+        return False
+
+
+def candidate_ids(lat: float, lng: float, km: float, kind: str) -> Optional[List]:
+    """
+    Keys of `kind` within `km`, or None when the index can't answer (disabled,
+    not live, loader failed, or too many hits to be worth an IN filter).
+    """
+    if not ENABLED or not is_live() or not ensure_loaded(kind):
+        return None
+    hits = query_radius(lat, lng, km, kind=kind)
+    if len(hits) > MAX_CANDIDATE_IDS:
+        return None
+    return [key for key, _ in hits]
+
+
+def filter_query(q, model, kind: str, lat: float, lng: float, km: float, include_unlocated: bool = False):
+    """
+    Narrow a SQLAlchemy query on `model` (which has id/lat/lng columns) to rows
+    that can be within `km` of (lat, lng).
+
+    Uses the in-memory index when it can answer (see candidate_ids), otherwise
+    a lat/lng bounding box. Callers still apply their own exact distance
+    check.
+    """
+    from sqlalchemy import and_, or_
+
+    ids = candidate_ids(lat, lng, km, kind)
+    if ids is not None:
+        spatial = model.id.in_(ids)
+    else:
+        min_lat, max_lat, min_lng, max_lng = geo.bounding_box(lat, lng, km)
+        conds = [model.lat.isnot(None), model.lng.isnot(None), model.lat.between(min_lat, max_lat)]
+        if min_lng is not None:
+            conds.append(model.lng.between(min_lng, max_lng))
+        spatial = and_(*conds)
+
+    if include_unlocated:
+        return q.filter(or_(model.lat.is_(None), model.lng.is_(None), spatial))
+    return q.filter(spatial)
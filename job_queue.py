@@ -0,0 +1,318 @@
+"""
+Small DB-backed job queue for work that shouldn't run on the request path
+(notification fan-outs, delayed escalations, periodic maintenance).
+
+- Jobs live in the `jobs` table, so they survive restarts and can be
+  processed by the web process (embedded worker) and/or `python worker.py`.
+- Claiming is a compare-and-set UPDATE (plus SKIP LOCKED on Postgres), so
+  any number of workers can poll the same table safely.
+- Failed jobs are retried with exponential backoff up to `max_attempts`.
+- Each run records its duration; `stats()` summarises per-kind timings.
+- `recurring(kind, every_seconds)` keeps one job of `kind` scheduled at that
+  interval (periodic maintenance); workers top it up once a minute, under a
+  lock so concurrent workers do not schedule it twice.
+
+The app wires it up once with `configure(db, Job, context_factory)` and
+registers handlers with `@job_queue.handler("kind")`.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 5
+POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# A job still "running" after this long is assumed to belong to a dead worker.
+STALE_AFTER_SECONDS = int(os.getenv("JOB_STALE_AFTER_SECONDS", "600"))
+# pg_advisory_xact_lock key held while recurring jobs are scheduled.
+RECURRING_LOCK_KEY = 0x4C4C4A51
+
+_handlers: Dict[str, Callable[[dict], Any]] = {}
+# kind -> (every_seconds, payload)
+_recurring: Dict[str, tuple] = {}
+_db = None
+_Job = None
+_context_factory = None
+
+# In-process timing metrics: kind -> {runs, failures, total_ms, max_ms, last_ms}
+_metrics: Dict[str, Dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+
+
+def configure(db, job_model, context_factory=None) -> None:
+    """Bind the queue to the app's db/Job model. `context_factory()` returns
+    a context manager every job (and poll) runs inside."""
+    global _db, _Job, _context_factory
+    _db = db
+    _Job = job_model
+    _context_factory = context_factory
+
+
+def handler(kind: str):
+    """Decorator registering the function that processes jobs of `kind`."""
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def recurring(kind: str, every_seconds: float, payload: Optional[dict] = None) -> None:
+    """Run `kind` every `every_seconds` (scheduled by `ensure_recurring`)."""
+    _recurring[kind] = (every_seconds, payload or {})
+
+
+def enqueue(kind: str, payload: Optional[dict] = None, delay_seconds: float = 0,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS, commit: bool = True):
+    """Add a job. With commit=False it joins the caller's transaction."""
+    job = _Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay_seconds),
+    )
+    _db.session.add(job)
+    if commit:
+        _db.session.commit()
+    return job
+
+
+def _claim_next(worker_id: str):
+    Job = _Job
+    now = datetime.utcnow()
+    q = (
+        _db.session.query(Job.id)
+        .filter(Job.status == "queued", Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(10)
+    )
+    if _db.engine.dialect.name == "postgresql":
+        q = q.with_for_update(skip_locked=True)
+    candidate_ids = [row[0] for row in q.all()]
+
+    for job_id in candidate_ids:
+        claimed = (
+            _db.session.query(Job)
+            .filter(Job.id == job_id, Job.status == "queued")
+            .update(
+                {"status": "running", "locked_by": worker_id, "locked_at": now,
+                 "attempts": Job.attempts + 1},
+                synchronize_session=False,
+            )
+        )
+        _db.session.commit()
+        if claimed:
+            return _db.session.get(Job, job_id)
+    _db.session.commit()
+    return None
+
+
+def _record(kind: str, duration_ms: float, ok: bool) -> None:
+    with _metrics_lock:
+        m = _metrics.setdefault(kind, {"runs": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+        m["runs"] += 1
+        if not ok:
+            m["failures"] += 1
+        m["total_ms"] += duration_ms
+        m["max_ms"] = max(m["max_ms"], duration_ms)
+        m["last_ms"] = duration_ms
+
+
+def _run(job) -> bool:
+    fn = _handlers.get(job.kind)
+    started = time.perf_counter()
+    job.started_at = datetime.utcnow()
+    error = None
+
+    if fn is None:
+        error = f"No handler registered for job kind '{job.kind}'"
+    else:
+        try:
+            fn(json.loads(job.payload or "{}"))
+        except Exception as e:
+            error = f"{e}\n{traceback.format_exc(limit=5)}"
+            try:
+                _db.session.rollback()
+            except Exception:
+                pass
+
+    duration_ms = (time.perf_counter() - started) * 1000.0
+    # The handler may have rolled back or expired the session; reload.
+    job = _db.session.get(_Job, job.id)
+    job.duration_ms = duration_ms
+    job.finished_at = datetime.utcnow()
+    job.locked_by = None
+    job.locked_at = None
+
+    if error is None:
+        job.status = "done"
+        job.last_error = None
+    else:
+        job.last_error = error[:4000]
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS * (2 ** (job.attempts - 1)))
+        else:
+            job.status = "failed"
+    _db.session.commit()
+    _record(job.kind, duration_ms, error is None)
+
+    outcome = "done" if error is None else ("retry" if job.status == "queued" else "FAILED")
+    print(f"[JOBS] {job.kind} #{job.id} {outcome} in {duration_ms:.0f}ms (attempt {job.attempts}/{job.max_attempts})")
+    if error is not None:
+        print(f"[JOBS] {job.kind} #{job.id} error: {error.splitlines()[0]}")
+    return error is None
+
+
+def run_pending(worker_id: Optional[str] = None, limit: int = 50) -> int:
+    """Process up to `limit` due jobs; returns how many ran."""
+    worker_id = worker_id or default_worker_id()
+    ran = 0
+    while ran < limit:
+        with _context_factory():
+            try:
+                job = _claim_next(worker_id)
+                if job is None:
+                    break
+                _run(job)
+                ran += 1
+            finally:
+                _db.session.remove()
+    return ran
+
+
+def requeue_stale(older_than_seconds: int = STALE_AFTER_SECONDS) -> int:
+    """
+    Put jobs stuck in "running" (crashed worker) back in the queue. The
+    crashed run counts as an attempt (claiming already added it), so a job
+    that keeps killing its worker ends up "failed" at max_attempts.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    Job = _Job
+    stale = (Job.status == "running", Job.locked_at < cutoff)
+    released = {"locked_by": None, "locked_at": None, "last_error": "worker died while running the job"}
+    failed = (
+        _db.session.query(Job)
+        .filter(*stale, Job.attempts >= Job.max_attempts)
+        .update(dict(released, status="failed", finished_at=datetime.utcnow()), synchronize_session=False)
+    )
+    n = (
+        _db.session.query(Job)
+        .filter(*stale, Job.attempts < Job.max_attempts)
+        .update(dict(released, status="queued"), synchronize_session=False)
+    )
+    _db.session.commit()
+    if n:
+        print(f"[JOBS] Requeued {n} stale running jobs")
+    if failed:
+        print(f"[JOBS] Gave up on {failed} stale running jobs (max attempts reached)")
+    return n
+
+
+def _lock_recurring_schedule() -> None:
+    """
+    Serialise ensure_recurring() between processes until the transaction
+    ends, so two workers cannot both see no pending run and both add one.
+    """
+    from sqlalchemy import text
+
+    dialect = _db.engine.dialect.name
+    if dialect == "postgresql":
+        _db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": RECURRING_LOCK_KEY})
+    elif dialect == "sqlite":
+        # Any write statement takes SQLite's database-wide write lock.
+        _db.session.execute(text(f"UPDATE {_Job.__tablename__} SET id = id WHERE 0 = 1"))
+
+
+def ensure_recurring() -> int:
+    """Enqueue the next run of every recurring kind that has none pending."""
+    from sqlalchemy import func
+
+    Job = _Job
+    added = 0
+    _lock_recurring_schedule()
+    for kind, (every_seconds, payload) in _recurring.items():
+        pending = (
+            _db.session.query(Job.id)
+            .filter(Job.kind == kind, Job.status.in_(("queued", "running")))
+            .first()
+        )
+        if pending is not None:
+            continue
+        last = (
+            _db.session.query(func.max(Job.finished_at))
+            .filter(Job.kind == kind, Job.status.in_(("done", "failed")))
+            .scalar()
+        )
+        delay = 0.0
+        if last is not None:
+            delay = max(0.0, every_seconds - (datetime.utcnow() - last).total_seconds())
+        enqueue(kind, payload, delay_seconds=delay, commit=False)
+        added += 1
+    _db.session.commit()
+    return added
+
+
+def work_forever(worker_id: Optional[str] = None, poll_interval: float = POLL_INTERVAL_SECONDS,
+                 sleep: Callable[[float], None] = time.sleep, stop: Optional[threading.Event] = None) -> None:
+    """Worker loop: run due jobs, sleep when idle. `sleep` lets the embedded
+    worker yield cooperatively (e.g. socketio.sleep under eventlet)."""
+    worker_id = worker_id or default_worker_id()
+    print(f"[JOBS] Worker {worker_id} started")
+    last_stale_check = 0.0
+    while stop is None or not stop.is_set():
+        try:
+            if time.monotonic() - last_stale_check > 60:
+                with _context_factory():
+                    try:
+                        requeue_stale()
+                        ensure_recurring()
+                    finally:
+                        _db.session.remove()
+                last_stale_check = time.monotonic()
+            if run_pending(worker_id):
+                continue
+        except Exception as e:
+            print(f"[JOBS] Worker loop error: {e}")
+        sleep(poll_interval)
+
+
+def stats() -> Dict[str, Any]:
+    """Queue depth per status/kind from the table plus in-process timings."""
+    from sqlalchemy import func
+
+    Job = _Job
+    rows = (
+        _db.session.query(Job.kind, Job.status, func.count(Job.id), func.avg(Job.duration_ms), func.max(Job.duration_ms))
+        .group_by(Job.kind, Job.status)
+        .all()
+    )
+    by_kind: Dict[str, Dict[str, Any]] = {}
+    for kind, status, count, avg_ms, max_ms in rows:
+        entry = by_kind.setdefault(kind, {})
+        entry[status] = {
+            "count": int(count or 0),
+            "avg_ms": round(float(avg_ms), 1) if avg_ms is not None else None,
+            "max_ms": round(float(max_ms), 1) if max_ms is not None else None,
+        }
+    with _metrics_lock:
+        process = {
+            kind: dict(m, avg_ms=round(m["total_ms"] / m["runs"], 1) if m["runs"] else 0.0)
+            for kind, m in _metrics.items()
+        }
+    return {"jobs": by_kind, "this_process": process}
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def registered_kinds() -> List[str]:
+    return sorted(_handlers)
@@ -0,0 +1,120 @@
+"""add user_activity_hourly rollups; partition user_activity by day on Postgres
+
+Revision ID: 20261017_activity_retention
+Revises: 20261017_sos_rings
+Create Date: 2026-10-17
+
+"""
+
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_activity_retention'
+down_revision = '20261017_sos_rings'
+branch_labels = None
+depends_on = None
+
+PARTITION_DAYS_AHEAD = 3
+
+
+def upgrade():
+    op.create_table(
+        'user_activity_hourly',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('ping_count', sa.Integer(), nullable=False),
+        sa.Column('located_count', sa.Integer(), nullable=False),
+        sa.Column('lat_sum', sa.Float(), nullable=False),
+        sa.Column('lng_sum', sa.Float(), nullable=False),
+        sa.Column('motion_count', sa.Integer(), nullable=False),
+        sa.Column('motion_sum', sa.Float(), nullable=False),
+        sa.Column('first_at', sa.DateTime(), nullable=True),
+        sa.Column('last_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'hour', name='uq_user_activity_hourly_user_hour'),
+    )
+    op.create_index('ix_user_activity_hourly_user_id', 'user_activity_hourly', ['user_id'])
+    op.create_index('ix_user_activity_hourly_hour', 'user_activity_hourly', ['hour'])
+
+    if op.get_bind().dialect.name == 'postgresql':
+        _partition_user_activity()
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _unpartition_user_activity()
+
+    op.drop_index('ix_user_activity_hourly_hour', table_name='user_activity_hourly')
+    op.drop_index('ix_user_activity_hourly_user_id', table_name='user_activity_hourly')
+    op.drop_table('user_activity_hourly')
+
+
+def _partition_user_activity():
+    """Rebuild user_activity as a table range-partitioned by created_at (one
+    partition per day, plus a default one for older rows) so retention can
+    drop whole days instead of deleting row by row."""
+    op.execute("ALTER TABLE user_activity RENAME TO user_activity_old")
+    op.execute("ALTER INDEX user_activity_pkey RENAME TO user_activity_old_pkey")
+    op.execute("""
+        CREATE TABLE user_activity (
+            id integer NOT NULL DEFAULT nextval('user_activity_id_seq'),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            lat double precision,
+            lng double precision,
+            activity_type varchar(50) NOT NULL,
+            device_motion double precision,
+            created_at timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE TABLE user_activity_default PARTITION OF user_activity DEFAULT")
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    for offset in range(PARTITION_DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        op.execute(
+            f"CREATE TABLE user_activity_p{day:%Y%m%d} PARTITION OF user_activity "
+            f"FOR VALUES FROM ('{day:%Y-%m-%d}') TO ('{day + timedelta(days=1):%Y-%m-%d}')"
+        )
+
+    op.execute(
+        "INSERT INTO user_activity (id, user_id, lat, lng, activity_type, device_motion, created_at) "
+        "SELECT id, user_id, lat, lng, activity_type, device_motion, created_at FROM user_activity_old"
+    )
+    # Keep the id sequence alive when the old table goes away.
+    op.execute("ALTER SEQUENCE user_activity_id_seq OWNED BY user_activity.id")
+    op.execute("DROP TABLE user_activity_old")
+    op.create_index('ix_user_activity_created_at', 'user_activity', ['created_at'])
+    op.create_index('ix_user_activity_user_id', 'user_activity', ['user_id'])
+
+
+def _unpartition_user_activity():
+    op.execute("ALTER TABLE user_activity RENAME TO user_activity_partitioned")
+    op.execute("ALTER INDEX user_activity_pkey RENAME TO user_activity_partitioned_pkey")
+    op.execute("ALTER INDEX ix_user_activity_created_at RENAME TO ix_user_activity_partitioned_created_at")
+    op.execute("ALTER INDEX ix_user_activity_user_id RENAME TO ix_user_activity_partitioned_user_id")
+    op.execute("""
+        CREATE TABLE user_activity (
+            id integer NOT NULL DEFAULT nextval('user_activity_id_seq') PRIMARY KEY,
+            user_id integer NOT NULL REFERENCES "user" (id),
+            lat double precision,
+            lng double precision,
+            activity_type varchar(50) NOT NULL,
+            device_motion double precision,
+            created_at timestamp without time zone NOT NULL
+        )
+    """)
+    op.execute(
+        "INSERT INTO user_activity (id, user_id, lat, lng, activity_type, device_motion, created_at) "
+        "SELECT id, user_id, lat, lng, activity_type, device_motion, created_at FROM user_activity_partitioned"
+    )
+    op.execute("ALTER SEQUENCE user_activity_id_seq OWNED BY user_activity.id")
+    op.execute("DROP TABLE user_activity_partitioned CASCADE")
+    op.create_index('ix_user_activity_created_at', 'user_activity', ['created_at'])
+    op.create_index('ix_user_activity_user_id', 'user_activity', ['user_id'])
@@ -0,0 +1,52 @@
+"""add chat_attachments and chat_messages.attachment_id
+
+Revision ID: 20261017_chat_attachments
+Revises: 20261017_user_stats
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_attachments'
+down_revision = '20261017_user_stats'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_attachments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('uploader_id', sa.Integer(), nullable=False),
+        sa.Column('file_name', sa.String(length=255), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='uploading'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id']),
+        sa.ForeignKeyConstraint(['uploader_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_chat_attachments_conversation_id', 'chat_attachments', ['conversation_id'])
+    op.create_index('ix_chat_attachments_sha256', 'chat_attachments', ['sha256'])
+    with op.batch_alter_table('chat_messages') as batch_op:
+        batch_op.add_column(sa.Column('attachment_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            'fk_chat_messages_attachment_id', 'chat_attachments', ['attachment_id'], ['id']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('chat_messages') as batch_op:
+        batch_op.drop_constraint('fk_chat_messages_attachment_id', type_='foreignkey')
+        batch_op.drop_column('attachment_id')
+    op.drop_index('ix_chat_attachments_sha256', table_name='chat_attachments')
+    op.drop_index('ix_chat_attachments_conversation_id', table_name='chat_attachments')
+    op.drop_table('chat_attachments')
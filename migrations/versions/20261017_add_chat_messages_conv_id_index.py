@@ -0,0 +1,26 @@
+"""add (conversation_id, id) index on chat_messages for paged history
+
+Revision ID: 20261017_chat_messages_conv_id
+Revises: 20261017_chat_attachments
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_chat_messages_conv_id'
+down_revision = '20261017_chat_attachments'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_chat_messages_conv_id', 'chat_messages', ['conversation_id', 'id'], if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.drop_index('ix_chat_messages_conv_id', table_name='chat_messages', if_exists=True)
@@ -0,0 +1,42 @@
+"""add conversations.last_message_id / last_message_at for the chat inbox
+
+Revision ID: 20261017_conv_last_message
+Revises: 20261017_chat_messages_conv_id
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_conv_last_message'
+down_revision = '20261017_chat_messages_conv_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('last_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    op.execute(
+        """
+        UPDATE conversations SET
+            last_message_id = (
+                SELECT MAX(m.id) FROM chat_messages m WHERE m.conversation_id = conversations.id
+            ),
+            last_message_at = (
+                SELECT m.created_at FROM chat_messages m WHERE m.id = (
+                    SELECT MAX(m2.id) FROM chat_messages m2 WHERE m2.conversation_id = conversations.id
+                )
+            )
+        """
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('last_message_at')
+        batch_op.drop_column('last_message_id')
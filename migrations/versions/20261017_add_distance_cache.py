@@ -0,0 +1,36 @@
+"""add distance_cache table (route distances between rounded coordinates)
+
+Revision ID: 20261017_distance_cache
+Revises: 20261017_request_geohash
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_distance_cache'
+down_revision = '20261017_request_geohash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'distance_cache',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('provider', sa.String(length=30), nullable=False),
+        sa.Column('origin_key', sa.String(length=40), nullable=False),
+        sa.Column('dest_key', sa.String(length=40), nullable=False),
+        sa.Column('meters', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_distance_cache_pair', 'distance_cache', ['provider', 'dest_key', 'origin_key'])
+
+
+def downgrade():
+    op.drop_index('ix_distance_cache_pair', table_name='distance_cache')
+    op.drop_table('distance_cache')
@@ -0,0 +1,50 @@
+"""add geohash column to requests (spatial prefilter)
+
+Revision ID: 20261017_request_geohash
+Revises: 20251218_user_auth_fcm
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+import geo
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_request_geohash'
+down_revision = '20251218_user_auth_fcm'
+branch_labels = None
+depends_on = None
+
+
+def _backfill(bind, batch_size=500):
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, lat, lng FROM requests "
+                "WHERE id > :last_id AND lat IS NOT NULL AND lng IS NOT NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": batch_size},
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            sa.text("UPDATE requests SET geohash = :geohash WHERE id = :id"),
+            [{"id": r[0], "geohash": geo.encode_geohash(r[1], r[2])} for r in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.add_column('requests', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_requests_geohash', 'requests', ['geohash'], unique=False)
+    _backfill(op.get_bind())
+
+
+def downgrade():
+    op.drop_index('ix_requests_geohash', table_name='requests')
+    op.drop_column('requests', 'geohash')
@@ -0,0 +1,60 @@
+"""add composite (and Postgres partial) indexes for the hot requests queries
+
+Revision ID: 20261017_requests_indexes
+Revises: 20261017_activity_retention
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_requests_indexes'
+down_revision = '20261017_activity_retention'
+branch_labels = None
+depends_on = None
+
+# name -> columns; mirrors Request.__table_args__
+COMPOSITE_INDEXES = {
+    'ix_requests_status_offer_created': ['status', 'is_offer', 'created_at'],   # feeds by type, newest first
+    'ix_requests_status_expires': ['status', 'expires_at'],                     # open & unexpired counts
+    'ix_requests_offer_expires': ['is_offer', 'expires_at'],                    # need/offer totals
+    'ix_requests_expires_category': ['expires_at', 'category'],                 # category breakdown
+    'ix_requests_user_created': ['user_id', 'created_at'],                      # "my posts"
+    'ix_requests_helper_status': ['helper_id', 'status'],                       # "my engagements"
+}
+
+# Postgres only: indexes over just the open rows (a small slice of the table).
+PARTIAL_OPEN_INDEXES = {
+    'ix_requests_open_offer_created': ['is_offer', sa.text('created_at DESC')],
+    'ix_requests_open_expires': ['expires_at'],
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY keeps the table writable while the indexes build.
+        with op.get_context().autocommit_block():
+            for name, columns in COMPOSITE_INDEXES.items():
+                op.create_index(name, 'requests', columns, postgresql_concurrently=True, if_not_exists=True)
+            for name, columns in PARTIAL_OPEN_INDEXES.items():
+                op.create_index(
+                    name, 'requests', columns,
+                    postgresql_where=sa.text("status = 'open'"),
+                    postgresql_concurrently=True,
+                    if_not_exists=True,
+                )
+        return
+
+    for name, columns in COMPOSITE_INDEXES.items():
+        op.create_index(name, 'requests', columns, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in PARTIAL_OPEN_INDEXES:
+            op.drop_index(name, table_name='requests', if_exists=True)
+    for name in COMPOSITE_INDEXES:
+        op.drop_index(name, table_name='requests', if_exists=True)
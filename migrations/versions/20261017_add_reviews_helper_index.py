@@ -0,0 +1,25 @@
+"""index reviews.helper_id (scores are recomputed per helper on review writes)
+
+Revision ID: 20261017_reviews_helper_idx
+Revises: 20261017_user_counters
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_reviews_helper_idx'
+down_revision = '20261017_user_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reviews_helper_id', 'reviews', ['helper_id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_reviews_helper_id', table_name='reviews', if_exists=True)
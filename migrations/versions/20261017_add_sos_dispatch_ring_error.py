@@ -0,0 +1,27 @@
+"""add sos_dispatch_rings.error (why an SOS ring's bells/pushes failed)
+
+Revision ID: 20261017_sos_ring_error
+Revises: 20261017_conv_last_message
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_sos_ring_error'
+down_revision = '20261017_conv_last_message'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sos_dispatch_rings') as batch_op:
+        batch_op.add_column(sa.Column('error', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sos_dispatch_rings') as batch_op:
+        batch_op.drop_column('error')
@@ -0,0 +1,39 @@
+"""add sos_dispatch_rings table (ring-by-ring SOS dispatch log)
+
+Revision ID: 20261017_sos_rings
+Revises: 20261017_jobs
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_sos_rings'
+down_revision = '20261017_jobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sos_dispatch_rings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('request_id', sa.Integer(), nullable=False),
+        sa.Column('ring', sa.Integer(), nullable=False),
+        sa.Column('radius_km', sa.Float(), nullable=True),
+        sa.Column('helpers_notified', sa.Integer(), nullable=False),
+        sa.Column('dispatch_ms', sa.Float(), nullable=True),
+        sa.Column('dispatched_at', sa.DateTime(), nullable=False),
+        sa.Column('first_response_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['request_id'], ['requests.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_sos_dispatch_rings_request_id', 'sos_dispatch_rings', ['request_id'])
+
+
+def downgrade():
+    op.drop_index('ix_sos_dispatch_rings_request_id', table_name='sos_dispatch_rings')
+    op.drop_table('sos_dispatch_rings')
@@ -0,0 +1,48 @@
+"""add user_counters (unread badges) and indexes on notifications / chat
+
+Revision ID: 20261017_user_counters
+Revises: 20261017_requests_indexes
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_user_counters'
+down_revision = '20261017_requests_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created lazily (counted from the source tables on first read).
+    op.create_table(
+        'user_counters',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('unread_notifications', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('unread_chat', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index(
+        'ix_notifications_user_read_created', 'notifications', ['user_id', 'is_read', 'created_at'],
+        if_not_exists=True,
+    )
+    op.create_index(
+        'ix_chat_messages_conv_read_sender', 'chat_messages', ['conversation_id', 'read', 'sender_id'],
+        if_not_exists=True,
+    )
+    op.create_index('ix_conversations_user_a', 'conversations', ['user_a'], if_not_exists=True)
+    op.create_index('ix_conversations_user_b', 'conversations', ['user_b'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_conversations_user_b', table_name='conversations', if_exists=True)
+    op.drop_index('ix_conversations_user_a', table_name='conversations', if_exists=True)
+    op.drop_index('ix_chat_messages_conv_read_sender', table_name='chat_messages', if_exists=True)
+    op.drop_index('ix_notifications_user_read_created', table_name='notifications', if_exists=True)
+    op.drop_table('user_counters')
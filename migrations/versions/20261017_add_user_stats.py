@@ -0,0 +1,40 @@
+"""add user_stats (per-helper totals over reviews and impact_log)
+
+Revision ID: 20261017_user_stats
+Revises: 20261017_reviews_helper_idx
+Create Date: 2026-10-17
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261017_user_stats'
+down_revision = '20261017_reviews_helper_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created lazily (aggregated from the source tables on first
+    # read); scripts/rebuild_user_stats.py fills the whole table at once.
+    op.create_table(
+        'user_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('helped_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('people_helped', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('review_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('review_hours', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('event_hours', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('items', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('carbon', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('user_stats')
@@ -0,0 +1,175 @@
+"""
+Who is online, across all web workers.
+
+Socket connections are tracked per worker (sid -> user id, since a
+disconnect is always handled by the worker holding the socket); "is user X
+online" is answered from a store every worker can reach:
+
+- LocalPresence    process memory only (single worker, the default)
+- SharedPresence   a shared store: the local broker (backplane.BrokerClient)
+                   or Redis (RedisPresenceStore). Each socket is a member
+                   "<worker>/<sid>" of its user with an expiry; workers
+                   refresh their members every HEARTBEAT_SECONDS, so sockets
+                   of a crashed worker drop out after TTL_SECONDS.
+
+Store errors fall back to the local view rather than failing the request.
+"""
+
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional, Set
+
+import backplane
+
+HEARTBEAT_SECONDS = int(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "15"))
+TTL_SECONDS = HEARTBEAT_SECONDS * 3
+REDIS_KEY_PREFIX = "lifeline:presence:"
+
+
+class LocalPresence:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sids: Dict[str, int] = {}
+
+    def add(self, sid: str, user_id: int) -> None:
+        with self._lock:
+            self._sids[sid] = int(user_id)
+
+    def remove(self, sid: str) -> Optional[int]:
+        """Forget a socket; returns its user id (None if it never joined)."""
+        with self._lock:
+            return self._sids.pop(sid, None)
+
+    def user_for(self, sid: str) -> Optional[int]:
+        return self._sids.get(sid)
+
+    def local_users(self) -> Set[int]:
+        with self._lock:
+            return set(self._sids.values())
+
+    def is_online(self, user_id: int) -> bool:
+        return int(user_id) in self.online_among([user_id])
+
+    def online_among(self, user_ids: Iterable[int]) -> Set[int]:
+        local = self.local_users()
+        return {int(uid) for uid in user_ids if int(uid) in local}
+
+    def heartbeat(self) -> None:
+        pass
+
+    def run_heartbeat(self, sleep=time.sleep) -> None:
+        pass
+
+
+class SharedPresence(LocalPresence):
+    def __init__(self, store, worker_id: Optional[str] = None):
+        super().__init__()
+        self.store = store
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._failing = False
+
+    def _member(self, sid: str) -> str:
+        return f"{self.worker_id}/{sid}"
+
+    def _store_call(self, fn, *args):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            if not self._failing:
+                print(f"[PRESENCE] Shared store unavailable, using this worker's view: {e}")
+            self._failing = True
+            raise
+        if self._failing:
+            print("[PRESENCE] Shared store reachable again")
+            self._failing = False
+        return result
+
+    def add(self, sid: str, user_id: int) -> None:
+        super().add(sid, user_id)
+        try:
+            self._store_call(self.store.presence_set, [(self._member(sid), int(user_id))], TTL_SECONDS)
+        except Exception:
+            pass
+
+    def remove(self, sid: str) -> Optional[int]:
+        user_id = super().remove(sid)
+        if user_id is not None:
+            try:
+                self._store_call(self.store.presence_remove, self._member(sid), user_id)
+            except Exception:
+                pass
+        return user_id
+
+    def online_among(self, user_ids: Iterable[int]) -> Set[int]:
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+        if not user_ids:
+            return set()
+        try:
+            return set(self._store_call(self.store.presence_online, user_ids))
+        except Exception:
+            return super().online_among(user_ids)
+
+    def heartbeat(self) -> None:
+        """Refresh the expiry of every socket on this worker."""
+        with self._lock:
+            entries = [(self._member(sid), uid) for sid, uid in self._sids.items()]
+        if not entries:
+            return
+        try:
+            self._store_call(self.store.presence_set, entries, TTL_SECONDS)
+        except Exception:
+            pass
+
+    def run_heartbeat(self, sleep=time.sleep) -> None:
+        while True:
+            sleep(HEARTBEAT_SECONDS)
+            self.heartbeat()
+
+
+class RedisPresenceStore:
+    """Presence store on Redis: one sorted set per user, scored by expiry."""
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for redis:// queues
+
+        self.redis = redis.Redis.from_url(url)
+
+    def _key(self, user_id: int) -> str:
+        return f"{REDIS_KEY_PREFIX}{int(user_id)}"
+
+    def presence_set(self, entries, ttl: float) -> None:
+        expires = time.time() + ttl
+        pipe = self.redis.pipeline(transaction=False)
+        for member, user_id in entries:
+            pipe.zadd(self._key(user_id), {member: expires})
+            pipe.expire(self._key(user_id), int(ttl) + 1)
+        pipe.execute()
+
+    def presence_remove(self, member: str, user_id: int) -> None:
+        self.redis.zrem(self._key(user_id), member)
+
+    def presence_online(self, user_ids) -> Set[int]:
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for uid in user_ids:
+            pipe.zcount(self._key(uid), now, "+inf")
+        return {int(uid) for uid, n in zip(user_ids, pipe.execute()) if n}
+
+
+def presence_for_url(url: Optional[str]) -> LocalPresence:
+    """The presence registry matching the Socket.IO message queue URL."""
+    if not url:
+        return LocalPresence()
+    try:
+        if backplane.is_local_url(url):
+            return SharedPresence(backplane.BrokerClient(url))
+        if url.startswith(("redis://", "rediss://")):
+            return SharedPresence(RedisPresenceStore(url))
+    except Exception as e:
+        print(f"[PRESENCE] Cannot use {url.split('://')[0]}:// for presence: {e}")
+        return LocalPresence()
+    print(f"[PRESENCE] No shared presence store for {url.split('://')[0]}://; "
+          "set PRESENCE_URL to a redis:// or local:// URL")
+    return LocalPresence()
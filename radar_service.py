@@ -0,0 +1,369 @@
+"""
+In-memory snapshot behind the Availability Radar.
+
+Keeps, per user, the pings of the last RADAR_MAX_WINDOW_MIN minutes (time,
+position, device motion) plus their name / helper flag, so both radar
+endpoints are answered without touching the database:
+
+- `record()` is called from /api/activity/ping for every ping.
+- Samples older than the longest window are evicted as queries run.
+- A private GeoIndex keyed by user id (last known position) narrows every
+  query to the users around the viewer.
+- `tile_payload()` pre-aggregates pings into a fixed TILE_GRID x TILE_GRID
+  grid per web-mercator tile; the JSON body and its ETag are cached for
+  TILE_TTL_SECONDS and shared by every viewer of that tile.
+
+The snapshot is warmed from the database through a loader registered by
+the app and reloaded every REFRESH_SECONDS, so pings taken by other
+processes show up even if their broadcast (cluster.py) was missed. A reload
+keeps the in-memory pings of the last RELOAD_OVERLAP_SECONDS that the
+database does not have yet (activity pings are written in batches).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import geo
+from geo_index import GeoIndex
+
+RADAR_MAX_WINDOW_MIN = 180
+MAX_SAMPLES_PER_USER = 720
+# Users are indexed at their last position; anyone whose recent pings are
+# within the radius is found as long as they moved less than this since.
+CANDIDATE_SLACK_KM = 2.0
+EVICT_INTERVAL_SECONDS = 30
+REFRESH_SECONDS = int(os.getenv("RADAR_REFRESH_SECONDS", "300"))
+RELOAD_OVERLAP_SECONDS = 120
+
+# Heatmap tiles: cells per tile side (so at most TILE_GRID**2 cells per
+# response), the zoom levels served, and how long a computed tile is shared.
+TILE_GRID = 16
+MIN_TILE_ZOOM = 10
+MAX_TILE_ZOOM = 18
+TILE_TTL_SECONDS = int(os.getenv("RADAR_TILE_TTL_SECONDS", "15"))
+MAX_CACHED_TILES = 4096
+
+
+class _UserState:
+    __slots__ = ("user_id", "name", "is_helper", "samples")
+
+    def __init__(self, user_id: int, name: str = "User", is_helper: bool = False):
+        self.user_id = user_id
+        self.name = name
+        self.is_helper = is_helper
+        # (created_at, lat, lng, device_motion), oldest first
+        self.samples = deque(maxlen=MAX_SAMPLES_PER_USER)
+
+
+class RadarSnapshot:
+    def __init__(self, max_window_min: int = RADAR_MAX_WINDOW_MIN, refresh_seconds: int = REFRESH_SECONDS):
+        self.max_window = timedelta(minutes=max_window_min)
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._users: Dict[int, _UserState] = {}
+        self._index = GeoIndex()
+        self._loader: Optional[Callable[[], Iterable[tuple]]] = None
+        self._loaded = False
+        self._loaded_at: Optional[float] = None
+        self._reload_lock = threading.Lock()
+        self._last_evict: Optional[datetime] = None
+        # (z, x, y, window_min) -> (expires_monotonic, etag, body)
+        self._tiles: Dict[tuple, Tuple[float, str, bytes]] = {}
+        self._tile_lock = threading.Lock()
+
+    # ---------- writes ----------
+
+    def register_loader(self, loader: Callable[[], Iterable[tuple]]) -> None:
+        """loader() -> (user_id, name, is_helper, lat, lng, device_motion, created_at) rows, oldest first."""
+        self._loader = loader
+
+    def ensure_loaded(self) -> None:
+        if self._loader is None:
+            return
+        if not self._loaded:
+            self._load(initial=True)
+            return
+        if time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return  # another thread is reloading; keep serving the current snapshot
+        try:
+            if time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                self._load(initial=False)
+        finally:
+            self._reload_lock.release()
+
+    def _load(self, initial: bool) -> None:
+        try:
+            rows = list(self._loader())
+        except Exception as e:
+            print(f"[Radar] Snapshot load failed: {e}")
+            if self._loaded:
+                self._loaded_at = time.monotonic()  # retry on the next refresh
+            return
+        with self._lock:
+            if initial:
+                if self._loaded:
+                    return
+                for user_id, name, is_helper, lat, lng, motion, created_at in rows:
+                    self._add(user_id, lat, lng, motion, created_at, name, is_helper)
+                self._loaded = True
+                self._loaded_at = time.monotonic()
+                print(f"[Radar] Snapshot warmed with {len(rows)} pings for {len(self._users)} users")
+                return
+
+            # Reload: rebuild from the database, then put back recent pings it
+            # does not have yet (still buffered, or not written at all).
+            newest = max((row[6] for row in rows), default=None)
+            keep_after = (newest - timedelta(seconds=RELOAD_OVERLAP_SECONDS)) if newest else None
+            loaded = {(row[0], row[6]) for row in rows}
+            recent = [
+                (state.user_id, state.name, state.is_helper, lat, lng, motion, at)
+                for state in self._users.values()
+                for at, lat, lng, motion in state.samples
+                if (keep_after is None or at > keep_after) and (state.user_id, at) not in loaded
+            ]
+            self._users = {}
+            self._index = GeoIndex()
+            for user_id, name, is_helper, lat, lng, motion, created_at in sorted(
+                rows + recent, key=lambda row: row[6]
+            ):
+                self._add(user_id, lat, lng, motion, created_at, name, is_helper)
+            self._loaded_at = time.monotonic()
+
+    def record(self, user_id: int, lat: Optional[float], lng: Optional[float], device_motion: Optional[float] = None,
+               at: Optional[datetime] = None, name: Optional[str] = None, is_helper: Optional[bool] = None) -> None:
+        # Warm up first, so a ping recorded before it is stored is not counted twice.
+        self.ensure_loaded()
+        with self._lock:
+            self._add(user_id, lat, lng, device_motion, at or datetime.utcnow(), name, is_helper)
+
+    def update_user(self, user_id: int, name: Optional[str] = None, is_helper: Optional[bool] = None) -> None:
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                return
+            if name is not None:
+                state.name = name
+            if is_helper is not None:
+                state.is_helper = bool(is_helper)
+
+    def _add(self, user_id, lat, lng, motion, created_at, name, is_helper):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(user_id)
+        if name is not None:
+            state.name = name
+        if is_helper is not None:
+            state.is_helper = bool(is_helper)
+        state.samples.append((created_at, lat, lng, motion))
+        if lat is not None and lng is not None:
+            self._index.upsert("user", user_id, lat, lng, expires_at=created_at + self.max_window)
+
+    def evict(self, now: Optional[datetime] = None) -> int:
+        """Drop samples older than the longest window; returns users removed."""
+        cutoff = (now or datetime.utcnow()) - self.max_window
+        removed = 0
+        with self._lock:
+            for user_id in list(self._users):
+                samples = self._users[user_id].samples
+                while samples and samples[0][0] < cutoff:
+                    samples.popleft()
+                if not samples:
+                    del self._users[user_id]
+                    self._index.remove("user", user_id)
+                    removed += 1
+        return removed
+
+    # ---------- reads ----------
+
+    def _candidates(self, lat, lng, radius_km, window_min, now):
+        """[(state, window_samples)] for users that may be inside the radius."""
+        self.ensure_loaded()
+        if self._last_evict is None or (now - self._last_evict).total_seconds() >= EVICT_INTERVAL_SECONDS:
+            self.evict(now)
+            self._last_evict = now
+        cutoff = now - timedelta(minutes=window_min)
+        out = []
+        with self._lock:
+            for user_id, _ in self._index.query_radius(lat, lng, radius_km + CANDIDATE_SLACK_KM, kind="user", now=now):
+                state = self._users.get(user_id)
+                if state is None:
+                    continue
+                samples = [s for s in state.samples if s[0] >= cutoff]
+                if samples:
+                    out.append((state, samples))
+        return out
+
+    def active_users(self, lat: float, lng: float, radius_km: float, window_min: int,
+                     now: Optional[datetime] = None) -> List[dict]:
+        """
+        Per user: average position of their pings in the window, ping count,
+        average motion and last-seen time; kept if the average position is
+        within the radius.
+        """
+        now = now or datetime.utcnow()
+        rows = []
+        for state, samples in self._candidates(lat, lng, radius_km, window_min, now):
+            located = [s for s in samples if s[1] is not None and s[2] is not None]
+            if not located:
+                continue
+            motions = [s[3] for s in samples if s[3] is not None]
+            rows.append({
+                "user_id": state.user_id,
+                "name": state.name,
+                "is_helper": state.is_helper,
+                "avg_lat": sum(s[1] for s in located) / len(located),
+                "avg_lng": sum(s[2] for s in located) / len(located),
+                "activity_count": len(samples),
+                "avg_motion": (sum(motions) / len(motions)) if motions else None,
+                "last_activity": samples[-1][0],
+            })
+
+        dists = geo.distances_km(lat, lng, [r["avg_lat"] for r in rows], [r["avg_lng"] for r in rows])
+        result = []
+        for row, dist in zip(rows, dists):
+            if dist <= radius_km:
+                row["distance_km"] = float(dist)
+                result.append(row)
+        return result
+
+    def heatmap(self, lat: float, lng: float, radius_km: float, window_min: int,
+                now: Optional[datetime] = None) -> List[dict]:
+        """
+        Per user: only their pings inside the radius, aggregated into a mean
+        position, count, summed motion and nearest distance.
+        """
+        now = now or datetime.utcnow()
+        owners, lats, lngs, motions = [], [], [], []
+        for state, samples in self._candidates(lat, lng, radius_km, window_min, now):
+            for _, s_lat, s_lng, motion in samples:
+                if s_lat is None or s_lng is None:
+                    continue
+                owners.append(state)
+                lats.append(s_lat)
+                lngs.append(s_lng)
+                motions.append(motion)
+
+        dists = geo.distances_km(lat, lng, lats, lngs)
+        aggregated: Dict[int, dict] = {}
+        for state, s_lat, s_lng, motion, dist in zip(owners, lats, lngs, motions, dists):
+            if dist > radius_km:
+                continue
+            entry = aggregated.get(state.user_id)
+            if entry is None:
+                entry = aggregated[state.user_id] = {
+                    "user_id": state.user_id,
+                    "name": state.name,
+                    "is_helper": state.is_helper,
+                    "lat_sum": 0.0,
+                    "lng_sum": 0.0,
+                    "count": 0,
+                    "motion_sum": 0.0,
+                    "distance": float(dist),
+                }
+            entry["lat_sum"] += s_lat
+            entry["lng_sum"] += s_lng
+            entry["count"] += 1
+            entry["distance"] = min(entry["distance"], float(dist))
+            if motion is not None:
+                entry["motion_sum"] += motion
+        return list(aggregated.values())
+
+    def tile(self, z: int, x: int, y: int, window_min: int, now: Optional[datetime] = None) -> List[dict]:
+        """
+        Pings inside web-mercator tile z/x/y bucketed into a TILE_GRID x
+        TILE_GRID grid: per non-empty cell the mean position, ping count,
+        distinct users/helpers and a 0-1 weight (same scale as `heatmap`).
+        No user ids or names, since tiles are shared between viewers.
+        """
+        now = now or datetime.utcnow()
+        south, west, north, east = geo.tile_bounds(z, x, y)
+        c_lat, c_lng = (south + north) / 2, (west + east) / 2
+        radius_km = geo.haversine_km(c_lat, c_lng, north, west)
+
+        cells: Dict[Tuple[int, int], dict] = {}
+        for state, samples in self._candidates(c_lat, c_lng, radius_km, window_min, now):
+            for _, lat, lng, motion in samples:
+                if lat is None or lng is None or not (south <= lat < north and west <= lng < east):
+                    continue
+                key = (
+                    min(TILE_GRID - 1, int((north - lat) / (north - south) * TILE_GRID)),
+                    min(TILE_GRID - 1, int((lng - west) / (east - west) * TILE_GRID)),
+                )
+                cell = cells.get(key)
+                if cell is None:
+                    cell = cells[key] = {"lat_sum": 0.0, "lng_sum": 0.0, "count": 0, "motion_sum": 0.0,
+                                         "users": set(), "helpers": set()}
+                cell["lat_sum"] += lat
+                cell["lng_sum"] += lng
+                cell["count"] += 1
+                if motion is not None:
+                    cell["motion_sum"] += motion
+                cell["users"].add(state.user_id)
+                if state.is_helper:
+                    cell["helpers"].add(state.user_id)
+
+        out = []
+        for (row, col), cell in sorted(cells.items()):
+            count = cell["count"]
+            motion_avg = cell["motion_sum"] / count
+            intensity = min(100, count * 15)
+            if motion_avg > 20:
+                intensity = min(100, intensity + (motion_avg / 2))
+            out.append({
+                "row": row,
+                "col": col,
+                "lat": round(cell["lat_sum"] / count, 6),
+                "lng": round(cell["lng_sum"] / count, 6),
+                "count": count,
+                "users": len(cell["users"]),
+                "helpers": len(cell["helpers"]),
+                "weight": round(min(1.0, intensity / 100), 3),
+            })
+        return out
+
+    def tile_payload(self, z: int, x: int, y: int, window_min: int) -> Tuple[str, bytes]:
+        """(etag, JSON body) for a tile; computed at most once per TILE_TTL_SECONDS."""
+        key = (z, x, y, window_min)
+        hit = self._tiles.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1], hit[2]
+
+        with self._tile_lock:
+            # Another viewer may have computed it while we waited.
+            hit = self._tiles.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                return hit[1], hit[2]
+
+            body = json.dumps({
+                "ok": True,
+                "z": z,
+                "x": x,
+                "y": y,
+                "window_min": window_min,
+                "grid": TILE_GRID,
+                "cells": self.tile(z, x, y, window_min),
+            }, separators=(",", ":")).encode("utf-8")
+            etag = hashlib.sha1(body).hexdigest()
+
+            now_m = time.monotonic()
+            if len(self._tiles) >= MAX_CACHED_TILES:
+                for k in [k for k, v in self._tiles.items() if v[0] <= now_m]:
+                    del self._tiles[k]
+                if len(self._tiles) >= MAX_CACHED_TILES:
+                    self._tiles.clear()
+            self._tiles[key] = (now_m + TILE_TTL_SECONDS, etag, body)
+        return etag, body
+
+    def size(self) -> int:
+        return len(self._users)
+
+
+radar = RadarSnapshot()
@@ -0,0 +1,447 @@
+"""
+Versioned in-memory snapshot of the live (open, unexpired) requests.
+
+Backs the home page's live-requests widget, which polls every second:
+
+- The snapshot holds one compact, pre-rendered dict per live request
+  (poster name included), loaded once per process through a loader
+  registered by the app and reloaded every REFRESH_SECONDS so writes made
+  by other processes show up eventually.
+- Every change (create, update, expire, delete) bumps `version` and is
+  recorded in a bounded change log. Writes are staged by the app's mapper
+  events and applied on commit, so rolled-back rows never appear.
+- Listeners (`add_listener`) get every batch of changes, e.g. to push them
+  over the socket event bus.
+- `view()` answers a poll: nothing to do when the client is already at the
+  current version, the changed rows around the viewer when its version is
+  still in the log, the nearest rows otherwise.
+
+Versions start from the process start time in milliseconds, so a version
+handed out by an earlier process is simply treated as unknown.
+
+With several web workers (`use_cluster`, cluster.py) versions come from one
+shared counter instead: a worker sends each batch of changes through the
+cluster and every worker, the sender included, applies the batches in
+counter order, so a `since_version` from one worker is valid on all of them.
+Expiry and periodic reloads then run on the lead worker only (`tick`); a
+worker that misses batches (reconnect, gap in the counter) reloads and
+starts a fresh log.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import geo
+
+REFRESH_SECONDS = int(os.getenv("REQUEST_FEED_REFRESH_SECONDS", "60"))
+# Changes kept for deltas; older clients get a full snapshot instead.
+MAX_LOG_ENTRIES = 2000
+DESCRIPTION_CHARS = 160
+
+# loader() -> iterable of (Request, user_name) for the live requests
+Loader = Callable[[], Iterable[tuple]]
+# listener([(request_id, old_row, new_row), ...], version); a None row means
+# "not live" (old_row is also None when the sender did not have the row)
+Listener = Callable[[List[tuple], int], None]
+CLUSTER_TOPIC = "feed"
+RETRY_SECONDS = 5.0
+
+
+def _epoch(dt: Optional[datetime]) -> Optional[int]:
+    return int(dt.timestamp()) if dt is not None else None
+
+
+def is_live(req, now: Optional[datetime] = None) -> bool:
+    now = now or datetime.utcnow()
+    return (
+        req.status == "open"
+        and req.completed_at is None
+        and req.expires_at is not None
+        and req.expires_at > now
+        and req.lat is not None
+        and req.lng is not None
+    )
+
+
+def compact_row(req, user_name: Optional[str]) -> Dict[str, Any]:
+    """The fields the live widget renders, computed once per change."""
+    description = req.description or ""
+    if len(description) > DESCRIPTION_CHARS:
+        description = description[:DESCRIPTION_CHARS]
+    return {
+        "id": req.id,
+        "user_id": req.user_id,
+        "user_name": user_name,
+        "title": req.title,
+        "category": req.category,
+        "description": description,
+        "lat": req.lat,
+        "lng": req.lng,
+        "area": req.area,
+        "urgency": req.urgency,
+        "is_offer": bool(req.is_offer),
+        "image_url": req.image_url,
+        "status": req.status,
+        "created_at": _epoch(req.created_at),
+        "expires_at": _epoch(req.expires_at),
+    }
+
+
+class RequestFeed:
+    def __init__(self, refresh_seconds: int = REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self._names: Dict[int, str] = {}
+        # (version, request_id), oldest first
+        self._log: deque = deque(maxlen=MAX_LOG_ENTRIES)
+        self._loader: Optional[Loader] = None
+        self._loaded_at: Optional[float] = None
+        self._next_expiry: Optional[int] = None
+        self._listeners: List[Listener] = []
+        self._pending: List[tuple] = []
+        self.version = int(time.time() * 1000)
+        # shared mode (use_cluster)
+        self._cluster = None
+        self._load_lock = threading.Lock()
+        self._loading = False
+        self._early: List[tuple] = []  # (seq, changes) received while loading
+        self._retry_at = 0.0
+        self._behind: Optional[int] = None
+
+    # ---------- loading ----------
+
+    def register_loader(self, loader: Loader) -> None:
+        self._loader = loader
+
+    def add_listener(self, listener: Listener) -> None:
+        """
+        Called after every batch of changes, outside the lock. With a cluster
+        only the worker that sent the batch calls it.
+        """
+        self._listeners.append(listener)
+
+    def use_cluster(self, cluster) -> None:
+        """Share versions and changes with the other workers (see module docstring)."""
+        self._cluster = cluster
+        cluster.on_sequenced(CLUSTER_TOPIC, self._receive)
+        cluster.on_subscribed(self.resync)
+
+    def ensure_loaded(self, refresh: bool = True) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is not None and (not refresh or time.monotonic() - loaded_at < self.refresh_seconds):
+            return
+        if self._loader is None:
+            return
+        if self._cluster is not None and loaded_at is None:
+            self._load_shared(initial=True)
+            return
+        try:
+            rows = {req.id: compact_row(req, name) for req, name in self._loader()}
+        except Exception as e:
+            print(f"[Feed] Failed to load live requests: {e}")
+            # Retry on the next refresh rather than on every poll.
+            self._loaded_at = time.monotonic()
+            return
+
+        with self._lock:
+            if self._loaded_at is None:
+                self._rows = rows
+                self._log.clear()
+                self._reset_expiry()
+                print(f"[Feed] Loaded {len(rows)} live requests (version {self.version})")
+                changed = {}
+            else:
+                # Reload: record only what differs (e.g. written by another process).
+                changed = {rid: row for rid, row in rows.items() if self._rows.get(rid) != row}
+                changed.update({rid: None for rid in self._rows if rid not in rows})
+            for row in rows.values():
+                if row["user_name"] is not None:
+                    self._names[row["user_id"]] = row["user_name"]
+            self._loaded_at = time.monotonic()
+        self._commit(changed)
+
+    def _load_shared(self, initial: bool = False) -> None:
+        """
+        (Re)load the snapshot at the cluster's current version. Batches that
+        arrive meanwhile are held back and replayed on top; the log starts
+        empty, so older client versions get a full snapshot.
+        """
+        if time.monotonic() < self._retry_at or not self._cluster.wait_ready(RETRY_SECONDS):
+            return
+        with self._load_lock:
+            if initial and self._loaded_at is not None:
+                return  # another thread loaded it while this one waited
+            with self._lock:
+                self._loading = True
+            try:
+                # The counter first: every batch up to it was committed before
+                # it was sent, so the snapshot read next includes it.
+                version = self._cluster.current_seq(CLUSTER_TOPIC)
+                rows = {req.id: compact_row(req, name) for req, name in self._loader()}
+            except Exception as e:
+                print(f"[Feed] Failed to load live requests: {e}")
+                self._retry_at = time.monotonic() + RETRY_SECONDS
+                with self._lock:
+                    self._loading = False
+                return
+            with self._lock:
+                self._rows = rows
+                self._log.clear()
+                self.version = version
+                for row in rows.values():
+                    if row["user_name"] is not None:
+                        self._names[row["user_id"]] = row["user_name"]
+                early, self._early = self._early, []
+                for seq, changes in sorted(early, key=lambda item: item[0]):
+                    if seq > self.version:
+                        self._apply_batch(seq, changes)
+                self._reset_expiry()
+                self._loading = False
+                self._loaded_at = time.monotonic()
+                self._behind = None
+        print(f"[Feed] Loaded {len(rows)} live requests (shared version {version})")
+
+    def resync(self) -> None:
+        """Reload after batches may have been missed (the cluster resubscribed)."""
+        if self._loaded_at is not None:
+            self._load_shared()
+
+    def tick(self, lead: bool = True) -> None:
+        """
+        Background tick: periodic reload and expiry. With a cluster only the
+        lead worker does them; every worker checks it has not fallen behind.
+        """
+        if self._cluster is None or lead:
+            self.ensure_loaded()
+            self.expire()
+        else:
+            self.ensure_loaded(refresh=False)
+        if self._cluster is not None:
+            self._check_behind()
+
+    def ensure_current(self) -> None:
+        """
+        Before a read: load, reload when due and expire. With a cluster only
+        the first load happens here; reloads and expiry come from the lead
+        worker, and reads skip rows that expired meanwhile.
+        """
+        if self._cluster is None:
+            self.ensure_loaded()
+            self.expire()
+        else:
+            self.ensure_loaded(refresh=False)
+
+    def _check_behind(self) -> None:
+        # A batch lost on the way (and nothing after it to reveal the gap):
+        # the counter moved on but this worker stayed behind for a whole tick.
+        if self._loaded_at is None:
+            return
+        try:
+            latest = self._cluster.current_seq(CLUSTER_TOPIC)
+        except Exception:
+            return
+        if latest <= self.version:
+            self._behind = None
+        elif self._behind is not None and self.version < self._behind:
+            print(f"[Feed] Behind the cluster ({self.version} < {self._behind}); reloading")
+            self._behind = None
+            self._load_shared()
+        else:
+            self._behind = latest
+
+    def _receive(self, seq: int, data: Dict[str, Any]) -> None:
+        """A batch from the cluster (own ones included), in counter order."""
+        changes = {int(rid): row for rid, row in (data or {}).items()}
+        with self._lock:
+            if self._loaded_at is None or self._loading:
+                if len(self._early) < MAX_LOG_ENTRIES:
+                    self._early.append((seq, changes))
+                return
+            if seq <= self.version:
+                return  # already in the snapshot
+            if seq == self.version + 1:
+                self._apply_batch(seq, changes)
+                self._reset_expiry()
+                return
+        print(f"[Feed] Missed batches {self.version + 1}..{seq - 1}; reloading")
+        self._load_shared()
+
+    def _apply_batch(self, seq: int, changes: Dict[int, Optional[Dict[str, Any]]]) -> None:
+        for rid, row in changes.items():
+            if row is not None and row.get("user_name") is not None:
+                self._names[row["user_id"]] = row["user_name"]
+            if self._rows.get(rid) != row:
+                self._set(rid, row, version=seq)
+        self.version = seq
+
+    # ---------- writes ----------
+
+    def user_name(self, user_id: int) -> Optional[str]:
+        return self._names.get(user_id)
+
+    def apply(self, changes: Dict[int, Optional[Dict[str, Any]]]) -> None:
+        """Apply committed changes: request id -> compact row, or None to drop it."""
+        if not changes:
+            return
+        for row in changes.values():
+            if row is not None and row.get("user_name") is not None:
+                self._names[row["user_id"]] = row["user_name"]
+        if self._cluster is None and self._loaded_at is None:
+            return  # the first load will pick them up
+        self._commit(changes)
+
+    def rename_user(self, user_id: int, name: Optional[str]) -> None:
+        if name is None or self._names.get(user_id, name) == name:
+            self._names[user_id] = name
+            return
+        with self._lock:
+            self._names[user_id] = name
+            renamed = {
+                rid: dict(row, user_name=name) for rid, row in self._rows.items() if row["user_id"] == user_id
+            }
+        self._commit(renamed)
+
+    def forget_user_name(self, user_id: int) -> None:
+        """Drop a cached poster name (renamed by another worker)."""
+        self._names.pop(user_id, None)
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """Drop rows whose expiry has passed; cheap when nothing is due."""
+        now_s = int((now or datetime.utcnow()).timestamp())
+        if self._next_expiry is None or now_s < self._next_expiry:
+            return 0
+        with self._lock:
+            expired = [rid for rid, row in self._rows.items() if row["expires_at"] <= now_s]
+        self._commit({rid: None for rid in expired})
+        return len(expired)
+
+    def _commit(self, changes: Dict[int, Optional[Dict[str, Any]]]) -> None:
+        """Apply changes here, or with a cluster send them to every worker."""
+        if not changes:
+            return
+        if self._cluster is not None:
+            self._send(changes)
+            return
+        with self._lock:
+            for rid, row in changes.items():
+                if self._rows.get(rid) != row:
+                    self._set(rid, row)
+            self._reset_expiry()
+        self._notify()
+
+    def _send(self, changes: Dict[int, Optional[Dict[str, Any]]]) -> None:
+        try:
+            version = self._cluster.publish_sequenced(
+                CLUSTER_TOPIC, {str(rid): row for rid, row in changes.items()}
+            )
+        except Exception as e:
+            # Picked up again by the lead worker's next reload.
+            print(f"[Feed] Could not send {len(changes)} changes to the cluster: {e}")
+            return
+        with self._lock:
+            batch = [(rid, self._rows.get(rid), row) for rid, row in changes.items()]
+        self._call_listeners(batch, version)
+
+    def _set(self, rid: int, row: Optional[Dict[str, Any]], version: Optional[int] = None) -> None:
+        if row is None:
+            old = self._rows.pop(rid, None)
+            if old is None:
+                return
+        else:
+            old = self._rows.get(rid)
+            self._rows[rid] = row
+        if version is None:
+            self.version += 1
+            version = self.version
+        self._log.append((version, rid))
+        if self._listeners and self._cluster is None:
+            self._pending.append((rid, old, row))
+
+    def _notify(self) -> None:
+        with self._lock:
+            changes, self._pending = self._pending, []
+            version = self.version
+        self._call_listeners(changes, version)
+
+    def _call_listeners(self, changes: List[tuple], version: int) -> None:
+        if not changes:
+            return
+        for listener in self._listeners:
+            try:
+                listener(changes, version)
+            except Exception as e:
+                print(f"[Feed] Listener failed: {e}")
+
+    def _reset_expiry(self) -> None:
+        self._next_expiry = min((row["expires_at"] for row in self._rows.values()), default=None)
+
+    # ---------- reads ----------
+
+    def changed_since(self, version: int) -> Optional[List[int]]:
+        """Ids changed after `version`, or None if the log no longer covers it."""
+        with self._lock:
+            if version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self._log or self._log[0][0] > version + 1:
+                return None
+            return list({rid for v, rid in self._log if v > version})
+
+    def view(self, lat: float, lng: float, radius_km: float, limit: int,
+             exclude_user_id: Optional[int] = None, since_version: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Rows for one viewer. Returns {"version", "unchanged": True} when the
+        client is current, {"version", "full": False, "upserts", "removed"}
+        for a delta, or {"version", "full": True, "requests"} otherwise.
+        Rows carry distance_km and seconds_remaining.
+        """
+        self.ensure_current()
+
+        with self._lock:
+            version = self.version
+            changed = self.changed_since(since_version) if since_version is not None else None
+            if changed == []:
+                return {"version": version, "unchanged": True}
+            if changed is None:
+                candidates = list(self._rows.values())
+            else:
+                candidates = [self._rows[rid] for rid in changed if rid in self._rows]
+
+        rows = self._near(candidates, lat, lng, radius_km, exclude_user_id)
+        if changed is None:
+            return {"version": version, "full": True, "requests": rows[:limit]}
+        kept = {row["id"] for row in rows}
+        return {
+            "version": version,
+            "full": False,
+            "upserts": rows,
+            "removed": sorted(rid for rid in changed if rid not in kept),
+        }
+
+    @staticmethod
+    def _near(rows, lat, lng, radius_km, exclude_user_id) -> List[Dict[str, Any]]:
+        if exclude_user_id is not None:
+            rows = [row for row in rows if row["user_id"] != exclude_user_id]
+        distances = geo.distances_km(lat, lng, [row["lat"] for row in rows], [row["lng"] for row in rows])
+        now_s = int(datetime.utcnow().timestamp())  # same clock as _epoch()
+        out = []
+        for row, km in zip(rows, distances):
+            if km <= radius_km and row["expires_at"] > now_s:
+                item = dict(row)
+                item["distance_km"] = round(float(km), 2)
+                item["seconds_remaining"] = max(0, row["expires_at"] - now_s)
+                out.append(item)
+        out.sort(key=lambda r: r["distance_km"])
+        return out
+
+    def size(self) -> int:
+        return len(self._rows)
+
+
+feed = RequestFeed()
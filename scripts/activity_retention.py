@@ -0,0 +1,41 @@
+"""Roll up and purge old user_activity rows (see activity_retention.py).
+
+Normally this runs as the recurring "activity_retention" job; use this to
+preview or run it by hand.
+
+Run:
+    python scripts/activity_retention.py --dry-run
+    python scripts/activity_retention.py --retention-hours 48 --batch-size 2000
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import activity_retention  # noqa: E402
+from app import app, db, UserActivity, UserActivityHourly  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would change, write nothing")
+    parser.add_argument("--retention-hours", type=int, default=activity_retention.RETENTION_HOURS)
+    parser.add_argument("--batch-size", type=int, default=activity_retention.PURGE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with app.app_context():
+        result = activity_retention.run(
+            db, UserActivity, UserActivityHourly,
+            retention_hours=args.retention_hours,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
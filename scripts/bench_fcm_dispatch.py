@@ -0,0 +1,83 @@
+"""Offline FCM fan-out benchmark: per-user multicast vs FCMDispatcher.
+
+Uses a throwaway SQLite database and FakeFCMClient (no Firebase needed).
+
+Run:
+    python scripts/bench_fcm_dispatch.py
+    python scripts/bench_fcm_dispatch.py --users 5000 --latency-ms 40 --workers 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_db_file = os.path.join(tempfile.mkdtemp(prefix="lifeline_bench_"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ.setdefault("JOB_WORKER_MODE", "off")
+
+from app import app, db, User, FCMToken  # noqa: E402
+from fcm_dispatcher import FCMDispatcher, FakeFCMClient  # noqa: E402
+
+
+def seed(n_users, tokens_per_user):
+    users = [User(email=f"bench{i}@example.com", name=f"Bench {i}", password_hash="x") for i in range(n_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    db.session.bulk_insert_mappings(FCMToken, [
+        {"user_id": u.id, "token": f"tok-{u.id}-{k}"}
+        for u in users
+        for k in range(tokens_per_user)
+    ])
+    db.session.commit()
+    return [u.id for u in users]
+
+
+def per_user(user_ids, client):
+    """Old shape: load each user's tokens, one multicast per user."""
+    for uid in user_ids:
+        tokens = [t for (t,) in db.session.query(FCMToken.token).filter(FCMToken.user_id == uid).all()]
+        if tokens:
+            client.send_multicast(tokens, "Bench", "Per-user send", {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--tokens-per-user", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated FCM round trip")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        user_ids = seed(args.users, args.tokens_per_user)
+        latency = args.latency_ms / 1000.0
+
+        client = FakeFCMClient(latency_s=latency)
+        start = time.perf_counter()
+        per_user(user_ids, client)
+        t_old = time.perf_counter() - start
+        old_calls = client.calls
+
+        client = FakeFCMClient(latency_s=latency)
+        dispatcher = FCMDispatcher(db, FCMToken, client=client, max_workers=args.workers)
+        start = time.perf_counter()
+        result = dispatcher.send(user_ids, "Bench", "Batched send", {})
+        t_new = time.perf_counter() - start
+
+    tokens = args.users * args.tokens_per_user
+    print(f"users={args.users} tokens={tokens} latency={args.latency_ms:g}ms workers={args.workers}")
+    print(f"per-user:   {t_old:8.3f}s  {old_calls:6d} calls  {tokens / t_old:10,.0f} tokens/s")
+    print(f"dispatcher: {t_new:8.3f}s  {client.calls:6d} calls  {tokens / t_new:10,.0f} tokens/s"
+          f"  (success={result.success})")
+    print(f"speedup: {t_old / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
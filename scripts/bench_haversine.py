@@ -0,0 +1,65 @@
+"""Micro-benchmark: scalar haversine loop vs batched geo.distances_km.
+
+Run:
+    python scripts/bench_haversine.py
+    python scripts/bench_haversine.py --sizes 1000 100000 --repeat 5
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import geo
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    center_lat, center_lng = 23.8103, 90.4125  # Dhaka
+
+    print(f"numpy: {'yes (' + geo.np.__version__ + ')' if geo.np is not None else 'no (pure-Python fallback)'}")
+    print(f"{'points':>10} {'scalar s':>10} {'batch s':>10} {'scalar pts/s':>14} {'batch pts/s':>14} {'speedup':>8}")
+
+    for n in args.sizes:
+        lats = [center_lat + rng.uniform(-0.5, 0.5) for _ in range(n)]
+        lngs = [center_lng + rng.uniform(-0.5, 0.5) for _ in range(n)]
+
+        def scalar():
+            return [geo.haversine_km(center_lat, center_lng, a, b) for a, b in zip(lats, lngs)]
+
+        def batch():
+            return geo.distances_km(center_lat, center_lng, lats, lngs)
+
+        # Sanity check: both paths agree.
+        s, b = scalar(), batch()
+        worst = max(abs(x - float(y)) for x, y in zip(s[:1000], b[:1000]))
+        assert worst < 1e-6, f"scalar/batch mismatch: {worst}"
+
+        t_scalar = best_of(scalar, args.repeat)
+        t_batch = best_of(batch, args.repeat)
+        print(
+            f"{n:>10} {t_scalar:>10.4f} {t_batch:>10.4f} "
+            f"{n / t_scalar:>14,.0f} {n / t_batch:>14,.0f} {t_scalar / t_batch:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark: per-message serialize_message vs batched serialize_messages.
+
+Seeds a throwaway SQLite database with one conversation of N messages from
+a pool of senders (the app's own database is never touched), then
+serializes the whole list three ways and reports SQL statements and time:
+
+- per_message  the old serializer: two User lookups per message (the
+               looked-up users are not kept, so the identity map rarely helps)
+- batch_cold   serialize_messages with an empty sender-name cache
+- batch_warm   serialize_messages again (names cached)
+
+Run:
+    python scripts/bench_serialize_messages.py
+    python scripts/bench_serialize_messages.py --messages 10000 --senders 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_db_file = os.path.join(tempfile.mkdtemp(prefix="lifeline-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + _db_file
+os.environ.setdefault("JOB_WORKER_MODE", "off")
+
+from sqlalchemy import event, insert  # noqa: E402
+from sqlalchemy.exc import LegacyAPIWarning  # noqa: E402
+
+import app as lifeline  # noqa: E402
+from app import ChatMessage, Conversation, User, app, db  # noqa: E402
+
+
+def legacy_serialize_message(msg):
+    """serialize_message before batching (kept here for comparison)."""
+    warnings.simplefilter("ignore", LegacyAPIWarning)
+    return {
+        "id": msg.id,
+        "conversation_id": msg.conversation_id,
+        "sender_id": msg.sender_id,
+        "sender_name": (User.query.get(msg.sender_id).name if User.query.get(msg.sender_id) else None),
+        "text": msg.text,
+        "created_at": int(msg.created_at.timestamp()),
+        "delivered": bool(msg.delivered),
+        "read": bool(msg.read),
+        "language": msg.language,
+    }
+
+
+def seed(n_messages, n_senders):
+    db.create_all()
+    db.session.execute(insert(User), [
+        {"id": i, "email": f"bench{i}@example.com", "name": f"Sender {i}"} for i in range(1, n_senders + 1)
+    ])
+    conv = Conversation(user_a=1, user_b=2)
+    db.session.add(conv)
+    db.session.flush()
+    start = datetime.utcnow() - timedelta(days=365)
+    db.session.execute(insert(ChatMessage), [
+        {
+            "conversation_id": conv.id,
+            "sender_id": 1 + i % n_senders,
+            "text": f"message {i}",
+            "created_at": start + timedelta(minutes=i),
+            "read": True,
+        }
+        for i in range(n_messages)
+    ])
+    db.session.commit()
+    return conv.id
+
+
+def measure(label, conv_id, serialize):
+    # Fresh session, so the identity map starts empty like a new request.
+    db.session.remove()
+    msgs = ChatMessage.query.filter_by(conversation_id=conv_id).order_by(ChatMessage.id).all()
+
+    count = [0]
+
+    def on_execute(*args, **kwargs):
+        count[0] += 1
+
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    try:
+        with app.test_request_context("/"):
+            started = time.perf_counter()
+            payload = serialize(msgs)
+            elapsed = time.perf_counter() - started
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_execute)
+    print(f"{label:>12} {len(payload):>9} {count[0]:>9} {elapsed * 1000:>10.1f}")
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--senders", type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        conv_id = seed(args.messages, args.senders)
+        print(f"{args.messages} messages from {args.senders} senders")
+        print(f"{'serializer':>12} {'messages':>9} {'queries':>9} {'ms':>10}")
+        old = measure("per_message", conv_id, lambda msgs: [legacy_serialize_message(m) for m in msgs])
+        lifeline._user_name_cache.clear()
+        new = measure("batch_cold", conv_id, lifeline.serialize_messages)
+        measure("batch_warm", conv_id, lifeline.serialize_messages)
+
+        same = all(
+            {k: v for k, v in a.items() if v is not None} == b for a, b in zip(old, new)
+        )
+        print(f"payloads match: {same}")
+        db.session.remove()
+    os.remove(_db_file)
+
+
+if __name__ == "__main__":
+    main()
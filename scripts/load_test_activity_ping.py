@@ -0,0 +1,119 @@
+"""Load test for /api/activity/ping: one commit per ping vs the write-behind buffer.
+
+Drives the real endpoint through Flask test clients from several threads
+against a throwaway SQLite database, first with ACTIVITY_INGEST_MODE=sync,
+then buffered with the background flusher running, and reports sustained
+pings/sec plus the buffer's queue-depth and flush-latency metrics.
+
+Run:
+    python scripts/load_test_activity_ping.py
+    python scripts/load_test_activity_ping.py --users 200 --threads 8 --seconds 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_db_file = os.path.join(tempfile.mkdtemp(prefix="lifeline_load_"), "load.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ.setdefault("JOB_WORKER_MODE", "off")
+
+import app as lifeline  # noqa: E402
+from app import app, db, User, UserActivity  # noqa: E402
+
+
+def seed(n_users):
+    users = [User(email=f"load{i}@example.com", name=f"Load {i}", password_hash="x",
+                  lat=23.78, lng=90.40) for i in range(n_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [u.id for u in users]
+
+
+def run(mode, user_ids, threads, seconds):
+    lifeline.ACTIVITY_INGEST_MODE = mode
+    # The flusher is driven here with real threads instead of socketio.
+    lifeline._activity_flusher_started = True
+    ingestor = lifeline.activity_ingestor
+    stop_flusher = threading.Event()
+    flusher = None
+    if mode == "buffered":
+        flusher = threading.Thread(target=ingestor.run_forever, kwargs={"stop": stop_flusher}, daemon=True)
+        flusher.start()
+
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+    errors = [0] * threads
+
+    def worker(n):
+        clients = []
+        for uid in user_ids[n::threads]:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess["user_id"] = uid
+            clients.append(client)
+        i = 0
+        while time.perf_counter() < deadline:
+            client = clients[i % len(clients)]
+            resp = client.post("/api/activity/ping", json={
+                "lat": 23.78 + (i % 100) * 1e-4, "lng": 90.40, "activity_type": "ping", "device_motion": 35,
+            })
+            if resp.status_code in (201, 202):
+                counts[n] += 1
+            else:
+                errors[n] += 1
+            i += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    if flusher is not None:
+        stop_flusher.set()
+        flusher.join()
+
+    with app.app_context():
+        stored = UserActivity.query.count()
+    return sum(counts), sum(errors), elapsed, stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        user_ids = seed(args.users)
+
+    print(f"users={args.users} threads={args.threads} seconds={args.seconds:g} db={_db_file}")
+    results = {}
+    stored_before = 0
+    for mode in ("sync", "buffered"):
+        ok, errors, elapsed, stored = run(mode, user_ids, args.threads, args.seconds)
+        results[mode] = ok / elapsed
+        print(f"{mode:9s} {ok:7d} pings  {errors:4d} errors  {ok / elapsed:9,.0f} pings/s  "
+              f"(rows stored: {stored - stored_before})")
+        stored_before = stored
+
+    stats = lifeline.activity_ingestor.stats()
+    print(f"buffer: flushes={stats['flushes']} avg_flush={stats['avg_flush_ms']}ms "
+          f"max_flush={stats['max_flush_ms']}ms max_depth={stats['max_depth']} dropped={stats['dropped']}")
+    print(f"speedup: {results['buffered'] / results['sync']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
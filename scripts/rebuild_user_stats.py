@@ -0,0 +1,37 @@
+"""Rebuild the user_stats ledger from reviews and impact_log.
+
+The ledger is maintained with every Review / ImpactLog write; use this after
+bulk edits or to check it. Reviews are streamed once, ordered by helper, and
+the table is replaced in a single transaction.
+
+Run:
+    python scripts/rebuild_user_stats.py
+    python scripts/rebuild_user_stats.py --batch-size 5000 --scores
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import app, rebuild_user_stats, reconcile_user_scores  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows fetched / inserted per batch")
+    parser.add_argument("--scores", action="store_true", help="also re-check trust/kindness scores")
+    args = parser.parse_args()
+
+    with app.app_context():
+        result = rebuild_user_stats(batch_size=args.batch_size)
+        if args.scores:
+            result["scores"] = reconcile_user_scores()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
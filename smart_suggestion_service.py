@@ -13,10 +13,12 @@ import requests
 import os
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Optional
-from math import radians, cos, sin, asin, sqrt
 import json
 from collections import defaultdict
 
+import geo
+import geo_index
+
 # Environment variables for APIs
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 SUGGESTION_RADIUS_KM = float(os.getenv("SUGGESTION_RADIUS_KM", "5"))  # Default 5km radius
@@ -196,17 +198,7 @@ class LocationMatcher:
         on the earth (specified in decimal degrees)
         Returns distance in kilometers
         """
-        # Convert decimal degrees to radians
-        lat1_rad, lng1_rad = radians(lat1), radians(lng1)
-        lat2_rad, lng2_rad = radians(lat2), radians(lng2)
-        
-        # Haversine formula
-        dlat = lat2_rad - lat1_rad
-        dlng = lng2_rad - lng1_rad
-        a = sin(dlat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlng/2)**2
-        c = 2 * asin(sqrt(a))
-        r = 6371  # Radius of earth in kilometers
-        return c * r
+        return geo.haversine_km(lat1, lng1, lat2, lng2)
     
     @staticmethod
     def get_nearby_requests(
@@ -238,22 +230,30 @@ class LocationMatcher:
 
             if exclude_user_id is not None:
                 query = query.filter(Request.user_id != exclude_user_id)
-            
+
+            # Only rows that can be inside the radius. The shared index holds
+            # open requests only, so other statuses use the bounding box.
+            if status == "open" and not include_expired and not include_completed:
+                query = geo_index.filter_query(query, Request, "request", user_lat, user_lng, radius_km)
+            else:
+                min_lat, max_lat, min_lng, max_lng = geo.bounding_box(user_lat, user_lng, radius_km)
+                query = query.filter(Request.lat.between(min_lat, max_lat))
+                if min_lng is not None:
+                    query = query.filter(Request.lng.between(min_lng, max_lng))
+
             all_requests = query.all()
             
-            # Filter by distance
+            # Filter by distance (one batched computation for all candidates)
+            located = [r for r in all_requests if r.lat is not None and r.lng is not None]
+            distances = geo.distances_km(
+                user_lat, user_lng, [r.lat for r in located], [r.lng for r in located]
+            )
+
             nearby = []
-            for req in all_requests:
-                if req.lat is None or req.lng is None:
-                    continue
-                    
-                distance = LocationMatcher.haversine_distance(
-                    user_lat, user_lng, req.lat, req.lng
-                )
-                
+            for req, distance in zip(located, distances):
                 if distance <= radius_km:
                     req_dict = req.to_dict(include_user=True)
-                    req_dict["distance_km"] = round(distance, 2)
+                    req_dict["distance_km"] = round(float(distance), 2)
                     nearby.append(req_dict)
             
             # Sort by distance and limit
@@ -1,7 +1,7 @@
 (function () {
   // Explicitly use the current origin; improves reliability behind proxies (e.g., Render)
   const socket = io(window.location.origin, {
-    transports: ["websocket", "polling"],
+    transports: window.LIFELINE_SOCKET_TRANSPORTS || ["websocket", "polling"],
   });
   const messagesEl = document.getElementById("messages");
   const input = document.getElementById("message_input");
@@ -17,10 +17,14 @@
     CONVERSATION_ID
   );
 
+  let everConnected = false;
   socket.on("connect", () => {
     console.log("Socket connected:", socket.id);
     console.log("Emitting join to conversation", CONVERSATION_ID);
     socket.emit("join", { conversation_id: CONVERSATION_ID });
+    // new_message events sent while we were disconnected are lost
+    if (everConnected) loadMissedMessages();
+    everConnected = true;
   });
 
   socket.on("disconnect", () => {
@@ -76,16 +80,69 @@
     }
   }
 
-  function appendMessage(m) {
-    console.log("appendMessage called with:", {
-      id: m.id,
-      text: m.text?.substring(0, 50),
-      has_file_data: !!m.file_data,
-      file_name: m.file_name,
-      is_image: m.is_image,
-    });
+  function formatSize(bytes) {
+    if (!bytes && bytes !== 0) return "";
+    if (bytes < 1024) return bytes + " B";
+    if (bytes < 1024 * 1024) return (bytes / 1024).toFixed(1) + " KB";
+    return (bytes / (1024 * 1024)).toFixed(1) + " MB";
+  }
+
+  // Attachment block: {url, file_name, size, is_image}; url may be missing
+  // while the file is still uploading (progress shown instead).
+  function renderAttachment(att) {
+    if (att.url && att.is_image) {
+      const box = document.createElement("div");
+      box.className = "message-image-container";
+      const link = document.createElement("a");
+      link.href = att.url;
+      link.target = "_blank";
+      link.rel = "noopener";
+      const img = document.createElement("img");
+      img.className = "message-image";
+      img.src = att.url;
+      img.alt = att.file_name || "";
+      img.loading = "lazy";
+      img.addEventListener("load", () => scrollBottom(false));
+      link.appendChild(img);
+      box.appendChild(link);
+      return box;
+    }
 
-    // m: {id, conversation_id, sender_id, text, created_at, delivered, read}
+    const box = document.createElement(att.url ? "a" : "div");
+    box.className = "message-file-container";
+    if (att.url) box.href = att.url;
+    const icon = document.createElement("div");
+    icon.className = "message-file-icon";
+    icon.textContent = "📎";
+    const info = document.createElement("div");
+    info.className = "message-file-info";
+    const name = document.createElement("div");
+    name.className = "message-file-name";
+    name.textContent = att.file_name || "Attachment";
+    const size = document.createElement("div");
+    size.className = "message-file-size";
+    size.textContent =
+      att.progress !== undefined
+        ? "Uploading " + Math.round(att.progress * 100) + "%"
+        : formatSize(att.size);
+    info.appendChild(name);
+    info.appendChild(size);
+    box.appendChild(icon);
+    box.appendChild(info);
+    return box;
+  }
+
+  function setAttachment(el, att) {
+    const old = el.querySelector(".message-attachment");
+    const wrap = document.createElement("div");
+    wrap.className = "message-attachment";
+    wrap.appendChild(renderAttachment(att));
+    if (old) old.replaceWith(wrap);
+    else el.insertBefore(wrap, el.querySelector(".text"));
+  }
+
+  function buildMessage(m) {
+    // m: {id, conversation_id, sender_id, text, created_at, delivered, read, attachment}
     const div = document.createElement("div");
     const me = m.sender_id === CURRENT_USER_ID;
     div.className = "chat-message " + (me ? "sent" : "received");
@@ -108,6 +165,7 @@
     text.className = "text";
     text.textContent = m.text;
     div.appendChild(text);
+    if (m.attachment) setAttachment(div, m.attachment);
 
     // timestamp: show below the bubble
     const meta = document.createElement("div");
@@ -120,12 +178,77 @@
       meta.textContent = "";
     }
     div.appendChild(meta);
+    return div;
+  }
 
-    messagesEl.appendChild(div);
+  // History is paged by message id (/api/conversations/<id>/messages):
+  // the page renders the latest messages, older ones load on scroll-up and
+  // a reconnect fetches whatever arrived while the socket was down.
+  let oldestId = null;
+  let newestId = null;
+  let hasOlder = typeof HAS_MORE_MESSAGES !== "undefined" && !!HAS_MORE_MESSAGES;
+  let loadingOlder = false;
+
+  function trackId(id) {
+    if (typeof id !== "number") return;
+    if (oldestId === null || id < oldestId) oldestId = id;
+    if (newestId === null || id > newestId) newestId = id;
+  }
+
+  function appendMessage(m) {
+    trackId(m.id);
+    messagesEl.appendChild(buildMessage(m));
     // allow layout to settle before scrolling
     setTimeout(() => scrollBottom(false), 10);
   }
 
+  function loadOlderMessages() {
+    if (!hasOlder || loadingOlder || oldestId === null) return;
+    loadingOlder = true;
+    const container = messagesEl.parentElement;
+    fetch(
+      "/api/conversations/" + CONVERSATION_ID + "/messages?before_id=" + oldestId,
+      { credentials: "same-origin" }
+    )
+      .then((r) => (r.ok ? r.json() : Promise.reject(r.status)))
+      .then((page) => {
+        const fromBottom = container.scrollHeight - container.scrollTop;
+        const frag = document.createDocumentFragment();
+        page.messages.forEach((m) => {
+          trackId(m.id);
+          frag.appendChild(buildMessage(m));
+        });
+        messagesEl.insertBefore(frag, messagesEl.firstChild);
+        // keep the messages the user was looking at in place
+        container.scrollTop = container.scrollHeight - fromBottom;
+        hasOlder = page.has_more;
+      })
+      .catch((e) => console.log("Loading older messages failed:", e))
+      .finally(() => {
+        loadingOlder = false;
+      });
+  }
+
+  function loadMissedMessages() {
+    if (newestId === null) return;
+    fetch(
+      "/api/conversations/" + CONVERSATION_ID + "/messages?after_id=" + newestId,
+      { credentials: "same-origin" }
+    )
+      .then((r) => (r.ok ? r.json() : Promise.reject(r.status)))
+      .then((page) => {
+        page.messages.forEach((m) => {
+          if (!messagesEl.querySelector('[data-message-id="' + m.id + '"]')) appendMessage(m);
+        });
+        if (page.has_more) loadMissedMessages();
+      })
+      .catch((e) => console.log("Loading missed messages failed:", e));
+  }
+
+  messagesEl.parentElement.addEventListener("scroll", () => {
+    if (messagesEl.parentElement.scrollTop < 120) loadOlderMessages();
+  });
+
   // Preload messages if present
   if (typeof MESSAGES !== "undefined" && Array.isArray(MESSAGES)) {
     console.log("Preloading", MESSAGES.length, "messages");
@@ -145,6 +268,7 @@
         console.log("Found temp message, updating ID");
         // update dataset id
         tempEl.dataset.messageId = m.id;
+        trackId(m.id);
         // update timestamp/meta
         const metaEl = tempEl.querySelector(".meta");
         if (metaEl) {
@@ -154,10 +278,13 @@
             );
           } catch (e) {}
         }
+        if (m.attachment) setAttachment(tempEl, m.attachment);
         // ensure data is consistent
         return;
       }
     }
+    // Already shown (e.g. fetched after a reconnect)
+    if (messagesEl.querySelector('[data-message-id="' + m.id + '"]')) return;
     // For receivers or if temp not found, append the message
     console.log("Appending new message from broadcast");
     appendMessage(m);
@@ -288,6 +415,153 @@
     socket.emit("stop_typing", { conversation_id: CONVERSATION_ID });
   }
 
+  // ---------- Attachments ----------
+  // Files go over HTTP in chunks (resumable, deduplicated by SHA-256); the
+  // socket message only carries the attachment id.
+  const attachBtn = document.getElementById("attach-btn");
+  const attachInput = document.getElementById("attach-input");
+  const RESUME_PREFIX = "lifeline.upload.";
+  const MAX_HASH_BYTES = 64 * 1024 * 1024;
+
+  async function sha256Hex(file) {
+    if (!window.crypto || !crypto.subtle || file.size > MAX_HASH_BYTES) return null;
+    try {
+      const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+      return Array.from(new Uint8Array(digest))
+        .map((b) => b.toString(16).padStart(2, "0"))
+        .join("");
+    } catch (e) {
+      return null;
+    }
+  }
+
+  async function callApi(url, options) {
+    let res;
+    try {
+      res = await fetch(url, Object.assign({ credentials: "same-origin" }, options));
+    } catch (e) {
+      return { status: 0, body: {} };
+    }
+    const body = await res.json().catch(() => ({}));
+    return { status: res.status, body: body };
+  }
+
+  function jsonPost(url, payload) {
+    return callApi(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload),
+    });
+  }
+
+  async function uploadAttachment(file, onProgress) {
+    const sha256 = await sha256Hex(file);
+    const resumeKey =
+      RESUME_PREFIX + CONVERSATION_ID + ":" + (sha256 || [file.name, file.size, file.lastModified].join(":"));
+
+    // Resume an upload interrupted earlier (e.g. by a reload).
+    let state = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      const r = await callApi("/api/chat/attachments/" + savedId);
+      if (r.status === 200 && r.body.size === file.size) state = r.body;
+    }
+    if (!state) {
+      const r = await jsonPost("/api/chat/" + CONVERSATION_ID + "/attachments", {
+        file_name: file.name,
+        size: file.size,
+        content_type: file.type,
+        sha256: sha256,
+      });
+      if (r.status !== 201) throw new Error(r.body.error || "Upload failed");
+      state = r.body;
+      localStorage.setItem(resumeKey, state.attachment_id);
+    }
+
+    let offset = state.offset;
+    let failures = 0;
+    while (state.status !== "ready" && offset < file.size) {
+      onProgress(offset / file.size);
+      const r = await callApi(
+        "/api/chat/attachments/" + state.attachment_id + "?offset=" + offset,
+        {
+          method: "PUT",
+          headers: { "Content-Type": "application/octet-stream" },
+          body: file.slice(offset, offset + state.chunk_size),
+        }
+      );
+      if (r.status === 200) {
+        offset = r.body.offset;
+        failures = 0;
+        continue;
+      }
+      // 409 (and partial failures) tell us where the server is: continue from there.
+      if (typeof r.body.offset === "number") offset = r.body.offset;
+      if (r.status >= 400 && r.status < 500 && r.status !== 409) {
+        throw new Error(r.body.error || "Upload failed");
+      }
+      if (++failures > 5) throw new Error("Upload interrupted, try again to resume");
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+    }
+
+    if (state.status !== "ready") {
+      const r = await jsonPost("/api/chat/attachments/" + state.attachment_id + "/complete", {
+        sha256: sha256,
+      });
+      if (r.status !== 200) {
+        if (r.status === 422) localStorage.removeItem(resumeKey);
+        throw new Error(r.body.error || "Upload failed");
+      }
+      state = r.body;
+    }
+    localStorage.removeItem(resumeKey);
+    onProgress(1);
+    return state.attachment;
+  }
+
+  async function sendAttachment(file) {
+    const caption = input.value.trim();
+    input.value = "";
+    const tempMsg = {
+      id: "temp-" + Date.now(),
+      conversation_id: CONVERSATION_ID,
+      sender_id: CURRENT_USER_ID,
+      text: caption,
+      created_at: Math.floor(Date.now() / 1000),
+      attachment: { file_name: file.name, size: file.size, progress: 0 },
+    };
+    appendMessage(tempMsg);
+    setTimeout(() => scrollBottom(true), 30);
+    const tempEl = messagesEl.querySelector('[data-message-id="' + tempMsg.id + '"]');
+
+    try {
+      const attachment = await uploadAttachment(file, (progress) => {
+        if (tempEl) setAttachment(tempEl, { file_name: file.name, size: file.size, progress: progress });
+      });
+      socket.emit("send_message", {
+        conversation_id: CONVERSATION_ID,
+        text: caption,
+        attachment_id: attachment.id,
+        temp_id: tempMsg.id,
+      });
+    } catch (e) {
+      console.log("Attachment upload failed:", e);
+      if (tempEl) {
+        const sizeEl = tempEl.querySelector(".message-file-size");
+        if (sizeEl) sizeEl.textContent = e.message || "Upload failed";
+      }
+    }
+  }
+
+  if (attachBtn && attachInput) {
+    attachBtn.addEventListener("click", () => attachInput.click());
+    attachInput.addEventListener("change", () => {
+      const file = attachInput.files && attachInput.files[0];
+      attachInput.value = "";
+      if (file) sendAttachment(file);
+    });
+  }
+
   // Ensure we scroll smoothly on resize
   window.addEventListener("resize", () => {
     setTimeout(() => scrollBottom(false), 50);
@@ -1,6 +1,6 @@
 (function () {
   const socket = io(window.location.origin, {
-    transports: ["websocket", "polling"],
+    transports: window.LIFELINE_SOCKET_TRANSPORTS || ["websocket", "polling"],
   });
   console.log("chat_index.js loaded");
 
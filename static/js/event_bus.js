@@ -0,0 +1,131 @@
+// Client side of the server event bus (event_bus.py).
+//
+// One shared Socket.IO connection per tab. Pages subscribe to topics (and,
+// with a position, to the geo-cell rooms around it) and react to
+// "bus_event" messages instead of polling. Pollers registered with
+// LifelineBus.poll() only run while the socket is down.
+(function () {
+  if (window.LifelineBus) return;
+
+  const SOCKET_SRC = "https://cdn.socket.io/4.5.4/socket.io.min.js";
+
+  const handlers = {};
+  const reconnectFns = [];
+  const socketFns = [];
+  let socket = null;
+  let connected = false;
+  let everConnected = false;
+  let subscription = null;
+
+  function ensureSocketIO(ready) {
+    if (typeof window.io === "function") return ready();
+
+    const existing = document.querySelector('script[data-socketio="1"]');
+    if (existing) {
+      existing.addEventListener("load", ready, { once: true });
+      return;
+    }
+
+    const s = document.createElement("script");
+    s.src = SOCKET_SRC;
+    s.async = true;
+    s.dataset.socketio = "1";
+    s.addEventListener("load", ready, { once: true });
+    document.head.appendChild(s);
+  }
+
+  function dispatch(evt) {
+    if (!evt || !evt.type) return;
+    const fns = (handlers[evt.type] || []).concat(handlers["*"] || []);
+    fns.forEach((fn) => {
+      try {
+        fn(evt.data || {}, evt);
+      } catch (e) {
+        console.log("Bus handler error:", e);
+      }
+    });
+  }
+
+  function connect() {
+    if (socket) return;
+    ensureSocketIO(function () {
+      if (socket || typeof window.io !== "function") return;
+      socket = window.io(window.location.origin, {
+        transports: window.LIFELINE_SOCKET_TRANSPORTS || ["websocket", "polling"],
+      });
+
+      socket.on("connect", function () {
+        connected = true;
+        // Personal room (user_<id>) for logged-in users.
+        if (window.LIFELINE_CURRENT_USER_ID) socket.emit("join", {});
+        if (subscription) socket.emit("subscribe", subscription);
+        // Events may have been missed while disconnected: let pages resync.
+        if (everConnected) {
+          reconnectFns.forEach((fn) => {
+            try {
+              fn();
+            } catch (e) {}
+          });
+        }
+        everConnected = true;
+      });
+      socket.on("disconnect", function () {
+        connected = false;
+      });
+      socket.on("bus_event", dispatch);
+
+      socketFns.splice(0).forEach((fn) => fn(socket));
+    });
+  }
+
+  window.LifelineBus = {
+    // on("request.changed", fn) or on(["a", "b"], fn); "*" gets everything.
+    on(types, fn) {
+      (Array.isArray(types) ? types : [types]).forEach((t) => {
+        (handlers[t] = handlers[t] || []).push(fn);
+      });
+      connect();
+    },
+
+    // {topics: [...], lat?, lng?, radius_km?}; replaces the previous one.
+    subscribe(opts) {
+      const next = JSON.stringify(opts || {});
+      if (subscription && JSON.stringify(subscription) === next) return;
+      subscription = JSON.parse(next);
+      if (socket && connected) socket.emit("subscribe", subscription);
+      connect();
+    },
+
+    onReconnect(fn) {
+      reconnectFns.push(fn);
+    },
+
+    // Fallback polling: fn runs every `ms` only while the socket is down.
+    poll(fn, ms) {
+      connect();
+      return setInterval(function () {
+        if (!connected && !document.hidden) fn();
+      }, ms);
+    },
+
+    // Trailing-edge debounce for handlers of bursty events.
+    debounce(fn, ms) {
+      let timer = null;
+      return function () {
+        clearTimeout(timer);
+        timer = setTimeout(fn, ms);
+      };
+    },
+
+    isConnected() {
+      return connected;
+    },
+
+    // The shared socket, for code that listens to its own events.
+    withSocket(fn) {
+      if (socket) return fn(socket);
+      socketFns.push(fn);
+      connect();
+    },
+  };
+})();
@@ -1,28 +1,11 @@
 (function () {
   // Only run for logged-in users
   try {
-    if (!window.LIFELINE_CURRENT_USER_ID) return;
+    if (!window.LIFELINE_CURRENT_USER_ID || !window.LifelineBus) return;
   } catch (e) {
     return;
   }
 
-  function ensureSocketIO(ready) {
-    if (typeof window.io === "function") return ready();
-
-    const existing = document.querySelector('script[data-socketio="1"]');
-    if (existing) {
-      existing.addEventListener("load", ready, { once: true });
-      return;
-    }
-
-    const s = document.createElement("script");
-    s.src = "https://cdn.socket.io/4.5.4/socket.io.min.js";
-    s.async = true;
-    s.dataset.socketio = "1";
-    s.addEventListener("load", ready, { once: true });
-    document.head.appendChild(s);
-  }
-
   function setHomeChatBadge(count) {
     const el = document.getElementById("home-chat-unread-badge");
     if (!el) return;
@@ -54,18 +37,20 @@
     }
   }
 
-  ensureSocketIO(function () {
-    const socket = window.io(window.location.origin, {
-      transports: ["websocket", "polling"],
-    });
-
-    socket.on("connect", function () {
-      // Join personal room for count updates
-      try {
-        socket.emit("join", {});
-      } catch (e) {}
-    });
+  // chat messages send both notification_new and notification.created
+  const refreshNotifications = window.LifelineBus.debounce(function () {
+    try {
+      if (typeof window.lifelineFetchNotifications === "function") {
+        window.lifelineFetchNotifications();
+      } else if (typeof window.lifelineFetchNotificationCount === "function") {
+        window.lifelineFetchNotificationCount();
+      }
+    } catch (e) {}
+  }, 300);
 
+  // Shares the page's event bus socket (static/js/event_bus.js), which
+  // also joins the personal room on every (re)connect.
+  window.LifelineBus.withSocket(function (socket) {
     // Server sends authoritative counts so UI never lies.
     socket.on("counts_update", function (payload) {
       try {
@@ -79,16 +64,9 @@
     });
 
     // When a new notification arrives, refresh dropdown list instantly (if available)
-    socket.on("notification_new", function () {
-      try {
-        if (typeof window.lifelineFetchNotifications === "function") {
-          window.lifelineFetchNotifications();
-        } else if (
-          typeof window.lifelineFetchNotificationCount === "function"
-        ) {
-          window.lifelineFetchNotificationCount();
-        }
-      } catch (e) {}
-    });
+    socket.on("notification_new", refreshNotifications);
   });
+
+  window.LifelineBus.on("notification.created", refreshNotifications);
+  window.LifelineBus.onReconnect(refreshNotifications);
 })();
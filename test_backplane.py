@@ -0,0 +1,137 @@
+"""
+Tests for the Socket.IO backplane (backplane.py), shared presence
+(presence.py) and cross-worker sync (cluster.py) against the in-repo local
+broker. No app or database needed.
+
+Run:
+    python -m pytest -q test_backplane.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import backplane  # noqa: E402
+import cluster  # noqa: E402
+import presence  # noqa: E402
+
+
+def _broker():
+    return backplane.LocalBroker("127.0.0.1", 0).start()
+
+
+def _wait_for(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_publish_reaches_every_subscriber():
+    broker = _broker()
+    try:
+        received = {1: [], 2: []}
+        for n in received:
+            listener = backplane.BrokerClient(broker.url).listen("chan")
+            threading.Thread(target=lambda n=n, it=listener: [received[n].append(m) for m in it], daemon=True).start()
+        assert _wait_for(lambda: broker.state.subscribers.get("chan") and len(broker.state.subscribers["chan"]) == 2)
+
+        publisher = backplane.BrokerClient(broker.url)
+        msg = {"method": "emit", "event": "new_message", "room": "chat_7", "data": [{"text": "hi"}]}
+        assert publisher.publish("chan", msg) == 2
+        assert publisher.publish("other", {"x": 1}) == 0
+        assert _wait_for(lambda: received[1] == [msg] and received[2] == [msg])
+    finally:
+        broker.stop()
+
+
+def test_presence_is_shared_between_workers():
+    broker = _broker()
+    try:
+        w1 = presence.SharedPresence(backplane.BrokerClient(broker.url), worker_id="w1")
+        w2 = presence.SharedPresence(backplane.BrokerClient(broker.url), worker_id="w2")
+
+        w1.add("sid-a", 1)
+        w2.add("sid-b", 2)
+        w2.add("sid-b2", 2)
+        assert w1.online_among([1, 2, 3]) == {1, 2}
+        assert w2.is_online(1)
+
+        assert w2.remove("sid-b") == 2
+        assert w1.is_online(2)  # second socket still connected
+        assert w2.remove("sid-b2") == 2
+        assert not w1.is_online(2)
+        assert w2.remove("unknown") is None
+    finally:
+        broker.stop()
+
+
+def test_presence_of_a_dead_worker_expires():
+    broker = _broker()
+    try:
+        client = backplane.BrokerClient(broker.url)
+        client.presence_set([("dead/sid", 5)], ttl=0.2)
+        assert client.presence_online([5]) == {5}
+        time.sleep(0.3)
+        assert client.presence_online([5]) == set()
+    finally:
+        broker.stop()
+
+
+def test_presence_falls_back_to_local_view_without_broker():
+    broker = _broker()
+    url = broker.url
+    broker.stop()
+
+    registry = presence.SharedPresence(backplane.BrokerClient(url), worker_id="w1")
+    registry.add("sid-a", 1)
+    assert registry.online_among([1, 2]) == {1}
+    assert registry.remove("sid-a") == 1
+
+
+def test_cluster_orders_sequenced_messages_and_elects_one_leader():
+    broker = _broker()
+    try:
+        workers = [cluster.SharedCluster(backplane.BrokerClient(broker.url), "peers", worker_id=w) for w in ("w1", "w2")]
+        seen = {w.worker_id: [] for w in workers}
+        plain = {w.worker_id: [] for w in workers}
+        for w in workers:
+            w.on_sequenced("feed", lambda seq, data, w=w: seen[w.worker_id].append((seq, data)))
+            w.on("user.changed", lambda data, w=w: plain[w.worker_id].append(data))
+            threading.Thread(target=w.run, daemon=True).start()
+        assert all(w.wait_ready(3) for w in workers)
+
+        start = workers[0].current_seq("feed")
+        assert workers[1].current_seq("feed") == start
+        sent = [workers[i % 2].publish_sequenced("feed", {"n": i}) for i in range(6)]
+        assert sent == list(range(start + 1, start + 7))
+        expected = [(seq, {"n": i}) for i, seq in enumerate(sent)]
+        assert _wait_for(lambda: seen["w1"] == expected and seen["w2"] == expected)
+
+        # Plain messages skip the sender.
+        assert workers[0].publish("user.changed", {"id": 3})
+        assert _wait_for(lambda: plain["w2"] == [{"id": 3}])
+        assert plain["w1"] == []
+
+        assert workers[0].lead("ticker", ttl=0.2)
+        assert not workers[1].lead("ticker", ttl=0.2)
+        assert workers[0].lead("ticker", ttl=0.2)
+        time.sleep(0.3)
+        assert workers[1].lead("ticker", ttl=0.2)
+    finally:
+        broker.stop()
+
+
+def test_socketio_options():
+    assert backplane.socketio_options(None) == {}
+    assert backplane.socketio_options("redis://localhost:6379/0", channel="c") == {
+        "message_queue": "redis://localhost:6379/0", "channel": "c",
+    }
+    manager = backplane.socketio_options("local://127.0.0.1:6399")["client_manager"]
+    assert isinstance(manager, backplane.BrokerManager)
+    assert (manager.client.host, manager.client.port) == ("127.0.0.1", 6399)
@@ -0,0 +1,73 @@
+"""
+Tests for the in-memory spatial index (geo_index.py) against a throwaway
+in-memory SQLite table. No app needed.
+
+Run:
+    python -m pytest -q test_geo_index.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import Column, Float, Integer, create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import declarative_base  # noqa: E402
+
+import geo_index  # noqa: E402
+
+Base = declarative_base()
+KIND = "test-point"
+CENTER = (23.78, 90.40)
+
+
+class Point(Base):
+    __tablename__ = "points"
+    id = Column(Integer, primary_key=True)
+    lat = Column(Float)
+    lng = Column(Float)
+
+
+def _engine():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Point), [{"id": 1, "lat": CENTER[0], "lng": CENTER[1]}])
+    return engine
+
+
+def _loader(engine):
+    def load():
+        with engine.connect() as conn:
+            return conn.execute(select(Point.id, Point.lat, Point.lng)).all()
+    return load
+
+
+def _near_ids(conn):
+    q = geo_index.filter_query(select(Point.id), Point, KIND, CENTER[0], CENTER[1], 2.0)
+    return sorted(conn.execute(q).scalars())
+
+
+def test_row_written_by_another_process_is_found_unless_index_is_live():
+    engine = _engine()
+    live = {"value": False}
+    saved = geo_index.ENABLED, geo_index._live_check
+    geo_index.ENABLED = True
+    geo_index.set_live_check(lambda: live["value"])
+    geo_index.register_loader(KIND, _loader(engine))
+    try:
+        geo_index.ensure_loaded(KIND)
+        # Written straight to the table: no mapper event, no peer message.
+        with engine.begin() as conn:
+            conn.execute(insert(Point), [{"id": 2, "lat": CENTER[0] + 0.001, "lng": CENTER[1]}])
+
+        with engine.connect() as conn:
+            assert _near_ids(conn) == [1, 2]
+            # A live index is trusted as is: it narrows to the ids it holds.
+            live["value"] = True
+            assert _near_ids(conn) == [1]
+            geo_index.upsert(KIND, 2, CENTER[0] + 0.001, CENTER[1])
+            assert _near_ids(conn) == [1, 2]
+    finally:
+        geo_index.ENABLED, geo_index._live_check = saved
+        geo_index.invalidate(KIND)
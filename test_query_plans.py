@@ -0,0 +1,194 @@
+"""
+Query-plan regression test for the hot `requests` queries.
+
+Builds the schema from the models in a throwaway in-memory SQLite database
+(the app's own database is never touched), seeds a few thousand requests,
+runs ANALYZE, then checks with EXPLAIN QUERY PLAN that none of the queries
+behind need_help, can_help, list_requests, the nearby/search APIs, dashboard
+and api_home_summary falls back to a full scan of `requests`, that chat
+history pages are read straight off the (conversation_id, id) index, and
+that the chat inbox scans none of the tables it joins. The statements come
+from the same builders the views use (open_posts_select,
+filter_requests_near, chat_history_select, ...), so the checks follow any
+change to them.
+
+Run:
+    python -m pytest -q test_query_plans.py
+    python test_query_plans.py
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("JOB_WORKER_MODE", "off")
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+
+import app  # noqa: E402
+import geo  # noqa: E402
+import geo_index  # noqa: E402
+from app import db, ChatMessage, Conversation, Request, User  # noqa: E402
+
+N_USERS = 200
+N_REQUESTS = 5000
+N_MESSAGES = 20000
+CENTER = (23.78, 90.40)
+
+
+def _seed(engine):
+    db.metadata.create_all(engine)
+    rnd = random.Random(13)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i, "email": f"plan{i}@example.com", "name": f"Plan {i}"}
+            for i in range(1, N_USERS + 1)
+        ])
+        rows = []
+        for i in range(1, N_REQUESTS + 1):
+            status = rnd.choices(["open", "claimed", "closed"], weights=[15, 15, 70])[0]
+            created = now - timedelta(hours=rnd.uniform(0, 24 * 90))
+            lat = CENTER[0] + rnd.uniform(-1.0, 1.0)
+            lng = CENTER[1] + rnd.uniform(-1.0, 1.0)
+            rows.append({
+                "id": i,
+                "user_id": rnd.randint(1, N_USERS),
+                "helper_id": rnd.randint(1, N_USERS) if status != "open" else None,
+                "title": f"Request {i}",
+                "category": rnd.choice(["food", "medicine", "ride", "repair", "tutoring"]),
+                "is_offer": rnd.random() < 0.3,
+                "status": status,
+                "created_at": created,
+                "expires_at": created + timedelta(days=rnd.choice([1, 3, 7])),
+                "lat": lat,
+                "lng": lng,
+                # bulk inserts skip the mapper event that fills it
+                "geohash": geo.encode_geohash(lat, lng),
+            })
+        conn.execute(insert(Request), rows)
+        conn.execute(insert(Conversation), [
+            {"id": i, "user_a": i, "user_b": i + 1} for i in range(1, N_USERS)
+        ])
+        conn.execute(insert(ChatMessage), [
+            {"conversation_id": rnd.randint(1, N_USERS - 1), "sender_id": 1, "text": "hi",
+             "created_at": now, "read": rnd.random() < 0.9}
+            for _ in range(N_MESSAGES)
+        ])
+        # bulk inserts skip the mapper events that keep last_message_* current
+        conn.exec_driver_sql(
+            "UPDATE conversations SET last_message_id ="
+            " (SELECT MAX(id) FROM chat_messages m WHERE m.conversation_id = conversations.id)"
+        )
+        conn.exec_driver_sql("ANALYZE")
+
+
+def _hot_queries():
+    # The app's own builders, so the checks follow the statements the views run.
+    now = datetime.utcnow()
+    user_id = 7
+    return {
+        # need_help / can_help: open posts of one type, newest first, plus the sidebar
+        "need_help.posts": app.open_posts_select(now, is_offer=False).limit(50),
+        "can_help.posts": app.open_posts_select(now, is_offer=True).limit(50),
+        "need_help.total_need": app.posts_count_select(now, is_offer=False),
+        "need_help.total_offer": app.posts_count_select(now, is_offer=True),
+        "need_help.categories": app.category_counts_select(now),
+        # list_requests (mode=all and mode=need)
+        "list_requests.all": app.open_posts_select(now),
+        "list_requests.need": app.open_posts_select(now, is_offer=False),
+        # api_requests_nearby / api_list_requests (geohash fallback, see check_query_plans)
+        "api_requests_nearby": app.requests_nearby_select(
+            now, CENTER[0], CENTER[1], 3.0, created_after=now - timedelta(hours=1),
+        ),
+        "api_list_requests.near": app.requests_search_select(now, CENTER[0], CENTER[1], 5.0),
+        "api_list_requests.category": app.requests_search_select(now, category="food", include_offers=False),
+        # dashboard
+        "dashboard.my_posts": app.user_active_posts_select(user_id),
+        "dashboard.expired_candidates": app.user_expired_unanswered_candidates_select(user_id, now),
+        "dashboard.active_engagements": app.helper_engagements_select(user_id),
+        # api_home_summary
+        "api_home_summary.open_requests": app.open_requests_count_select(now),
+        "api_home_summary.matched_requests": app.matched_requests_count_select(),
+    }
+
+
+def _chat_page_queries():
+    # chat_history_page: latest, older (before_id), newer (after_id)
+    return {
+        "chat.latest": app.chat_history_select(7).limit(51),
+        "chat.before": app.chat_history_select(7, before_id=15000).limit(51),
+        "chat.after": app.chat_history_select(7, after_id=5000).limit(51),
+    }
+
+
+def _inbox_queries():
+    return {"chat.inbox": app.conversation_inbox_select(7).limit(51)}
+
+
+def _plan(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return [row[-1] for row in rows]
+
+
+def _full_scans(plan):
+    return [line for line in plan if line.startswith("SCAN requests")]
+
+
+def _unindexed_chat_page(plan):
+    # must walk ix_chat_messages_conv_id in order: no scan, no sort
+    return not any("ix_chat_messages_conv_id" in line for line in plan) or any(
+        "TEMP B-TREE" in line for line in plan
+    )
+
+
+def _inbox_scans(plan):
+    return [line for line in plan if line.startswith("SCAN ")]
+
+
+def check_query_plans():
+    engine = create_engine("sqlite://")
+    _seed(engine)
+    failures = {}
+    # Nearby queries: check the SQL fallback, not the in-memory index's id list.
+    geo_index_enabled, geo_index.ENABLED = geo_index.ENABLED, False
+    try:
+        with engine.connect() as conn:
+            _check(conn, failures)
+    finally:
+        geo_index.ENABLED = geo_index_enabled
+    return failures
+
+
+def _check(conn, failures):
+    for name, stmt in _hot_queries().items():
+        plan = _plan(conn, stmt)
+        if _full_scans(plan):
+            failures[name] = plan
+    for name, stmt in _chat_page_queries().items():
+        plan = _plan(conn, stmt)
+        if _unindexed_chat_page(plan):
+            failures[name] = plan
+    for name, stmt in _inbox_queries().items():
+        plan = _plan(conn, stmt)
+        if _inbox_scans(plan):
+            failures[name] = plan
+
+
+def test_hot_request_queries_use_indexes():
+    failures = check_query_plans()
+    assert not failures, "full scans / unindexed pages:\n" + "\n".join(
+        f"  {name}: {plan}" for name, plan in failures.items()
+    )
+
+
+if __name__ == "__main__":
+    failures = check_query_plans()
+    for name, plan in failures.items():
+        print(f"NO INDEX  {name}: {plan}")
+    print("OK" if not failures else f"{len(failures)} queries not using their index")
+    sys.exit(1 if failures else 0)
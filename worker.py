@@ -0,0 +1,51 @@
+"""Background job worker (see job_queue.py).
+
+Run:
+    python worker.py            # poll forever
+    python worker.py --once     # drain due jobs and exit
+    python worker.py --stats    # print queue stats and exit
+
+Set JOB_WORKER_MODE=external on the web process when running this
+separately, so jobs are only processed here (the Procfile does). Socket
+events emitted by jobs reach clients through SOCKETIO_MESSAGE_QUEUE; this
+process publishes to it without subscribing.
+
+This process does not listen for the web workers' index updates, so its
+proximity lookups (SOS rings, need-request alerts) query the lat/lng columns
+directly instead of going through the in-memory geo_index.
+"""
+import argparse
+import json
+import os
+
+# Before the app builds its SocketIO: emit-only, nothing is served here.
+os.environ.setdefault("SOCKETIO_WRITE_ONLY", "1")
+# No geo_index either (see above): it would go stale between reloads.
+os.environ.setdefault("GEO_INDEX_ENABLED", "0")
+
+from app import SOCKETIO_MESSAGE_QUEUE, app, job_queue  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LifeLine background job worker")
+    parser.add_argument("--once", action="store_true", help="process due jobs and exit")
+    parser.add_argument("--stats", action="store_true", help="print queue stats and exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        with app.app_context():
+            print(json.dumps(job_queue.stats(), indent=2))
+        return
+
+    if args.once:
+        ran = job_queue.run_pending(limit=10_000)
+        print(f"[JOBS] Processed {ran} jobs")
+        return
+
+    if not SOCKETIO_MESSAGE_QUEUE:
+        print("[JOBS] SOCKETIO_MESSAGE_QUEUE is not set: socket events from jobs reach no client")
+    job_queue.work_forever()
+
+
+if __name__ == "__main__":
+    main()